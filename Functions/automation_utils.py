@@ -20,8 +20,10 @@ sys.path.append(root_dir)
 import os
 import subprocess
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import Functions.utilities as u
+from Functions.manifest_utils import diff_manifests, hashes_to_verify, print_manifest_delta
 from Models.GoogleBucket import GoogleBucket
 import pandas as pd
 from Levenshtein import distance as levenshtein_distance
@@ -29,51 +31,123 @@ from Levenshtein import distance as levenshtein_distance
 cfg = u.read_config()
 
 
-def compare_folder_tabei_savio(folders, country, t, s):
-    print("  Fetching filesizes from Tabei:")
-    tabei_sizes = t.get_folder_total_sizes(folders)
-
-    print("  Fetching filesizes from Savio:")
-    savio_directory_mappings = s.convert_to_savio_folderpaths(folders, country)
-    savio_paths = [savio_path for _, savio_path in savio_directory_mappings]
-    savio_sizes = s.get_folder_total_sizes(savio_paths)
+def compare_folder_sizes(directory_mappings, source_sizes, destination_sizes):
+    """
+    Compares the total file sizes of mapped folders.
 
+    :param directory_mappings: List of tuples (source_folder, destination_folder)
+    :param source_sizes: Dictionary {source_folder: total size in bytes}
+    :param destination_sizes: Dictionary {destination_folder: total size in bytes}
+    :return: List of dictionaries describing the folders whose totals differ or are missing
+    """
     mismatched_folders = []
 
-    for tabei_key, savio_key in savio_directory_mappings:
-        tabei_size = tabei_sizes.get(tabei_key)
-        savio_size = savio_sizes.get(savio_key)
+    for source_key, destination_key in directory_mappings:
+        source_size = source_sizes.get(source_key)
+        destination_size = destination_sizes.get(destination_key)
 
-        # Comparing sizes with a tolerance of 0.1%
-        if tabei_size is not None and savio_size is not None:
-            size_difference = abs(tabei_size - savio_size)
-            allowed_difference = 0.001 * max(tabei_size, savio_size)  # 0.1% of the larger size
-
-            if size_difference > allowed_difference:
+        if source_size is not None and destination_size is not None:
+            # exact: a match lets the folder skip the file by file comparison
+            if source_size != destination_size:
                 mismatched_folders.append({
-                    "tabei_key": tabei_key,
-                    "tabei_size": tabei_size,
-                    "savio_key": savio_key,
-                    "savio_size": savio_size,
-                    "difference": size_difference
+                    "source_key": source_key,
+                    "source_size": source_size,
+                    "destination_key": destination_key,
+                    "destination_size": destination_size,
+                    "difference": abs(source_size - destination_size)
                 })
         else:
             mismatched_folders.append({
-                "tabei_key": tabei_key,
-                "savio_key": savio_key,
+                "source_key": source_key,
+                "destination_key": destination_key,
                 "issue": "Missing size information"
             })
 
     if mismatched_folders:
-        print("There are mismatched folders.")
-        return mismatched_folders
+        print(f"  {len(mismatched_folders)} of {len(directory_mappings)} folders differ in total size.")
     else:
-        print("All folder sizes match within tolerance.")
-        return []
+        print("  All folder sizes match.")
+    return mismatched_folders
+
+
+def compare_folder_tabei_savio(folders, country, t, s):
+    """
+    Compares the total size of the files of every folder between Tabei and Savio, with one batched du per machine.
+
+    :return: List of mismatched folders, see compare_folder_sizes
+    """
+    print("  Fetching filesizes from Tabei:")
+    tabei_sizes = t.get_folder_total_sizes(folders, exclude_directories=True)
+
+    print("  Fetching filesizes from Savio:")
+    savio_directory_mappings = s.convert_to_savio_folderpaths(folders, country)
+    savio_paths = [savio_path for _, savio_path in savio_directory_mappings]
+    savio_sizes = s.get_folder_total_sizes(savio_paths, exclude_directories=True)
+
+    return compare_folder_sizes(savio_directory_mappings, tabei_sizes, savio_sizes)
+
+
+def compare_manifests_tabei_savio(folders, country, t, s, verify_hashes=False):
+    """
+    Compares the folders file by file (name and size) between Tabei and Savio.
+    With verify_hashes the MD5 of every file present on both machines with the same size is compared as well,
+    computed in parallel on both machines.
+
+    Without verify_hashes, folders whose total file sizes already match (compare_folder_tabei_savio) are skipped.
+
+    :return: Delta dictionary with 'missing', 'changed' and 'extra' files, see diff_manifests
+    """
+    if not verify_hashes:
+        mismatched_folders = {m['source_key'] for m in compare_folder_tabei_savio(folders, country, t, s)}
+        folders = [folder for folder in folders if folder in mismatched_folders]
+        if not folders:
+            delta = diff_manifests({}, {}, [])
+            print_manifest_delta(delta)
+            return delta
+
+    print("  Fetching file manifest from Tabei:")
+    tabei_manifest = t.get_manifest(folders)
+
+    print("  Fetching file manifest from Savio:")
+    savio_directory_mappings = s.convert_to_savio_folderpaths(folders, country)
+    savio_manifest = s.get_manifest([savio_path for _, savio_path in savio_directory_mappings])
 
+    if verify_hashes:
+        print("  Hashing files on Tabei and Savio:")
+        tabei_hashes, savio_hashes = hashes_to_verify(tabei_manifest, savio_manifest, savio_directory_mappings)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tabei_future = executor.submit(t.add_hashes, tabei_manifest, tabei_hashes)
+            savio_future = executor.submit(s.add_hashes, savio_manifest, savio_hashes)
+            tabei_future.result()
+            savio_future.result()
 
+    delta = diff_manifests(tabei_manifest, savio_manifest, savio_directory_mappings, compare_hash=verify_hashes)
+    print_manifest_delta(delta)
+    return delta
 
-def upload_images_savio(contract_alias, folders, country, pwd, t, s):
+
+def write_upload_list(contract_alias, file_pairs, t):
+    """
+    Writes the files to upload into a text file and places it on Tabei, since the list can be far
+    too long to pass on the command line. Each line is "<Tabei path>\t<destination path>", so that
+    files in subfolders keep their place below the image folder.
+
+    :param file_pairs: List of tuples (tabei_path, destination_path), e.g. from the manifest delta
+    :return: Path of the list on Tabei
+    """
+    local_fp = os.path.join(root_dir, "Files", "upload_lists", f"{contract_alias}_upload.txt")
+    os.makedirs(os.path.dirname(local_fp), exist_ok=True)
+    with open(local_fp, 'w') as f:
+        f.write("\n".join(f"{tabei_fp}\t{destination_fp}" for tabei_fp, destination_fp in file_pairs) + "\n")
+
+    remote_dir = os.path.join(cfg['tabei']['stitching-services'], "Files", "upload_lists")
+    remote_fp = os.path.join(remote_dir, os.path.basename(local_fp))
+    t.makedirs(remote_dir)
+    t.upload_files_sftp([local_fp], [remote_fp])
+    return remote_fp
+
+
+def upload_images_savio(contract_alias, folders, country, pwd, t, s, verify_hashes=False):
 
     tmux_name = f"{contract_alias}_upload"  # set the tmux name
     
@@ -84,22 +158,22 @@ def upload_images_savio(contract_alias, folders, country, pwd, t, s):
             return "Upload is still ongoing. Please wait until complete."
             # print("Upload is still ongoing. Please wait until complete.")
 
-    # if there is no tmux session, we do filesize comparisons to verify correct upload
-    mismatched_folders_detailed = compare_folder_tabei_savio(folders, country, t, s)
-    mismatched_folders = [x['tabei_key'] for x in mismatched_folders_detailed]
+    # if there is no tmux session, we compare the file manifests and upload only the missing and changed files
+    delta = compare_manifests_tabei_savio(folders, country, t, s, verify_hashes)
+    upload_pairs = delta['missing'] + delta['changed']
 
-    if len(mismatched_folders) > 0:
+    if len(upload_pairs) > 0:
         # prepare the tmux upload command
         env_interpreter = os.path.join(cfg['tabei']['conda_env'], "bin", "python")
         stitch_env = "/home/jeffrey.clark/miniconda3/envs/stitch-service/bin/python3.11"
 
         cmd_path = os.path.join(cfg['tabei']['stitching-services'], "Tabei/upload_folders.py") 
-        folder_string = " ".join(mismatched_folders)
+        files_list = write_upload_list(contract_alias, upload_pairs, t)
         set_password = f"export SAVIO_DECRYPTION_PASSWORD={pwd}"  # need to send the password for SavioClient decryption.
 
         update_status_command = f"{stitch_env} {cfg['tabei']['stitching-services']}/Local/update_status.py --machine savio --username {cfg['savio']['username']} --country {country} --contract_alias {contract_alias} --column image_upload --value Done"
 
-        command = f"{set_password} && {env_interpreter} {cmd_path} --paths {folder_string} --country {country} --destination Savio && {update_status_command}"
+        command = f"{set_password} && {env_interpreter} {cmd_path} --files_list {files_list} --country {country} --destination Savio && {update_status_command}"
 
         # send the command to upload
         t.send_tmux_command(f"{contract_alias}_upload", command)
@@ -110,51 +184,62 @@ def upload_images_savio(contract_alias, folders, country, pwd, t, s):
 
 
 
+
+
+
 def compare_folder_tabei_bucket(folders, country, t, b):
+    """
+    Compares the total size of the files of every folder between Tabei and the Google Bucket, with one batched
+    du on Tabei and one streamed listing of the bucket.
+
+    :return: List of mismatched folders, see compare_folder_sizes
+    """
     print("  Fetching filesizes from Tabei:")
-    tabei_sizes = t.get_folder_total_sizes(folders)
+    tabei_sizes = t.get_folder_total_sizes(folders, exclude_directories=True)
 
     print("  Fetching filesizes from Google Bucket:")
     bucket_directory_mappings = b.convert_to_bucket_paths(folders, country)
     bucket_paths = [bucket_path for _, bucket_path in bucket_directory_mappings]
     bucket_sizes = b.get_bucket_folders_total_sizes(bucket_paths)
 
-    mismatched_folders = []
+    return compare_folder_sizes(bucket_directory_mappings, tabei_sizes, bucket_sizes)
 
-    for tabei_key, bucket_key in bucket_directory_mappings:
-        tabei_size = tabei_sizes.get(tabei_key)
-        bucket_size = bucket_sizes.get(bucket_key)
 
-        # Comparing sizes with a tolerance of 0.1%
-        if tabei_size is not None and bucket_size is not None:
-            size_difference = abs(tabei_size - bucket_size)
-            allowed_difference = 0.001 * max(tabei_size, bucket_size)  # 0.1% of the larger size
+def compare_manifests_tabei_bucket(folders, country, t, b, verify_hashes=False):
+    """
+    Compares the folders file by file (name and size) between Tabei and the Google Bucket.
+    With verify_hashes the MD5 of every file on Tabei is compared with the MD5 stored by GCS.
+    Without verify_hashes, folders whose total file sizes already match (compare_folder_tabei_bucket) are skipped.
 
-            if size_difference > allowed_difference:
-                mismatched_folders.append({
-                    "tabei_key": tabei_key,
-                    "tabei_size": tabei_size,
-                    "bucket_key": bucket_key,
-                    "bucket_size": bucket_size,
-                    "difference": size_difference
-                })
-        else:
-            mismatched_folders.append({
-                "tabei_key": tabei_key,
-                "bucket_key": bucket_key,
-                "issue": "Missing size information"
-            })
+    :return: Delta dictionary with 'missing', 'changed' and 'extra' files, see diff_manifests
+    """
+    if not verify_hashes:
+        mismatched_folders = {m['source_key'] for m in compare_folder_tabei_bucket(folders, country, t, b)}
+        folders = [folder for folder in folders if folder in mismatched_folders]
+        if not folders:
+            delta = diff_manifests({}, {}, [])
+            print_manifest_delta(delta)
+            return delta
 
-    if mismatched_folders:
-        print("There are mismatched folders.")
-        return mismatched_folders
-    else:
-        print("All folder sizes match within tolerance.")
-        return []
+    print("  Fetching file manifest from Tabei:")
+    tabei_manifest = t.get_manifest(folders)
 
+    print("  Fetching file manifest from Google Bucket:")
+    bucket_directory_mappings = b.convert_to_bucket_paths(folders, country)
+    bucket_manifest = b.get_bucket_manifest([bucket_path for _, bucket_path in bucket_directory_mappings], with_hashes=verify_hashes)
+
+    if verify_hashes:
+        # only the files already in the bucket, with the hash GCS keeps for each object
+        print("  Hashing files on Tabei:")
+        tabei_hashes, _ = hashes_to_verify(tabei_manifest, bucket_manifest, bucket_directory_mappings)
+        t.add_hashes(tabei_manifest, tabei_hashes)
+
+    delta = diff_manifests(tabei_manifest, bucket_manifest, bucket_directory_mappings, compare_hash=verify_hashes)
+    print_manifest_delta(delta)
+    return delta
 
 
-def upload_images_bucket(contract_alias, folders, country, pwd, t, b, workers):
+def upload_images_bucket(contract_alias, folders, country, pwd, t, b, workers, verify_hashes=False):
 
     tmux_name = f"{contract_alias}_upload"  # set the tmux name
     
@@ -165,26 +250,22 @@ def upload_images_bucket(contract_alias, folders, country, pwd, t, b, workers):
             return "Upload is still ongoing. Please wait until complete."
             # print("Upload is still ongoing. Please wait until complete.")
 
-    # if there is no tmux session, we do filesize comparisons to verify correct upload
-    mismatched_folders_detailed = compare_folder_tabei_bucket(folders, country, t, b)
-    
-    print("DETAILS:",mismatched_folders_detailed)
-
-    mismatched_folders = [x['tabei_key'] for x in mismatched_folders_detailed]
+    # if there is no tmux session, we compare the file manifests and upload only the missing and changed files
+    delta = compare_manifests_tabei_bucket(folders, country, t, b, verify_hashes)
+    upload_pairs = delta['missing'] + delta['changed']
 
-    # Delete folders where there are discrpancies Something must have gone wrong
-    # too_big = [x for x in mismatched_folders_detailed if int(x['tabei_size']) < int(x['bucket_size'])]
-    if len(mismatched_folders_detailed) > 0:
-        b.delete_from_bucket([x['bucket_key'] for x in mismatched_folders_detailed])
+    # Delete objects that do not exist on Tabei. Something must have gone wrong
+    if len(delta['extra']) > 0:
+        b.delete_from_bucket(delta['extra'])
 
-    if len(mismatched_folders) > 0:
+    if len(upload_pairs) > 0:
         # prepare the tmux upload command
         env_interpreter = os.path.join(cfg['tabei']['conda_env'], "bin", "python")
         cmd_path_upload = os.path.join(cfg['tabei']['stitching-services'], "Tabei/upload_folders.py")
         cmd_path_update = os.path.join(cfg['tabei']['stitching-services'], "Local/update_status.py") 
-        folder_string = " ".join(mismatched_folders)
+        files_list = write_upload_list(contract_alias, upload_pairs, t)
         set_password = f"export SAVIO_DECRYPTION_PASSWORD={pwd}"  # need to send the password for SavioClient decryption.
-        upload_command = f"{env_interpreter} {cmd_path_upload} --paths {folder_string} --country {country} --destination Bucket --workers {workers}"
+        upload_command = f"{env_interpreter} {cmd_path_upload} --files_list {files_list} --country {country} --destination Bucket --workers {workers}"
         update_status_command = f"{env_interpreter} {cmd_path_update}  --machine google_vm --username {cfg['google_vm']['username']} --country {country} --contract_alias {contract_alias} --column image_upload --value Done"
         command = f"{set_password} && {upload_command} && {update_status_command}"
 
@@ -2,6 +2,9 @@ import os
 import Functions.utilities as u
 import yaml
 import json
+import copy
+from collections.abc import Mapping
+from types import MappingProxyType
 
 # read the config file here
 cfg = u.read_config()
@@ -36,6 +39,93 @@ def deserialize_from_google_sheet(data):
     except (json.JSONDecodeError, TypeError):
         return data
 
+def is_symlink_active(symlink_setting):
+    """
+    Returns True when the 'symlink' config value turns symlinked image folders on.
+    """
+    return symlink_setting not in ["", None, False, "false"]
+
+
+def parse_keep_clusters(keep_clusters):
+    """
+    Parses the 'keep_clusters' config value, a comma separated string of cluster ids, into a list of integers.
+    """
+    if isinstance(keep_clusters, bool) or keep_clusters in ["", None]:
+        raise ValueError("Cluster ids in config sheet 'keep_clusters' is not correctly specified. Make sure it is a comma separated string of integers, indicating clusters to keep")
+    if isinstance(keep_clusters, int):
+        return [keep_clusters]  # a single id is deserialized as a number
+    try:
+        if isinstance(keep_clusters, list):
+            return [int(x) for x in keep_clusters]
+        return [int(x.strip()) for x in keep_clusters.split(",")]
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("Cluster ids in config sheet 'keep_clusters' is not correctly specified. Make sure it is a comma separated string of integers, indicating clusters to keep")
+
+
+class ContractConfig(Mapping):
+    """
+    Read-only configuration of a contract from the config sheet, deserialized once.
+
+    Looks up like the dict returned by ConfigSheet.get_config before, and carries the derived
+    settings `symlink_active` and `keep_clusters`. Nested values (e.g. cropping_parameters) are returned
+    as copies, so changing them does not change the config. Use to_dict() for a mutable copy.
+    """
+    def __init__(self, contract_name, machine, data):
+        object.__setattr__(self, '_data', MappingProxyType(copy.deepcopy(dict(data))))
+        object.__setattr__(self, 'contract_name', contract_name)
+        object.__setattr__(self, 'machine', machine)
+        object.__setattr__(self, 'symlink_active', is_symlink_active(data.get('symlink', None)))
+        try:
+            keep_clusters, keep_clusters_error = parse_keep_clusters(data.get('keep_clusters', None)), None
+        except ValueError as e:
+            keep_clusters, keep_clusters_error = None, e
+        object.__setattr__(self, '_keep_clusters', keep_clusters)
+        object.__setattr__(self, '_keep_clusters_error', keep_clusters_error)
+
+    @classmethod
+    def from_sheet_row(cls, contract_name, machine, column_headers, contract_data):
+        """
+        Builds the config from the header row and the contract row of the config sheet.
+        """
+        # Deserialize and convert row data to a dictionary
+        config_data = {}
+        for i, key in enumerate(column_headers):
+            try:
+                value = deserialize_from_google_sheet(contract_data[i])
+            except:
+                value = None
+            # Explicitly convert 'True'/'False' strings to boolean values
+            if value == 'True':
+                value = True
+            elif value == 'False':
+                value = False
+            config_data[key] = value
+        return cls(contract_name, machine, config_data)
+
+    @property
+    def keep_clusters(self):
+        """List of the cluster ids to keep, raises ValueError when 'keep_clusters' is not set correctly."""
+        if self._keep_clusters_error is not None:
+            raise self._keep_clusters_error
+        return list(self._keep_clusters)
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ContractConfig is read-only, use to_dict() for a mutable copy")
+
+    def to_dict(self):
+        return copy.deepcopy(dict(self._data))
+
+
 def generate_default_config_data(df, machine):
 
     if 'path' in df:
@@ -235,8 +325,7 @@ def export_config_file(contract_status, country, config_data, machine_name):
     contract_alias = status['contract_name']
     symlink_folders = contract_status.load_symlinks(machine_name)
 
-    symlink_setting = config_data.get('symlink', None)
-    symlink_active = symlink_setting not in ["", None, False, "false"]
+    symlink_active = is_symlink_active(config_data.get('symlink', None))
 
     paths = cfg[machine_name.lower()]
 
@@ -1,29 +1,200 @@
 
+import os
+import json
+import hashlib
 import numpy as np
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from shapely.geometry import Polygon
 from rasterio.features import rasterize
 import rasterio
 
 
 
-def load_img(file):
+def read_luminance(raw_ds, out_shape=None, band_mode='mean', window=None):
+    """
+    Reads an open raster as a single band. Multiband images are averaged band by band in an integer
+    accumulator, which gives the same values as averaging in float64 and truncating to uint8, or only
+    the first band is read with band_mode='first' (scans stored as RGB have three identical bands).
+
+    :param raw_ds: Open rasterio dataset
+    :param out_shape: Tuple (rows, cols) to read at a reduced resolution, None for the full resolution
+    :param band_mode: 'mean' or 'first'
+    :param window: rasterio Window to read, None for the whole image
+    :return: 2D array
+    """
+    if raw_ds.count == 1 or band_mode == 'first':
+        return raw_ds.read(1, out_shape=out_shape, window=window)
+    if band_mode != 'mean':
+        raise ValueError(f"Unknown band_mode '{band_mode}'. Expected 'mean' or 'first'.")
+
+    if raw_ds.dtypes[0] != 'uint8':
+        img = raw_ds.read(out_shape=None if out_shape is None else (raw_ds.count,) + tuple(out_shape), window=window).mean(0)
+        return img.astype(np.uint8)
+
+    acc = None
+    for band in range(1, raw_ds.count + 1):
+        data = raw_ds.read(band, out_shape=out_shape, window=window)
+        if acc is None:
+            acc = data.astype(np.uint16)
+        else:
+            acc += data
+    return (acc // raw_ds.count).astype(np.uint8)
+
+
+def decimated_shape(shape, decimation):
+    return max(1, shape[0] // decimation), max(1, shape[1] // decimation)
+
+
+def load_img(file, decimation=1, band_mode='mean'):
+    """
+    Loads an image as a single band.
+
+    With decimation > 1 the image is read at 1/decimation of its resolution: GDAL reads from the internal
+    overviews when the file has them, and otherwise samples every decimation-th pixel (nearest neighbour,
+    which keeps the pixel-to-pixel contrast that calculate_box thresholds on) without reading the full band.
+
+    :param file: Path of the image
+    :param decimation: Reduction factor of both dimensions
+    :param band_mode: 'mean' or 'first', see read_luminance
+    """
     with warnings.catch_warnings():
         warnings.simplefilter(action='ignore', category=rasterio.errors.NotGeoreferencedWarning)
         with rasterio.open(file) as raw_ds:
-            if raw_ds.count > 1:
-                img = raw_ds.read().mean(0)  # Average across bands if multiple bands
-                img = img.astype(np.uint8)  # Convert from float64 to uint8
-            else:
-                img = raw_ds.read(1)  # Read the first band
+            out_shape = None if decimation == 1 else decimated_shape(raw_ds.shape, decimation)
+            img = read_luminance(raw_ds, out_shape=out_shape, band_mode=band_mode)
 
         return img
-    
+
+
+def decimation_tolerance(img_shape, full_shape):
+    """
+    Pixels by which the bounds of calculate_box_decimated may differ from calculate_box on the full image:
+    one decimated pixel, ceil(full / decimated size) of the larger axis. The sampling alone accounts for at
+    most half of it (see scale_box), the rest covers threshold crossings moved by the rows and columns
+    that the decimated read skips.
+    """
+    return max(int(np.ceil(full_shape[0] / img_shape[0])), int(np.ceil(full_shape[1] / img_shape[1])))
+
+
+def _bound_kinds(starting_from, mode):
+    """
+    How a (min, max) bound of box_from_profiles relates to the edge: 'first' is the first index past it
+    and 'last' the last index before it, 'between' is a difference index between two samples.
+    """
+    if mode == 'differences':
+        return 'between', 'between'
+    return ('first', 'last') if starting_from == 'side' else ('last', 'first')
+
+
+def _scale_bounds(k, n, full, kind, zero_is_edge=True):
+    """
+    Maps decimated indices k (scalar or array) to full resolution.
+
+    The decimated pixel k is the full resolution pixel floor((k + 0.5) * scale) (nearest neighbour samples
+    pixel centers), so the full resolution bound lies between two consecutive samples, and the middle of
+    that gap is returned. 0 and n are also the values box_from_profiles falls back to (no cropping on that
+    side) and map to 0 and full; for 'last' bounds zero_is_edge tells a fallback 0 from a genuine index 0.
+    """
+    k = np.asarray(k, dtype=np.int64)
+    if n == full:
+        return k.copy()
+    scale = full / n
+
+    def sample(i):
+        return np.floor((i + 0.5) * scale).astype(np.int64)
+
+    if kind == 'first':
+        # the edge is in (sample k-1, sample k]
+        est = np.where(k <= 0, 0, np.where(k >= n, full, np.rint((sample(k - 1) + 1 + sample(k)) / 2)))
+    elif kind == 'last':
+        # the edge is in [sample k, sample k+1)
+        end = np.where(k + 1 < n, sample(k + 1) - 1, full - 1)
+        est = np.where(k >= n, full, np.rint((sample(k) + end) / 2))
+        est = np.where((k == 0) & np.asarray(zero_is_edge), 0, est)
+    elif kind == 'between':
+        # the difference between samples k and k+1 is one of the full resolution differences in between
+        est = np.where(k <= 0, 0, np.where(k >= n, full, np.rint((sample(k) + sample(k + 1) - 1) / 2)))
+    else:
+        raise ValueError(f"Unknown bound kind '{kind}'.")
+    return est.astype(np.int64)
+
+
+def scale_box(box, img_shape, full_shape, starting_from='side', mode='levels', profiles=None, threshold=20):
+    """
+    Scales box bounds (xmin, xmax, ymin, ymax) computed on a decimated image back to the full resolution.
+
+    For mode='levels' the result is within half a decimated pixel of calculate_box on the full image when the
+    decimated profiles cross the threshold at the same samples as the full ones, see decimation_tolerance.
+
+    :param starting_from: cropping origin the box was computed with
+    :param mode: cropping mode the box was computed with
+    :param profiles: Tuple (std_x, std_y) of the decimated image, needed to tell a genuine index 0 from the
+                     fallback with starting_from='center'
+    :param threshold: Threshold the box was computed with
+    """
+    xmin, xmax, ymin, ymax = box
+    kind_min, kind_max = _bound_kinds(starting_from, mode)
+    zero_x = zero_y = True
+    if profiles is not None and mode != 'differences' and starting_from == 'center':
+        zero_x = not profiles[0][0] < threshold
+        zero_y = not profiles[1][0] < threshold
+    return (int(_scale_bounds(xmin, img_shape[1], full_shape[1], kind_min, zero_x)),
+            int(_scale_bounds(xmax, img_shape[1], full_shape[1], kind_max)),
+            int(_scale_bounds(ymin, img_shape[0], full_shape[0], kind_min, zero_y)),
+            int(_scale_bounds(ymax, img_shape[0], full_shape[0], kind_max)))
+
+
+def calculate_box_decimated(file, decimation=8, band_mode='mean', threshold=20, starting_from='side', mode='levels'):
+    """
+    Computes the crop box of an image from a decimated read and returns it in full resolution coordinates.
+
+    The bounds are within decimation_tolerance pixels (about decimation) of the ones calculate_box finds on
+    the full image, while the memory used is about 1/decimation**2 of a full read. check_decimated_box
+    compares both for an image.
+
+    :return: Tuple (xmin, xmax, ymin, ymax) in full resolution pixels
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter(action='ignore', category=rasterio.errors.NotGeoreferencedWarning)
+        with rasterio.open(file) as raw_ds:
+            full_shape = raw_ds.shape
+            img = read_luminance(raw_ds, out_shape=decimated_shape(full_shape, decimation), band_mode=band_mode)
+
+    std_x, std_y = np.std(img, axis=0), np.std(img, axis=1)
+    box = box_from_profiles(std_x, std_y, img.shape, threshold=threshold, starting_from=starting_from, mode=mode)
+    return scale_box(box, img.shape, full_shape, starting_from, mode, (std_x, std_y), threshold)
+
+
+def check_decimated_box(file, decimation=8, band_mode='mean', threshold=20, starting_from='side', mode='levels'):
+    """
+    Compares calculate_box_decimated with the full resolution result of an image (computed by streaming).
+
+    :return: Dictionary with 'full' and 'decimated' boxes, 'errors' per bound, 'tolerance' and 'within_tolerance'
+    """
+    with rasterio.open(file) as raw_ds:
+        full_shape = raw_ds.shape
+    full_box = calculate_box_streaming(file, band_mode, threshold, starting_from, mode)
+    decimated_box = calculate_box_decimated(file, decimation, band_mode, threshold, starting_from, mode)
+    errors = [abs(int(a) - int(b)) for a, b in zip(full_box, decimated_box)]
+    tolerance = decimation_tolerance(decimated_shape(full_shape, decimation), full_shape)
+    return {'full': tuple(int(v) for v in full_box), 'decimated': decimated_box, 'errors': errors,
+            'tolerance': tolerance, 'within_tolerance': max(errors) <= tolerance}
+
 
 def calculate_box(img, threshold=20, starting_from='side', mode='levels'):
     std_x = np.std(img, axis=0)
     std_y = np.std(img, axis=1)
-    
+    return box_from_profiles(std_x, std_y, img.shape, threshold=threshold, starting_from=starting_from, mode=mode)
+
+
+def box_from_profiles(std_x, std_y, img_shape, threshold=20, starting_from='side', mode='levels'):
+    """
+    Finds the crop box from the column (std_x) and row (std_y) standard deviation profiles of an image.
+
+    :return: Tuple (xmin, xmax, ymin, ymax)
+    """
     if mode=='differences':
         diff_x = np.diff(std_x)
         
@@ -44,7 +215,7 @@ def calculate_box(img, threshold=20, starting_from='side', mode='levels'):
         bottom = diff_y.copy()
         bottom[:int(len(bottom)/2)] = 0
         ymax = np.argmin(bottom)
-    
+
     else:
         if starting_from == 'side':
             above_threshold_x = np.argwhere(std_x > threshold)
@@ -54,14 +225,14 @@ def calculate_box(img, threshold=20, starting_from='side', mode='levels'):
                 xmax = above_threshold_x[-1][0]
             else:
                 xmin = 0
-                xmax = img.shape[1]
+                xmax = img_shape[1]
 
             if len(above_threshold_y)>0:
                 ymin = above_threshold_y[0][0]
                 ymax = above_threshold_y[-1][0]
             else:
                 ymin = 0
-                ymax = img.shape[0]
+                ymax = img_shape[0]
 
 
         elif starting_from == 'center':
@@ -75,30 +246,73 @@ def calculate_box(img, threshold=20, starting_from='side', mode='levels'):
             below_y = np.argwhere((std_y < threshold) & (idx_y > len(std_y)/2))
 
             xmin = left_x[-1][0] if len(left_x)>0 else 0
-            xmax = right_x[0][0] if len(right_x)>0 else img.shape[1]
+            xmax = right_x[0][0] if len(right_x)>0 else img_shape[1]
 
 
             ymin = above_y[-1][0] if len(above_y)>0 else 0
-            ymax = below_y[0][0] if len(below_y)>0 else img.shape[0]
+            ymax = below_y[0][0] if len(below_y)>0 else img_shape[0]
         else:
             raise NotImplementedError()
-    
+
     # prevent cropping mask from being too small: it must be at least half the original picture
     # Here we say that if the cropping is more than half the image we consider the cropping as invalid
     # and we reset to the default of no cropping on that side
 
-    if xmin > img.shape[1]/2:
+    if xmin > img_shape[1]/2:
         xmin = 0
-    if xmax < img.shape[1]/2:
-        xmax = img.shape[1]
-    if ymin > img.shape[0]/2:
+    if xmax < img_shape[1]/2:
+        xmax = img_shape[1]
+    if ymin > img_shape[0]/2:
         ymin = 0
-    if ymax < img.shape[0]/2:
-        ymax = img.shape[0]
-    
+    if ymax < img_shape[0]/2:
+        ymax = img_shape[0]
+
     return xmin, xmax, ymin, ymax
 
 
+def row_col_std(file, band_mode='mean'):
+    """
+    Computes the standard deviation of every column and every row of an image, like np.std(img, axis=0)
+    and np.std(img, axis=1), reading it one block window at a time. Only the sums and sums of squares
+    of the rows and columns are kept, so the memory used does not depend on the size of the image.
+
+    The sums of integer pixel values are exact in float64, so the profiles match np.std up to the
+    rounding of the last digit.
+
+    :return: Tuple (std_x, std_y, img_shape)
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter(action='ignore', category=rasterio.errors.NotGeoreferencedWarning)
+        with rasterio.open(file) as raw_ds:
+            height, width = raw_ds.shape
+            col_sum, col_sq = np.zeros(width), np.zeros(width)
+            row_sum, row_sq = np.zeros(height), np.zeros(height)
+
+            for _, window in raw_ds.block_windows(1):
+                block = read_luminance(raw_ds, band_mode=band_mode, window=window).astype(np.float64)
+                rows = slice(window.row_off, window.row_off + window.height)
+                cols = slice(window.col_off, window.col_off + window.width)
+                squares = block * block
+                col_sum[cols] += block.sum(0)
+                col_sq[cols] += squares.sum(0)
+                row_sum[rows] += block.sum(1)
+                row_sq[rows] += squares.sum(1)
+
+    # var = (n * sum(x^2) - sum(x)^2) / n^2, the numerator is an exact integer for integer images
+    std_x = np.sqrt(np.maximum(height * col_sq - col_sum * col_sum, 0)) / height
+    std_y = np.sqrt(np.maximum(width * row_sq - row_sum * row_sum, 0)) / width
+    return std_x, std_y, (height, width)
+
+
+def calculate_box_streaming(file, band_mode='mean', threshold=20, starting_from='side', mode='levels'):
+    """
+    Same result as calculate_box(load_img(file)), computed with row_col_std without loading the whole image.
+    """
+    std_x, std_y, img_shape = row_col_std(file, band_mode=band_mode)
+    return box_from_profiles(std_x, std_y, img_shape, threshold=threshold, starting_from=starting_from, mode=mode)
+
+
+
 # def get_variance_polygon(img_path, threshold=20, sigma=10):
 
 #     img = load_img(img_path)
@@ -111,9 +325,9 @@ def calculate_box(img, threshold=20, starting_from='side', mode='levels'):
 
 
 # def get_variance_bounds(img_path, threshold=20, sigma=10):
-    
+
 #     img = load_img(img_path)
-    
+
 #     if sigma is not None:
 #         img = gaussian_filter(img, sigma=10)
 #     xmin, xmax, ymin, ymax = calculate_box(img, threshold)
@@ -197,7 +411,7 @@ def v_frame(xmin, xmax, ymin, ymax, v_height, v_width, number_padding_x, number_
         [xmin + number_padding_x * width, ymax - number_padding_y * height],
         [xmin, ymax - number_padding_y * height]]
     )
-    
+
 
 def square_frame(xmin, xmax, ymin, ymax, number_padding_x, number_padding_y, upper_left, bottom_right):
     height = ymax - ymin
@@ -231,16 +445,16 @@ def square_frame(xmin, xmax, ymin, ymax, number_padding_x, number_padding_y, upp
 
 
 def get_framed_polygon(mask_bounds, params):
-    
+
     xmin, xmax, ymin, ymax = mask_bounds
-    
+
     # margins are expressed in hundreds of pixels
     # so that their numerical values remain closer to unity as possible
     xmin = xmin + (params['margin_left']) * 100
     xmax = xmax - (params['margin_right']) * 100
     ymin = ymin + (params['margin_top']) * 100
     ymax = ymax - (params['margin_bottom']) * 100
-    
+
     if params['corners'] == 1:
         poly = cornered_frame(xmin, xmax, ymin, ymax, params['corners_width'], 
                               params['corners_height'], params['number_padding_x'])
@@ -258,19 +472,355 @@ def get_framed_polygon(mask_bounds, params):
 
 
 
-def generate_cropping_mask(img_shape, mask_bounds, cropping_parameters):
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Full resolution masks are large (one byte per pixel), so the cache is bounded by the bytes it holds
+MASK_CACHE_BYTES = 512 * 1024 ** 2
+# key (img_shape, mask_bounds, params hash, method, representation) -> mask, least recently used first
+_mask_cache = OrderedDict()
+_mask_cache_bytes = 0
+
+
+def _mask_nbytes(mask):
+    if isinstance(mask, np.ndarray):
+        return mask.nbytes
+    # rough size of the python tuples of the compact representations
+    return 64 * sum(len(item[2]) if len(item) == 3 else 1 for item in mask)
+
+
+def _copy_mask(mask):
+    if isinstance(mask, np.ndarray):
+        return mask.copy()
+    # rects are tuples of ints, bands hold a list of intervals
+    return [(item[0], item[1], list(item[2])) if len(item) == 3 else item for item in mask]
+
+
+def _contains(coords, x, y):
+    # even-odd rule, the point is never on an edge since it is the center of a cell of the vertex grid
+    inside = False
+    for (x1, y1), (x2, y2) in zip(coords, coords[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def is_rectilinear(polygon):
+    coords = list(polygon.exterior.coords)
+    return all(x1 == x2 or y1 == y2 for (x1, y1), (x2, y2) in zip(coords, coords[1:]))
+
+
+def polygon_row_bands(polygon, img_shape):
+    """
+    Decomposes a rectilinear polygon into the pixels it covers, as bands of rows that share the same column
+    intervals. Like rasterize, a pixel belongs to the polygon when its center does.
+
+    :return: List of tuples (row_start, row_stop, [(col_start, col_stop), ...]), stops are exclusive
+    """
+    coords = list(polygon.exterior.coords)
+    xs = sorted({x for x, _ in coords})
+    ys = sorted({y for _, y in coords})
+
+    def to_pixel(v, size):
+        # first pixel whose center is at or after v
+        return int(min(max(np.ceil(v - 0.5), 0), size))
+
+    bands = []
+    for y0, y1 in zip(ys, ys[1:]):
+        r0, r1 = to_pixel(y0, img_shape[0]), to_pixel(y1, img_shape[0])
+        if r0 >= r1:
+            continue
+        intervals = []
+        for x0, x1 in zip(xs, xs[1:]):
+            c0, c1 = to_pixel(x0, img_shape[1]), to_pixel(x1, img_shape[1])
+            if c0 >= c1 or not _contains(coords, (x0 + x1) / 2, (y0 + y1) / 2):
+                continue
+            if intervals and intervals[-1][1] == c0:
+                intervals[-1] = (intervals[-1][0], c1)
+            else:
+                intervals.append((c0, c1))
+        if not intervals:
+            continue
+        if bands and bands[-1][1] == r0 and bands[-1][2] == intervals:
+            bands[-1] = (bands[-1][0], r1, intervals)
+        else:
+            bands.append((r0, r1, intervals))
+    return bands
+
+
+def _build_mask(img_shape, polygon, method, representation):
+    if method == 'rasterize' or not is_rectilinear(polygon):
+        if representation != 'dense':
+            raise ValueError("Compact masks need a rectilinear polygon and method='analytic'.")
+        return rasterize([polygon], out_shape=img_shape)
+    if method != 'analytic':
+        raise ValueError(f"Unknown method '{method}'. Expected 'analytic' or 'rasterize'.")
+
+    bands = polygon_row_bands(polygon, img_shape)
+    if representation == 'bands':
+        return bands
+    if representation == 'rects':
+        return [(r0, r1, c0, c1) for r0, r1, intervals in bands for c0, c1 in intervals]
+    if representation != 'dense':
+        raise ValueError(f"Unknown representation '{representation}'. Expected 'dense', 'rects' or 'bands'.")
+
+    mask = np.zeros(img_shape, dtype=np.uint8)
+    for r0, r1, intervals in bands:
+        for c0, c1 in intervals:
+            mask[r0:r1, c0:c1] = 1
+    return mask
+
+
+def generate_cropping_mask(img_shape, mask_bounds, cropping_parameters, method='analytic', representation='dense', cache=False):
+    """
+    Builds the mask of the frame polygon of get_framed_polygon.
+
+    The frames are rectilinear, so by default the mask is filled rectangle by rectangle with NumPy slicing
+    instead of rasterize (the pixels are the same except where a polygon edge passes exactly through pixel
+    centers). With cache=True masks are kept in an LRU cache of at most MASK_CACHE_BYTES, since most images
+    of a contract share their shape and parameters; the caller always gets its own copy.
+
+    :param img_shape: Tuple (rows, cols)
+    :param mask_bounds: Tuple (xmin, xmax, ymin, ymax) as returned by calculate_box
+    :param cropping_parameters: Frame parameters of the contract config
+    :param method: 'analytic', or 'rasterize' to use rasterio.features.rasterize
+    :param representation: 'dense' for a uint8 array, 'rects' for a list of (row_start, row_stop, col_start, col_stop)
+                           rectangles or 'bands' for row bands with their column intervals (see polygon_row_bands)
+    :param cache: Use the mask cache, the result is the same as without it
+    """
+    global _mask_cache_bytes
+
+    key = None
+    if cache:
+        key = (tuple(img_shape), tuple(float(v) for v in mask_bounds), params_hash(cropping_parameters),
+               method, representation)
+        if key in _mask_cache:
+            _mask_cache.move_to_end(key)
+            return _copy_mask(_mask_cache[key])
 
-    # data = np.array([mask_bounds[0], mask_bounds[1], mask_bounds[2], mask_bounds[3], 
-    #      cropping_parameters['corners'], 
-    #      cropping_parameters['midpoints'], 
-    #      cropping_parameters['t_lg'], 
-    #      cropping_parameters['b_lg'], 
-    #      cropping_parameters['l_lg'], 
-    #      cropping_parameters['r_lg'], 
-    #      cropping_parameters['number_ul'], 
-    #      cropping_parameters['number_r']])
-    
     pred_polygon = get_framed_polygon(mask_bounds, cropping_parameters)
-    
-    mask = rasterize([pred_polygon], out_shape=img_shape)
+    mask = _build_mask(tuple(img_shape), pred_polygon, method, representation)
+
+    if cache:
+        nbytes = _mask_nbytes(mask)
+        if nbytes <= MASK_CACHE_BYTES:
+            _mask_cache[key] = _copy_mask(mask)
+            _mask_cache_bytes += nbytes
+            while _mask_cache_bytes > MASK_CACHE_BYTES:
+                _, evicted = _mask_cache.popitem(last=False)
+                _mask_cache_bytes -= _mask_nbytes(evicted)
     return mask
+
+
+# ---- Batch crop boxes over many images
+
+# the crop settings of a contract config, with the defaults of contract_utils
+DEFAULT_CROP_SETTINGS = {'cropping_std_threshold': 20, 'cropping_origin': 'side', 'cropping_mode': 'levels'}
+CROP_RESULT_COLUMNS = ['path', 'param_set', 'xmin', 'xmax', 'ymin', 'ymax', 'polygon', 'error']
+
+# results of batch_crop_boxes in this process, key (path, mtime, decimation, band_mode, params hash) -> row
+_box_cache = {}
+
+
+def image_profiles(path, decimation=1, band_mode='mean', cache_dir=None):
+    """
+    Computes the std profiles used by calculate_box for an image, streamed at full resolution or from
+    a decimated read. With cache_dir the profiles are kept in .npz files keyed on the path, mtime and
+    read settings, so trying other thresholds or frames does not read the image again.
+
+    :return: Tuple (std_x, std_y, img_shape, full_shape). img_shape is the shape the profiles were computed at.
+    """
+    cache_fp = None
+    if cache_dir is not None:
+        key = params_hash([os.path.abspath(path), os.path.getmtime(path), decimation, band_mode])
+        cache_fp = os.path.join(cache_dir, f"{key}.npz")
+        if os.path.isfile(cache_fp):
+            cached = np.load(cache_fp)
+            return cached['std_x'], cached['std_y'], tuple(cached['img_shape']), tuple(cached['full_shape'])
+
+    if decimation == 1:
+        std_x, std_y, full_shape = row_col_std(path, band_mode=band_mode)
+        img_shape = full_shape
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter(action='ignore', category=rasterio.errors.NotGeoreferencedWarning)
+            with rasterio.open(path) as raw_ds:
+                full_shape = raw_ds.shape
+                img = read_luminance(raw_ds, out_shape=decimated_shape(full_shape, decimation), band_mode=band_mode)
+        std_x, std_y, img_shape = np.std(img, axis=0), np.std(img, axis=1), img.shape
+
+    if cache_fp is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_fp = f"{cache_fp}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_fp, std_x=std_x, std_y=std_y, img_shape=img_shape, full_shape=full_shape)
+        os.replace(tmp_fp, cache_fp)
+    return std_x, std_y, tuple(img_shape), tuple(full_shape)
+
+
+def _crop_boxes_for_image(path, param_sets, decimation, band_mode, cache_dir):
+    """
+    Process pool worker: the profiles of one image are computed once and every parameter set is evaluated on them.
+    """
+    try:
+        std_x, std_y, img_shape, full_shape = image_profiles(path, decimation, band_mode, cache_dir)
+    except Exception as e:
+        return [{'path': path, 'param_set': i, 'xmin': None, 'xmax': None, 'ymin': None, 'ymax': None,
+                 'polygon': None, 'error': str(e)} for i in range(len(param_sets))]
+
+    rows = []
+    for i, params in enumerate(param_sets):
+        settings = {**DEFAULT_CROP_SETTINGS, **params}
+        row = {'path': path, 'param_set': i, 'polygon': None, 'error': None}
+        try:
+            box = box_from_profiles(std_x, std_y, img_shape, threshold=settings['cropping_std_threshold'],
+                                    starting_from=settings['cropping_origin'], mode=settings['cropping_mode'])
+            box = scale_box(box, img_shape, full_shape, settings['cropping_origin'], settings['cropping_mode'],
+                            (std_x, std_y), settings['cropping_std_threshold'])
+            row.update(zip(['xmin', 'xmax', 'ymin', 'ymax'], box))
+            if settings.get('cropping_parameters'):
+                row['polygon'] = get_framed_polygon(box, settings['cropping_parameters']).wkt
+        except Exception as e:
+            row.update({'xmin': None, 'xmax': None, 'ymin': None, 'ymax': None, 'error': str(e)})
+        rows.append(row)
+    return rows
+
+
+def batch_crop_boxes(paths, param_sets, workers=None, decimation=1, band_mode='mean', cache_dir=None, output_path=None):
+    """
+    Computes the crop box, and the mask polygon when the parameter set has 'cropping_parameters', of every
+    image for every parameter set, with one process pool task per image.
+
+    Results already computed in this process for the same (path, mtime, read settings, parameters) are
+    reused, so previewing a parameter change only evaluates the parameter sets that changed.
+
+    :param paths: List of image paths
+    :param param_sets: List of dictionaries with the crop settings of a contract config: 'cropping_std_threshold',
+                       'cropping_origin', 'cropping_mode' and optionally 'cropping_parameters' (see get_framed_polygon)
+    :param workers: Number of processes, None for the number of CPUs
+    :param decimation: Compute the boxes on images read at 1/decimation of their resolution, see load_img
+    :param band_mode: 'mean' or 'first', see read_luminance
+    :param cache_dir: Folder in which the std profiles of the images are kept between runs, see image_profiles
+    :param output_path: Parquet file to which the results are written as they complete
+    :return: DataFrame with columns path, param_set (index in param_sets), xmin, xmax, ymin, ymax,
+             polygon (WKT in full resolution pixels) and error
+    """
+    import pandas as pd
+
+    hashes = [params_hash(params) for params in param_sets]
+    rows = []
+    todo = {}  # path -> indices of the parameter sets that are not cached
+    for path in paths:
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        for i, h in enumerate(hashes):
+            cached = _box_cache.get((path, mtime, decimation, band_mode, h))
+            if cached is not None:
+                rows.append({**cached, 'param_set': i})
+            else:
+                todo.setdefault(path, []).append(i)
+
+    writer = None
+    if output_path is not None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([('path', pa.string()), ('param_set', pa.int64()), ('xmin', pa.int64()), ('xmax', pa.int64()),
+                            ('ymin', pa.int64()), ('ymax', pa.int64()), ('polygon', pa.string()), ('error', pa.string())])
+        writer = pq.ParquetWriter(output_path, schema)
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_crop_boxes_for_image, path, [param_sets[i] for i in indices],
+                                       decimation, band_mode, cache_dir): (path, indices)
+                       for path, indices in todo.items()}
+            for future in as_completed(futures):
+                path, indices = futures[future]
+                image_rows = future.result()
+                mtime = os.path.getmtime(path) if os.path.exists(path) else None
+                for row, i in zip(image_rows, indices):
+                    row['param_set'] = i
+                    if row['error'] is None:
+                        _box_cache[(path, mtime, decimation, band_mode, hashes[i])] = row
+                if writer is not None:
+                    writer.write_table(pa.Table.from_pylist(image_rows, schema=schema))
+                rows += image_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return pd.DataFrame(rows, columns=CROP_RESULT_COLUMNS).sort_values(['path', 'param_set'], ignore_index=True)
+
+
+# ---- Threshold sweeps
+
+def _sweep_profile(std, thresholds, starting_from):
+    """
+    Vectorized box_from_profiles ('levels' mode) along one axis, for every threshold at once.
+
+    :return: Tuple of arrays (mins, maxs), one value per threshold
+    """
+    size = len(std)
+    idx = np.arange(size)
+    if starting_from == 'side':
+        above = std[None, :] > thresholds[:, None]
+        found = above.any(1)
+        mins = np.where(found, np.argmax(above, 1), 0)
+        maxs = np.where(found, size - 1 - np.argmax(above[:, ::-1], 1), size)
+    elif starting_from == 'center':
+        below = std[None, :] < thresholds[:, None]
+        left = below & (idx < size/2)
+        right = below & (idx > size/2)
+        mins = np.where(left.any(1), size - 1 - np.argmax(left[:, ::-1], 1), 0)
+        maxs = np.where(right.any(1), np.argmax(right, 1), size)
+    else:
+        raise NotImplementedError()
+
+    # same rule as box_from_profiles: a crop of more than half the image is reset to no cropping on that side
+    mins = np.where(mins > size/2, 0, mins)
+    maxs = np.where(maxs < size/2, size, maxs)
+    return mins, maxs
+
+
+def sweep_thresholds(profiles, thresholds, origins=('side', 'center')):
+    """
+    Evaluates box_from_profiles (mode='levels') for a whole vector of thresholds and both origins, reusing
+    the std profiles of every image.
+
+    :param profiles: List of tuples (std_x, std_y, img_shape, full_shape) as returned by image_profiles
+    :param thresholds: Sequence of std thresholds
+    :param origins: Values of cropping_origin to evaluate
+    :return: Dictionary {origin: int array of shape (n_images, n_thresholds, 4)} with the bounds
+             (xmin, xmax, ymin, ymax) in full resolution pixels
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    boxes = {origin: np.zeros((len(profiles), len(thresholds), 4), dtype=np.int64) for origin in origins}
+    for i, (std_x, std_y, img_shape, full_shape) in enumerate(profiles):
+        for origin in origins:
+            std_x, std_y = np.asarray(std_x), np.asarray(std_y)
+            xmin, xmax = _sweep_profile(std_x, thresholds, origin)
+            ymin, ymax = _sweep_profile(std_y, thresholds, origin)
+            kind_min, kind_max = _bound_kinds(origin, 'levels')
+            # with 'center' an index 0 is genuine when the first sample is below the threshold, see scale_box
+            zero_x = ~(std_x[0] < thresholds) if origin == 'center' else True
+            zero_y = ~(std_y[0] < thresholds) if origin == 'center' else True
+            boxes[origin][i] = np.stack([_scale_bounds(xmin, img_shape[1], full_shape[1], kind_min, zero_x),
+                                         _scale_bounds(xmax, img_shape[1], full_shape[1], kind_max),
+                                         _scale_bounds(ymin, img_shape[0], full_shape[0], kind_min, zero_y),
+                                         _scale_bounds(ymax, img_shape[0], full_shape[0], kind_max)], axis=1)
+    return boxes
+
+
+def _image_profiles_task(args):
+    return image_profiles(*args)
+
+
+def sweep_crop_boxes(paths, thresholds, origins=('side', 'center'), workers=None, decimation=1, band_mode='mean', cache_dir=None):
+    """
+    Computes the std profiles of the images across a process pool and runs sweep_thresholds on them.
+
+    :return: Dictionary {origin: int array of shape (len(paths), len(thresholds), 4)}, see sweep_thresholds
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        profiles = list(executor.map(_image_profiles_task, [(path, decimation, band_mode, cache_dir) for path in paths]))
+    return sweep_thresholds(profiles, thresholds, origins)
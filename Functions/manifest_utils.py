@@ -0,0 +1,284 @@
+import os
+import json
+import shlex
+import threading
+
+import Functions.utilities as u
+from Functions.ssh_utils import chunk_command_args, MAX_COMMAND_LENGTH
+
+cfg = u.read_config()
+
+HASH_WORKERS = cfg.get('verification', {}).get('hash_workers', 8)
+
+# Standalone script run on the remote machine with `python3 -c`. It reads "<algorithm>\t<path>" lines from
+# stdin (algorithm 'md5' or 'crc32c'), hashes the files with a thread pool (hashlib releases the GIL on large
+# blocks, and `python3 -c` has no importable __main__ for a process pool under spawn) and prints
+# "<hex digest>\t<size>\t<mtime>\t<path>" per file. CRC32C is what GCS keeps for composite objects, which have
+# no MD5. It needs the C extension of google_crc32c, without it those files are reported as UNAVAILABLE and
+# stay unverified, since a pure Python CRC32C is far too slow for image files.
+REMOTE_HASH_SCRIPT = """
+import os, sys, hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import google_crc32c
+    if google_crc32c.implementation != 'c':
+        google_crc32c = None
+except (ImportError, AttributeError):
+    google_crc32c = None
+
+def hash_file(line):
+    algorithm, path = line.split('\\t', 1)
+    if algorithm == 'crc32c' and google_crc32c is None:
+        return 'UNAVAILABLE\\t0\\t0\\t%s' % path
+    try:
+        digest = google_crc32c.Checksum() if algorithm == 'crc32c' else hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                digest.update(block)
+        st = os.stat(path)
+        return '%s\\t%d\\t%f\\t%s' % (digest.digest().hex(), st.st_size, st.st_mtime, path)
+    except OSError:
+        return 'ERROR\\t0\\t0\\t%s' % path
+
+lines = [line.rstrip('\\n') for line in sys.stdin if line.strip()]
+with ThreadPoolExecutor(int(sys.argv[1])) as executor:
+    for line in executor.map(hash_file, lines):
+        print(line, flush=True)
+"""
+
+# Hashes compared by diff_manifests, in order of preference
+HASH_ALGORITHMS = ('md5', 'crc32c')
+
+
+def get_remote_manifest(ssh, folder_paths, max_command_length=MAX_COMMAND_LENGTH):
+    """
+    Lists path, size and mtime of every file in the given remote folders, subfolders included, in a single `find` pass.
+
+    :param ssh: Connected paramiko SSHClient
+    :param folder_paths: List of paths to the folders
+    :return: Dictionary where keys are folder paths and values are dictionaries
+             {file path relative to the folder: {'size': int, 'mtime': float}}
+    """
+    # map the starting points printed by find back to the paths as given
+    folder_keys = {folder_path.rstrip('/'): folder_path for folder_path in folder_paths}
+    manifest = {folder_path: {} for folder_path in folder_paths}
+
+    for chunk in chunk_command_args(folder_paths, max_command_length):
+        command = f"find {' '.join(chunk)} -type f -printf '%H\\t%P\\t%s\\t%T@\\n'"
+        stdin, stdout, stderr = ssh.exec_command(command)
+        output = stdout.read().decode('utf-8')
+        error = stderr.read().decode('utf-8')
+        if error:
+            print(f"An error occurred while listing files: {error}")
+
+        for line in output.splitlines():
+            folder, name, size, mtime = line.split('\t')
+            key = folder_keys.get(folder.rstrip('/'))
+            if key is not None:
+                manifest[key][name] = {'size': int(size), 'mtime': float(mtime)}
+
+    return manifest
+
+
+def diff_manifests(source_manifest, destination_manifest, folder_mappings, compare_mtime=False, compare_hash=False):
+    """
+    Compares two manifests file by file.
+
+    :param source_manifest: Manifest of the source machine (e.g. Tabei)
+    :param destination_manifest: Manifest of the destination machine (e.g. Savio or the bucket)
+    :param folder_mappings: List of tuples (source_folder, destination_folder)
+    :param compare_mtime: Also treat files as changed when the source is newer than the destination
+    :param compare_hash: Also treat files as changed when their hashes differ, comparing 'md5' when both sides
+                         have it and 'crc32c' otherwise (see add_remote_hashes)
+    :return: Dictionary with
+        'missing': list of tuples (source_path, destination_path) of files absent on the destination,
+        'changed': list of tuples (source_path, destination_path) of files that differ,
+        'extra': list of destination paths that do not exist on the source,
+        'unverified': list of tuples (source_path, destination_path) whose hash is unavailable on one side
+    """
+    delta = {'missing': [], 'changed': [], 'extra': [], 'unverified': []}
+
+    for source_folder, destination_folder in folder_mappings:
+        source_files = source_manifest.get(source_folder, {})
+        destination_files = destination_manifest.get(destination_folder, {})
+
+        for name, source_entry in sorted(source_files.items()):
+            source_path = os.path.join(source_folder, name)
+            destination_path = os.path.join(destination_folder, name)
+            destination_entry = destination_files.get(name)
+
+            if destination_entry is None:
+                delta['missing'].append((source_path, destination_path))
+            elif destination_entry['size'] != source_entry['size']:
+                delta['changed'].append((source_path, destination_path))
+            elif compare_mtime and source_entry['mtime'] > destination_entry['mtime']:
+                delta['changed'].append((source_path, destination_path))
+            elif compare_hash:
+                algorithm = next((a for a in HASH_ALGORITHMS if a in source_entry and a in destination_entry), None)
+                if algorithm is None:
+                    delta['unverified'].append((source_path, destination_path))
+                elif source_entry[algorithm] != destination_entry[algorithm]:
+                    delta['changed'].append((source_path, destination_path))
+
+        for name in sorted(set(destination_files) - set(source_files)):
+            delta['extra'].append(os.path.join(destination_folder, name))
+
+    return delta
+
+
+def hashes_to_verify(source_manifest, destination_manifest, folder_mappings):
+    """
+    Picks the files whose hashes diff_manifests needs: only files present on both sides with the same size,
+    since the others are missing or changed anyway. The source is hashed with the algorithm the destination
+    already has (e.g. the MD5 or, for composite objects, the CRC32C stored by GCS); destinations without any
+    hash are hashed with MD5 on both sides.
+
+    :return: Tuple of dictionaries ({source_path: algorithm}, {destination_path: algorithm}), see add_remote_hashes
+    """
+    source_hashes, destination_hashes = {}, {}
+    for source_folder, destination_folder in folder_mappings:
+        destination_files = destination_manifest.get(destination_folder, {})
+        for name, source_entry in source_manifest.get(source_folder, {}).items():
+            destination_entry = destination_files.get(name)
+            if destination_entry is None or destination_entry['size'] != source_entry['size']:
+                continue
+            source_path = os.path.join(source_folder, name)
+            algorithm = next((a for a in HASH_ALGORITHMS if a in destination_entry), None)
+            if algorithm is None:
+                algorithm = 'md5'
+                destination_hashes[os.path.join(destination_folder, name)] = algorithm
+            source_hashes[source_path] = algorithm
+    return source_hashes, destination_hashes
+
+
+def print_manifest_delta(delta):
+    n_missing, n_changed, n_extra = len(delta['missing']), len(delta['changed']), len(delta['extra'])
+    if n_missing + n_changed + n_extra == 0:
+        print("All files match.")
+    else:
+        print(f"Files missing: {n_missing}, changed: {n_changed}, extra: {n_extra}")
+    if delta.get('unverified'):
+        print(f"Files without a hash to verify against: {len(delta['unverified'])}")
+
+
+class HashCache:
+    """
+    Local cache of file hashes of a machine keyed by (path, size, mtime), so re-verification only hashes new or modified files.
+    """
+    def __init__(self, name):
+        self.path = os.path.join(u.root_dir, "Files", "hash_cache", f"{name}.json")
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable hash cache {self.path}: {e}")
+
+    @staticmethod
+    def _key(path, size, mtime, algorithm='md5'):
+        key = f"{path}|{size}|{mtime:.6f}"
+        return key if algorithm == 'md5' else f"{key}|{algorithm}"
+
+    def get(self, path, size, mtime, algorithm='md5'):
+        return self.entries.get(self._key(path, size, mtime, algorithm))
+
+    def set(self, path, size, mtime, digest, algorithm='md5'):
+        self.entries[self._key(path, size, mtime, algorithm)] = digest
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+
+
+def get_remote_hashes(ssh, file_paths, workers=HASH_WORKERS, algorithms=None):
+    """
+    Computes hashes of remote files on the remote machine with a thread pool.
+
+    :param ssh: Connected paramiko SSHClient
+    :param file_paths: List of remote file paths
+    :param workers: Number of hashing threads on the remote machine
+    :param algorithms: Dictionary {path: 'md5' or 'crc32c'}, files not in it get an MD5
+    :return: Dictionary {path: (hex digest, size, mtime)} for the files that could be read. Files that could
+             not be hashed are left out, diff_manifests reports them as unverified
+    """
+    if not file_paths:
+        return {}
+    algorithms = algorithms or {}
+
+    stdin, stdout, stderr = ssh.exec_command(f"python3 -c {shlex.quote(REMOTE_HASH_SCRIPT)} {int(workers)}")
+
+    # stderr is drained at the same time as stdout, a full stderr pipe would otherwise block the remote script
+    errors = []
+    stderr_reader = threading.Thread(target=lambda: errors.append(stderr.read().decode('utf-8')), daemon=True)
+    stderr_reader.start()
+
+    stdin.write("\n".join(f"{algorithms.get(path, 'md5')}\t{path}" for path in file_paths) + "\n")
+    stdin.channel.shutdown_write()
+
+    hashes = {}
+    n_unavailable = 0
+    for line in stdout:
+        digest, size, mtime, path = line.rstrip('\n').split('\t', 3)
+        if digest == 'ERROR':
+            print(f"An error occurred while hashing {path}")
+            continue
+        if digest == 'UNAVAILABLE':
+            n_unavailable += 1
+            continue
+        hashes[path] = (digest, int(size), float(mtime))
+
+    stderr_reader.join()
+    if n_unavailable:
+        print(f"  {n_unavailable} files need a CRC32C but google_crc32c (C extension) is not installed remotely, they stay unverified")
+    if errors and errors[0]:
+        print(f"An error occurred while hashing files: {errors[0]}")
+    return hashes
+
+
+def add_remote_hashes(ssh, manifest, cache_name, workers=HASH_WORKERS, hash_types=None):
+    """
+    Adds a hash entry ('md5' or 'crc32c') to the files of a manifest from get_remote_manifest, hashing
+    only the files whose (path, size, mtime) is not in the local hash cache.
+
+    :param cache_name: Name of the HashCache of the machine, e.g. 'tabei' or 'savio'
+    :param hash_types: Dictionary {path: algorithm} of the files to hash (see hashes_to_verify),
+                       by default every file gets an MD5
+    :return: The manifest, updated in place
+    """
+    cache = HashCache(cache_name)
+    to_hash = []
+    n_cached = 0
+    for folder_path, files in manifest.items():
+        for name, entry in files.items():
+            path = os.path.join(folder_path, name)
+            algorithm = hash_types.get(path) if hash_types is not None else 'md5'
+            if algorithm is None:
+                continue
+            digest = cache.get(path, entry['size'], entry['mtime'], algorithm)
+            if digest is not None:
+                entry[algorithm] = digest
+                n_cached += 1
+            else:
+                to_hash.append(path)
+
+    print(f"  Hashing {len(to_hash)} files ({n_cached} cached)")
+    hashes = get_remote_hashes(ssh, to_hash, workers, hash_types)
+
+    for folder_path, files in manifest.items():
+        for name, entry in files.items():
+            path = os.path.join(folder_path, name)
+            if path in hashes:
+                algorithm = hash_types.get(path) if hash_types is not None else 'md5'
+                digest = hashes[path][0]
+                entry[algorithm] = digest
+                cache.set(path, entry['size'], entry['mtime'], digest, algorithm)
+
+    cache.save()
+    return manifest
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import paramiko
+from tqdm import tqdm
+
+import Functions.utilities as u
+
+cfg = u.read_config()
+
+sftp_cfg = cfg.get('sftp', {})
+DEFAULT_WORKERS = sftp_cfg.get('workers', 4)
+DEFAULT_MAX_INFLIGHT_BYTES = sftp_cfg.get('max_inflight_mb', 2048) * 1024 * 1024
+CHUNK_SIZE = sftp_cfg.get('chunk_mb', 1) * 1024 * 1024
+PART_SUFFIX = ".part"
+# Journal entries (and journal files) older than this are dropped, the transfer is simply redone
+JOURNAL_MAX_AGE = sftp_cfg.get('journal_max_age_days', 7) * 24 * 3600
+JOURNAL_DIR = os.path.join(u.root_dir, "Files", "transfer_journals")
+
+
+class ByteBudget:
+    """
+    Bounds the number of bytes in flight across all transfer workers.
+    A single file larger than the budget is still allowed through when nothing else is in flight.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        with self._cond:
+            while self.inflight > 0 and self.inflight + n > self.limit:
+                self._cond.wait()
+            self.inflight += n
+
+    def release(self, n):
+        with self._cond:
+            self.inflight -= n
+            self._cond.notify_all()
+
+
+class TransferJournal:
+    """
+    Local record of the completed files of transfers, so that an interrupted batch
+    (e.g. SavioClient.upload_image_folders) picks up exactly where it stopped.
+
+    A journal belongs to a stable scope such as the destination root, not to one list of files: a re-run
+    usually transfers fewer files (the manifest delta shrinks) and must still find the journal. Several
+    processes can share it, every write takes a lock, merges with the file and drops stale entries.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = self._read()
+
+    @classmethod
+    def for_batch(cls, kind, scope):
+        """
+        Returns the journal of a kind of transfer ('upload' or 'download') into a scope, e.g. the
+        destination root folder. Journal files not written for JOURNAL_MAX_AGE are deleted.
+        """
+        cls.prune_stale()
+        digest = hashlib.sha1(scope.encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(JOURNAL_DIR, f"{kind}_{digest}.json"))
+
+    @staticmethod
+    def prune_stale(max_age=JOURNAL_MAX_AGE):
+        if not os.path.isdir(JOURNAL_DIR):
+            return
+        now = time.time()
+        for name in os.listdir(JOURNAL_DIR):
+            path = os.path.join(JOURNAL_DIR, name)
+            try:
+                if name.endswith(('.json', '.lock')) and now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _key(source, destination):
+        return f"{source} -> {destination}"
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable transfer journal {self.path}: {e}")
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in entries.items() if now - entry['time'] <= JOURNAL_MAX_AGE}
+
+    def _update(self, change):
+        """Applies change(entries) to the journal on disk under an exclusive lock, deleting the file once empty."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = self._read()
+                change(entries)
+                self.entries = entries
+                if not entries:
+                    if os.path.isfile(self.path):
+                        os.remove(self.path)
+                    return
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def is_done(self, source, destination, size):
+        entry = self.entries.get(self._key(source, destination))
+        return entry is not None and entry['size'] == size
+
+    def mark_done(self, source, destination, size):
+        entry = {'size': size, 'time': time.time()}
+        self._update(lambda entries: entries.__setitem__(self._key(source, destination), entry))
+
+    def complete(self, jobs):
+        """Drops the entries of a batch that finished, other batches of the same scope keep theirs."""
+        keys = {self._key(source, destination) for source, destination, _ in jobs}
+
+        def drop(entries):
+            for key in keys:
+                entries.pop(key, None)
+
+        self._update(drop)
+
+
+def put_resumable(sftp, local_path, remote_path, callback=None):
+    """
+    Uploads local_path to remote_path through a remote '.part' file.
+
+    If a '.part' file is left over from an interrupted upload, the transfer continues
+    from its current size. The '.part' file is renamed onto remote_path once complete.
+    """
+    size = os.path.getsize(local_path)
+    part_path = remote_path + PART_SUFFIX
+    try:
+        offset = sftp.stat(part_path).st_size
+    except IOError:
+        offset = 0
+    if offset > size:
+        offset = 0
+
+    with open(local_path, 'rb') as local_file, sftp.open(part_path, 'r+' if offset else 'w') as remote_file:
+        remote_file.set_pipelined(True)
+        local_file.seek(offset)
+        remote_file.seek(offset)
+        transferred = offset
+        if callback:
+            callback(transferred, size)
+        while True:
+            data = local_file.read(CHUNK_SIZE)
+            if not data:
+                break
+            remote_file.write(data)
+            transferred += len(data)
+            if callback:
+                callback(transferred, size)
+
+    remote_size = sftp.stat(part_path).st_size
+    if remote_size != size:
+        raise IOError(f"Size mismatch after upload of {local_path}: {remote_size} != {size}")
+
+    try:
+        sftp.posix_rename(part_path, remote_path)
+    except IOError:
+        # server without the posix-rename extension: plain rename does not overwrite
+        try:
+            sftp.remove(remote_path)
+        except IOError:
+            pass
+        sftp.rename(part_path, remote_path)
+
+
+def get_resumable(sftp, remote_path, local_path, callback=None, size=None):
+    """
+    Downloads remote_path to local_path through a local '.part' file, resuming a
+    partial download from its current size and renaming it into place once complete.
+    """
+    if size is None:
+        size = sftp.stat(remote_path).st_size
+    part_path = local_path + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if offset > size:
+        offset = 0
+
+    with sftp.open(remote_path, 'rb') as remote_file, open(part_path, 'r+b' if offset else 'wb') as local_file:
+        remote_file.seek(offset)
+        local_file.seek(offset)
+        remote_file.prefetch(size)
+        transferred = offset
+        if callback:
+            callback(transferred, size)
+        while transferred < size:
+            data = remote_file.read(CHUNK_SIZE)
+            if not data:
+                break
+            local_file.write(data)
+            transferred += len(data)
+            if callback:
+                callback(transferred, size)
+
+    if os.path.getsize(part_path) != size:
+        raise IOError(f"Size mismatch after download of {remote_path}: {os.path.getsize(part_path)} != {size}")
+    os.replace(part_path, local_path)
+
+
+class SFTPTransferEngine:
+    """
+    Moves many files concurrently over N SFTP channels opened on one SSH transport.
+
+    Used by SavioClient, TabeiClient and VMClient. Progress is reported as an aggregate
+    byte-rate bar plus a completion line with the byte rate of every file. Transfers go
+    through '.part' files and resume from their current size (see put_resumable/get_resumable).
+    """
+    def __init__(self, ssh, workers=None, max_inflight_bytes=None):
+        """
+        :param ssh: Connected paramiko SSHClient whose transport the channels are opened on
+        :param workers: Number of concurrent SFTP channels (defaults to sftp.workers in config.yml)
+        :param max_inflight_bytes: Upper bound on the bytes of files being transferred at once
+        """
+        self.transport = ssh.get_transport()
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        self.budget = ByteBudget(max_inflight_bytes or DEFAULT_MAX_INFLIGHT_BYTES)
+        self._channels = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _open_channels(self, n):
+        for _ in range(n):
+            self._channels.put(paramiko.SFTPClient.from_transport(self.transport))
+
+    def _close_channels(self):
+        while not self._channels.empty():
+            try:
+                self._channels.get_nowait().close()
+            except Exception:
+                pass
+
+    def _run(self, jobs, transfer_fn, desc, journal=None):
+        """
+        :param jobs: List of tuples (source, destination, size)
+        :param transfer_fn: Callable (sftp, source, destination, size, callback) performing one transfer
+        :param journal: Optional TransferJournal, files recorded as done are skipped
+        :return: List of tuples (source, destination) that failed
+        """
+        if journal is not None:
+            n_jobs = len(jobs)
+            jobs = [job for job in jobs if not journal.is_done(*job)]
+            if len(jobs) < n_jobs:
+                print(f"Resuming from journal: skipping {n_jobs - len(jobs)} completed files.")
+
+        if not jobs:
+            return []
+
+        total_bytes = sum(size for _, _, size in jobs)
+        n_workers = min(self.workers, len(jobs))
+        self._open_channels(n_workers)
+        failed = []
+
+        with tqdm(total=total_bytes, unit='B', unit_scale=True, desc=desc, file=sys.stdout) as pbar:
+
+            def transfer(source, destination, size):
+                self.budget.acquire(size)
+                sftp = self._channels.get()
+                done = [0]
+
+                def callback(bytes_transferred, total):
+                    with self._lock:
+                        pbar.update(bytes_transferred - done[0])
+                    done[0] = bytes_transferred
+
+                start = time.time()
+                try:
+                    transfer_fn(sftp, source, destination, size, callback)
+                finally:
+                    self._channels.put(sftp)
+                    self.budget.release(size)
+
+                if journal is not None:
+                    journal.mark_done(source, destination, size)
+
+                elapsed = max(time.time() - start, 1e-6)
+                with self._lock:
+                    pbar.update(size - done[0])
+                    pbar.write(f"  {os.path.basename(source)}: {size / 1e6:.1f} MB at {size / elapsed / 1e6:.1f} MB/s")
+
+            try:
+                with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                    futures = {executor.submit(transfer, *job): job for job in jobs}
+                    for future in as_completed(futures):
+                        source, destination, _ = futures[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            print(f"An error occurred transferring {source} to {destination}: {e}")
+                            failed.append((source, destination))
+            finally:
+                self._close_channels()
+
+        return failed
+
+    def upload(self, local_paths, remote_paths, journal=None):
+        """
+        :param journal: Optional TransferJournal, the entries of the batch are dropped once every file has been uploaded
+        """
+        jobs = [(l, r, os.path.getsize(l)) for l, r in zip(local_paths, remote_paths)]
+
+        def put(sftp, local_path, remote_path, size, callback):
+            put_resumable(sftp, local_path, remote_path, callback)
+
+        failed = self._run(jobs, put, "Uploading", journal)
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(jobs)} uploads failed: {failed[:10]}")
+        if journal is not None:
+            journal.complete(jobs)
+        print("Upload complete.")
+
+    def download(self, remote_paths, local_paths, sizes=None, journal=None):
+        """
+        :param sizes: Optional list of remote file sizes, avoids a stat per file when already known
+        :param journal: Optional TransferJournal, the entries of the batch are dropped once every file has been downloaded
+        """
+        if sizes is None:
+            sftp = paramiko.SFTPClient.from_transport(self.transport)
+            try:
+                sizes = [sftp.stat(r).st_size for r in remote_paths]
+            finally:
+                sftp.close()
+        jobs = list(zip(remote_paths, local_paths, sizes))
+
+        def get(sftp, remote_path, local_path, size, callback):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            get_resumable(sftp, remote_path, local_path, callback, size)
+
+        failed = self._run(jobs, get, "Downloading", journal)
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(jobs)} downloads failed: {failed[:10]}")
+        if journal is not None:
+            journal.complete(jobs)
+        print("Download complete.")
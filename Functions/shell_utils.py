@@ -75,6 +75,18 @@ update_status() {{
     fi
 }}
 
+# Function to send the status updates left in the spool file when the sheet could not be reached
+flush_status_spool() {{
+    singularity run {stitching_services_sif} \
+        python3 {os.path.join(services_repo, "Local/update_status.py")} \
+        --flush \
+        || echo "Warning: could not send the spooled status updates."
+}}
+
+# send the updates spooled by earlier jobs now, and whatever this job leaves in the spool when it ends
+flush_status_spool
+trap flush_status_spool EXIT
+
 # Function to run a stitching services script
 run_stitching_services() {{
     local script_path="$1"
@@ -409,6 +421,20 @@ update_status() {{
         exit $exit_code
     fi
 }}
+
+# Function to send the status updates left in the spool file when the sheet could not be reached
+flush_status_spool() {{
+    sudo docker run --rm \
+        --mount type=bind,source={vm_paths['services_repo']},target={docker_paths['services_repo']} \
+        stitching-services \
+        python3 {docker_paths['services_repo']}/Local/update_status.py \
+        --flush \
+        || echo "Warning: could not send the spooled status updates."
+}}
+
+# send the updates spooled by earlier jobs now, and whatever this job leaves in the spool when it ends
+flush_status_spool
+trap flush_status_spool EXIT
     """
     return shell_script_base
 
@@ -0,0 +1,227 @@
+import sys
+import time
+import shlex
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+import Functions.utilities as u
+
+cfg = u.read_config()
+
+# The remote shell receives the whole command as one argument, which Linux caps at 128 KiB (MAX_ARG_STRLEN)
+MAX_COMMAND_LENGTH = 100000
+
+
+class PooledSession:
+    """
+    An open paramiko SSHClient held by the connection pool.
+
+    Exec channels (execute_command) and the SFTP channel are multiplexed over the same
+    paramiko Transport, so switching between 'shell' and 'ftp' methods never reconnects.
+    """
+    def __init__(self, ssh):
+        self.ssh = ssh
+        self.sftp = None
+        self._sftp_lock = threading.Lock()
+
+    def get_sftp(self):
+        """Returns the SFTP channel of this session, opening it on the shared transport on first use."""
+        with self._sftp_lock:
+            if self.sftp is None:
+                self.sftp = self.ssh.open_sftp()
+            return self.sftp
+
+    def is_active(self):
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            if self.sftp is not None:
+                self.sftp.close()
+            self.ssh.close()
+        except Exception as e:
+            print(f"An error occurred while closing pooled connection: {e}")
+        self.sftp = None
+
+
+class SSHConnectionPool:
+    """
+    Process-wide pool of SSH sessions shared by SavioClient, TabeiClient and VMClient.
+
+    Sessions are keyed by (hostname, username), kept alive with transport keepalives and reused across
+    client instances. A session whose transport has dropped is reconnected on the next acquire.
+    """
+    def __init__(self, keepalive_interval=30):
+        self.keepalive_interval = keepalive_interval
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self._sessions = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def acquire(self, hostname, username, connect_fn):
+        """
+        Returns an active session for (hostname, username), calling connect_fn() to open a new SSHClient on a miss.
+
+        :param hostname: Host to connect to
+        :param username: User to connect as
+        :param connect_fn: Callable returning a connected paramiko SSHClient
+        :return: PooledSession
+        """
+        key = (hostname, username)
+        with self._key_lock(key):
+            session = self._sessions.get(key)
+            if session is not None and session.is_active():
+                self.hits += 1
+                return session
+
+            if session is not None:
+                print(f"Pooled connection to {key[0]} dropped, reconnecting...")
+                session.close()
+                self.reconnects += 1
+
+            self.misses += 1
+            ssh = connect_fn()
+            transport = ssh.get_transport()
+            if transport is not None and self.keepalive_interval:
+                transport.set_keepalive(self.keepalive_interval)
+
+            session = PooledSession(ssh)
+            self._sessions[key] = session
+            return session
+
+    def discard(self, key):
+        """Closes and forgets the session for key, if any."""
+        with self._key_lock(key):
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                session.close()
+
+    def close_all(self):
+        for key in list(self._sessions.keys()):
+            self.discard(key)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "open_sessions": len(self._sessions),
+        }
+
+
+pool = SSHConnectionPool(keepalive_interval=cfg.get('ssh', {}).get('keepalive_interval', 30))
+atexit.register(pool.close_all)
+
+
+# Decorator function to ensure a pooled connection for the SSH client methods.
+# The previous connection of the client is restored afterwards so that nested
+# calls across host types (e.g. a 'shell' call inside an 'ftp' method) are safe.
+def ensure_connection(host_type="shell", verbose=False):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            previous = (self.ssh, self.sftp, self.host_type, self.connected)
+
+            if verbose and self.connected and self.host_type == host_type:
+                print("Using existing connection...")
+
+            self.connect(host_type)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                if previous[3]:
+                    self.ssh, self.sftp, self.host_type, self.connected = previous
+        return wrapper
+    return decorator
+
+
+def chunk_command_args(paths, max_command_length=MAX_COMMAND_LENGTH):
+    """
+    Shell-quotes paths and splits them into chunks whose joined length stays below max_command_length.
+
+    :return: List of lists of quoted arguments
+    """
+    chunks = []
+    current = []
+    length = 0
+    for path in paths:
+        arg = shlex.quote(path)
+        if current and length + len(arg) + 1 > max_command_length:
+            chunks.append(current)
+            current, length = [], 0
+        current.append(arg)
+        length += len(arg) + 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def get_folder_total_sizes_batched(ssh, folder_paths, max_command_length=MAX_COMMAND_LENGTH, concurrency=1, delay=0,
+                                   exclude_directories=False):
+    """
+    Returns the total sizes of remote folders with one `du -sb` per folder, all of a chunk run in a
+    single remote shell.
+
+    Every folder gets its own du, so hard links are counted like a separate `du -sb` of that folder would
+    (one du over all folders counts an inode only in the first folder that has it). Folders are chunked so
+    that each command stays below max_command_length, and the chunks run on up to `concurrency` exec
+    channels of the same SSH session.
+
+    :param ssh: Connected paramiko SSHClient
+    :param folder_paths: List of paths to the folders
+    :param max_command_length: Maximum length of a single remote command
+    :param concurrency: Number of chunks executed at the same time
+    :param delay: Seconds to wait after each chunk, to respect login node rate limits
+    :param exclude_directories: Subtract the sizes of the directory entries, which differ between file
+                                systems, so that the totals only count the files
+    :return: Dictionary where keys are folder paths and values are total sizes of the folders in bytes
+    """
+    loop_body = 'du -sb -- "$d"'
+    if exclude_directories:
+        loop_body += """; find "$d" -type d -printf 'D\\t%s\\t%H\\n'"""
+    # room for the loop around the quoted paths
+    chunks = chunk_command_args(folder_paths, max_command_length - len(loop_body) - 32)
+
+    def run_chunk(chunk):
+        stdin, stdout, stderr = ssh.exec_command(f"for d in {' '.join(chunk)}; do {loop_body}; done")
+        output = stdout.read().decode('utf-8')
+        error = stderr.read().decode('utf-8')
+        if error:
+            print(f"An error occurred while getting folder sizes: {error}")
+
+        sizes = {}
+        directory_sizes = {}
+        for line in output.splitlines():
+            if line.startswith('D\t'):
+                _, size, path = line.split('\t', 2)
+                directory_sizes[path] = directory_sizes.get(path, 0) + int(size)
+            else:
+                size, path = line.split('\t', 1)
+                sizes[path] = int(size)
+        for path, size in directory_sizes.items():
+            if path in sizes:
+                sizes[path] -= size
+
+        if delay:
+            time.sleep(delay)
+        return len(chunk), sizes
+
+    folder_total_sizes = {}
+    with tqdm(total=len(folder_paths), desc="Getting folder sizes", file=sys.stdout) as pbar:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for n_folders, sizes in executor.map(run_chunk, chunks):
+                folder_total_sizes.update(sizes)
+                pbar.update(n_folders)
+
+    return folder_total_sizes
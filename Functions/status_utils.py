@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import fcntl
+
+import Functions.utilities as u
+
+cfg = u.read_config()
+
+# Minimal path for setting cells of the status sheet from SLURM jobs and tmux sessions (see Local/update_status.py).
+# Only gspread is imported, the row of a contract is remembered in a local index file, and updates that
+# cannot be sent are queued in a spool file and sent with the next successful update.
+
+SPOOL_PATH = os.path.join(u.root_dir, "Files", "status_spool.jsonl")
+ROW_INDEX_PATH = os.path.join(u.root_dir, "Files", "status_row_index.json")
+STATUS_SHEET_NAME = "status"
+
+
+def _row_key(contract_alias, machine, username):
+    return f"{contract_alias}|{machine}|{username}"
+
+
+def spool_update(contract_alias, machine, username, column, value, spool_path=SPOOL_PATH):
+    """
+    Appends a status update to the spool file, to be sent later by flush_spool.
+    """
+    os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+    entry = {'contract_alias': contract_alias, 'machine': machine, 'username': username,
+             'column': column, 'value': value, 'time': time.time()}
+    with open(spool_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _take_spool(spool_path=SPOOL_PATH):
+    """
+    Returns and empties the spooled updates. The file is locked, so concurrent jobs never send an update twice.
+    """
+    if not os.path.isfile(spool_path):
+        return []
+    with open(spool_path, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        entries = []
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping unreadable spool entry: {line.strip()}")
+        f.seek(0)
+        f.truncate()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return entries
+
+
+def spooled_count(spool_path=SPOOL_PATH):
+    """Returns the number of status updates waiting in the spool file."""
+    if not os.path.isfile(spool_path):
+        return 0
+    with open(spool_path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def warn_if_spooled(spool_path=SPOOL_PATH):
+    """
+    Prints a warning when status updates are still spooled, e.g. at the end of a run whose updates could not
+    be sent: they only reach the sheet with the next update_status.py call on this machine (the generated job
+    scripts run `update_status.py --flush` when they start and end).
+
+    :return: Number of spooled updates
+    """
+    n_spooled = spooled_count(spool_path)
+    if n_spooled:
+        print(f"WARNING: {n_spooled} status updates are not in the status sheet yet, they are spooled in {spool_path}. "
+              f"Run `python Local/update_status.py --flush` on this machine to send them.")
+    return n_spooled
+
+
+class StatusWriter:
+    """
+    Sets cells of the status sheet with as few Sheets API calls as possible: one to check the remembered
+    row of the contract and one batch_update for all cells. The whole sheet is only read when the row
+    is not remembered or has moved.
+    """
+    def __init__(self, spreadsheet_id=None, sheet_name=STATUS_SHEET_NAME, row_index_path=ROW_INDEX_PATH):
+        self.spreadsheet_id = spreadsheet_id or cfg['google_drive']['config_files']['id']
+        self.sheet_name = sheet_name
+        self.row_index_path = row_index_path
+        self._worksheet = None
+        self.index = self._read_index()
+
+    def _read_index(self):
+        if os.path.isfile(self.row_index_path):
+            try:
+                with open(self.row_index_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {'headers': None, 'rows': {}}
+
+    def _write_index(self):
+        os.makedirs(os.path.dirname(self.row_index_path), exist_ok=True)
+        tmp_path = f"{self.row_index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.row_index_path)
+
+    @property
+    def worksheet(self):
+        if self._worksheet is None:
+            import gspread
+            from google.oauth2.service_account import Credentials
+            creds = Credentials.from_service_account_file(os.path.join(u.root_dir, 'Config', 'google_service.json'),
+                                                          scopes=['https://www.googleapis.com/auth/spreadsheets'])
+            self._worksheet = gspread.authorize(creds).open_by_key(self.spreadsheet_id).worksheet(self.sheet_name)
+        return self._worksheet
+
+    def _rebuild_index(self):
+        values = self.worksheet.get_all_values()
+        headers = values[0]
+        contract_idx, machine_idx, user_idx = headers.index('contract_name'), headers.index('machine'), headers.index('user')
+        rows = {}
+        for idx, row in enumerate(values[1:], start=2):  # start=2 for 1-indexed row numbers
+            if len(row) > max(contract_idx, machine_idx, user_idx):
+                rows.setdefault(_row_key(row[contract_idx], row[machine_idx], row[user_idx]), idx)
+        self.index = {'headers': headers, 'rows': rows}
+        self._write_index()
+
+    def _check_row(self, row_index, contract_alias, machine, username):
+        """Reads the key cells of the remembered row, returns True when it still belongs to the contract."""
+        headers = self.index['headers']
+        row = self.worksheet.row_values(row_index)
+        try:
+            return (row[headers.index('contract_name')], row[headers.index('machine')], row[headers.index('user')]) == \
+                (contract_alias, machine, username)
+        except (IndexError, ValueError):
+            return False
+
+    def find_row(self, contract_alias, machine, username):
+        key = _row_key(contract_alias, machine, username)
+        row_index = self.index['rows'].get(key)
+        if row_index is not None and self.index['headers'] and self._check_row(row_index, contract_alias, machine, username):
+            return row_index
+
+        self._rebuild_index()
+        row_index = self.index['rows'].get(key)
+        if row_index is None:
+            # same row layout as StatusSheet.add_contract
+            headers = self.index['headers']
+            new_row_values = [contract_alias, None, machine, username] + [''] * (len(headers) - 4)
+            self.worksheet.append_row(new_row_values)
+            print(f"Contract '{contract_alias}' added with machine '{machine}' and user '{username}'.")
+            self._rebuild_index()
+            row_index = self.index['rows'].get(key)
+        return row_index
+
+    def write(self, updates):
+        """
+        Sends status updates, coalescing repeated updates of the same cell (the last one wins).
+
+        :param updates: List of dictionaries with 'contract_alias', 'machine', 'username', 'column' and 'value'
+        """
+        from gspread.utils import rowcol_to_a1
+
+        cells = {}
+        for update in updates:
+            row_index = self.find_row(update['contract_alias'], update['machine'], update['username'])
+            try:
+                col_index = self.index['headers'].index(update['column']) + 1  # +1 for 1-indexed columns
+            except ValueError:
+                print(f"Column '{update['column']}' not found.")
+                continue
+            cells[(row_index, col_index)] = update['value']
+
+        if cells:
+            data = [{'range': rowcol_to_a1(row, col), 'values': [[value]]} for (row, col), value in cells.items()]
+            self.worksheet.batch_update(data, value_input_option='RAW')  # RAW like GoogleSheet.flush and the sheet mirror
+
+
+def update_status(contract_alias, machine, username, column, value, spool=True):
+    """
+    Sets one status cell, together with any updates left in the spool by earlier failed calls.
+    If the sheet cannot be reached the updates are spooled and sent by the next call.
+
+    :return: True when the updates were sent, False when they were spooled
+    """
+    updates = _take_spool() + [{'contract_alias': contract_alias, 'machine': machine, 'username': username,
+                                 'column': column, 'value': value}]
+    try:
+        StatusWriter().write(updates)
+    except Exception as e:
+        if not spool:
+            raise
+        for update in updates:
+            spool_update(update['contract_alias'], update['machine'], update['username'], update['column'], update['value'])
+        print(f"Could not reach the status sheet ({e}). {len(updates)} status updates spooled in {SPOOL_PATH}.")
+        return False
+
+    if len(updates) > 1:
+        print(f"Sent {len(updates) - 1} spooled status updates.")
+    print(f"Status '{value}' updated for '{contract_alias}' in column '{column}'.")
+    return True
+
+
+def flush_spool():
+    """
+    Sends the spooled status updates, spooling them again when the sheet is still unreachable.
+    """
+    updates = _take_spool()
+    if not updates:
+        return 0
+    try:
+        StatusWriter().write(updates)
+    except Exception as e:
+        for update in updates:
+            spool_update(update['contract_alias'], update['machine'], update['username'], update['column'], update['value'])
+        print(f"Could not reach the status sheet ({e}). {len(updates)} status updates remain spooled.")
+        return 0
+    print(f"Sent {len(updates)} spooled status updates.")
+    return len(updates)
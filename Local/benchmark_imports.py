@@ -0,0 +1,79 @@
+# --- SET PROJECT ROOT
+
+import os
+import sys
+
+# Find the project root directory dynamically
+root_dir = os.path.abspath(__file__)  # Start from the current file's directory
+
+# Traverse upwards until the .project_root file is found or until reaching the system root
+while not os.path.exists(os.path.join(root_dir, '.project_root')) and root_dir != '/':
+    root_dir = os.path.dirname(root_dir)
+
+# Make sure the .project_root file is found
+assert root_dir != '/', "The .project_root file was not found. Make sure it exists in your project root."
+
+sys.path.append(root_dir)
+
+# ---
+
+import time
+import argparse
+import subprocess
+
+# Entry points whose startup cost is paid on every run
+DEFAULT_MODULES = ['main', 'Local.update_status', 'Models.GoogleDrive', 'Models.Savio', 'Models.Tabei', 'Models.GoogleVM']
+
+
+def benchmark_import(module, repeat=3, top=10):
+    """
+    Imports a module in fresh interpreters with `python -X importtime` and reports the wall time
+    and the imports with the largest cumulative time.
+
+    stdin is closed, so a module that still prompts for a password at import time fails instead of hanging.
+
+    :return: Dictionary with 'module', 'seconds' (best of repeat) and 'slowest' (list of tuples (cumulative microseconds, name))
+    """
+    best = None
+    stderr = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=root_dir, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+        if best is None or elapsed < best:
+            best, stderr = elapsed, result.stderr
+
+    # lines look like "import time:       self [us] |     cumulative | imported package"
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name[1:]))
+
+    # only top-level imports, nested ones are indented and part of their parent's cumulative time
+    top_level = [(us, name) for us, name in imports if not name.startswith(" ")]
+    slowest = sorted(top_level, reverse=True)[:top]
+    return {'module': module, 'seconds': best, 'slowest': slowest}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry point modules.")
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per module, the fastest one is reported')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            report = benchmark_import(module, args.repeat, args.top)
+        except RuntimeError as e:
+            print(e)
+            continue
+        print(f"{module}: {report['seconds']:.2f} s")
+        for us, name in report['slowest']:
+            print(f"    {us / 1e6:6.2f} s  {name}")
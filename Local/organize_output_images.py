@@ -45,6 +45,7 @@ def organize_files(contract_alias, machine):
         except:
             swath_files = {}
 
+        pairs = []
         for result_file in results_files:
             result_filename = os.path.basename(result_file['path'])
             if "geojson" in result_filename:
@@ -56,13 +57,16 @@ def organize_files(contract_alias, machine):
                 if result_file['size'] != swath_files[result_filename]['size']:
                     # Sizes are different, replace the file in swaths
                     print(f"Replacing {result_filename} in swaths...")
-                    b.move_file_in_bucket(result_file['path'], dest)
+                    pairs.append((result_file['path'], os.path.join(dest, result_filename)))
             else:
                 # File does not exist in swaths, move it there
                 print(f"Moving {result_filename} to swaths...")
-                b.move_file_in_bucket(result_file['path'], dest)
+                pairs.append((result_file['path'], os.path.join(dest, result_filename)))
+
+        report = b.move_files_in_bucket(pairs)
+        return report
+
 
-        
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Move images to folder in results folder.")
@@ -71,4 +75,12 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
-    organize_files(args.contract_alias, args.machine)
+    report = organize_files(args.contract_alias, args.machine) or {}
+
+    # a failed move must fail the stage, like the exception the sequential moves used to raise
+    failed = [(source_path, result['destination'], result['error']) for source_path, result in report.items() if result['status'] == 'failed']
+    if failed:
+        print(f"{len(failed)} files could not be moved:")
+        for source_path, destination_path, error in failed:
+            print(f"  {source_path} -> {destination_path}: {error}")
+        sys.exit(1)
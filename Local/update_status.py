@@ -17,41 +17,37 @@ sys.path.append(root_dir)
 
 # ---
 
-import glob
 import argparse
-from paramiko import SSHClient
-from tqdm import tqdm
-from paramiko import SSHClient
-import getpass
-import subprocess
-from Models.GoogleDrive import StatusSheet, Status
 
-import Functions.utilities as u
-
-cfg = u.read_config()
-
-
-status_db = StatusSheet(cfg['google_drive']['config_files']['id'], "status")
+# Runs at the end of every SLURM stage: keep the imports minimal (no pandas, no Google Drive client)
+from Functions.status_utils import update_status as send_status_update, flush_spool, warn_if_spooled
 
 
 def update_status(contract_alias, country, machine, username, column, value):
-
-    contract_status = Status(status_db, contract_alias, machine, username, country)
-    contract_status.update_status(column, value)
+    # country is accepted for compatibility with the existing callers, the status row is keyed without it
+    return send_status_update(contract_alias, machine, username, column, value)
 
         
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Update status in Google Sheet")
-    parser.add_argument('--contract_alias', type=str, help='Contract alias of row to be updated', required=True)
-    parser.add_argument('--country', type=str, help='country', required=True)
-    parser.add_argument('--machine', type=str, help='Machine of row to be updated', required=True)
-    parser.add_argument('--username', type=str, help='Username of row to be updated', required=True)
-    parser.add_argument('--column', type=str, help='Column to be updated', required=True)
-    parser.add_argument('--value', type=str, help='Value to be set', required=True)
+    parser.add_argument('--contract_alias', type=str, help='Contract alias of row to be updated')
+    parser.add_argument('--country', type=str, help='country')
+    parser.add_argument('--machine', type=str, help='Machine of row to be updated')
+    parser.add_argument('--username', type=str, help='Username of row to be updated')
+    parser.add_argument('--column', type=str, help='Column to be updated')
+    parser.add_argument('--value', type=str, help='Value to be set')
+    parser.add_argument('--flush', action='store_true', help='Only send the status updates left in the spool file')
 
     args = parser.parse_args()
 
-    update_status(args.contract_alias, args.country, args.machine, args.username, args.column, args.value)
+    if args.flush:
+        flush_spool()
+    else:
+        missing = [name for name in ['contract_alias', 'country', 'machine', 'username', 'column', 'value'] if getattr(args, name) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join('--' + name for name in missing)}")
+        update_status(args.contract_alias, args.country, args.machine, args.username, args.column, args.value)
 
-    
\ No newline at end of file
+    # the exit code stays 0 (the stage itself succeeded), but updates left in the spool must not go unnoticed
+    warn_if_spooled()
@@ -0,0 +1,294 @@
+# --- SET PROJECT ROOT
+
+import os
+import sys
+
+# Find the project root directory dynamically
+root_dir = os.path.abspath(__file__)  # Start from the current file's directory
+
+# Traverse upwards until the .project_root file is found or until reaching the system root
+while not os.path.exists(os.path.join(root_dir, '.project_root')) and root_dir != '/':
+    root_dir = os.path.dirname(root_dir)
+
+# Make sure the .project_root file is found
+assert root_dir != '/', "The .project_root file was not found. Make sure it exists in your project root."
+
+sys.path.append(root_dir)
+
+# ---
+
+import json
+import time
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+import Functions.utilities as u
+
+cfg = u.read_config()
+
+drive_cfg = cfg.get('google_drive', {})
+UPLOAD_WORKERS = drive_cfg.get('upload_workers', 4)
+UPLOAD_SESSION_PATH = os.path.join(root_dir, drive_cfg.get('upload_session_path', os.path.join("Files", "drive_upload_sessions.json")))
+
+# Chunks must be multiples of 256 KiB. Uploads start with small chunks, so the session URI is saved early,
+# and the chunk size then follows the measured throughput so that one chunk takes about CHUNK_TARGET_SECONDS.
+CHUNK_ALIGNMENT = 256 * 1024
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024 * 1024
+CHUNK_TARGET_SECONDS = 10
+
+
+def adapt_chunk_size(bytes_sent, seconds, target_seconds=CHUNK_TARGET_SECONDS):
+    """
+    Returns the chunk size that is expected to take target_seconds at the throughput of the last chunk.
+    """
+    if seconds <= 0:
+        return MAX_CHUNK_SIZE
+    size = int(bytes_sent / seconds * target_seconds) // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size))
+
+
+class UploadSessions:
+    """
+    Resumable upload session URIs kept in a JSON file, so that an interrupted upload continues where it
+    stopped after a restart. A session is only reused for the same file, size and modification time.
+
+    Several upload processes can share the file (e.g. one upload_archive.py per contract): every change
+    takes an exclusive lock, reads the file again and only changes its own key.
+    """
+    def __init__(self, path=UPLOAD_SESSION_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_path, folder_id, file_name):
+        return f"{os.path.abspath(file_path)}|{folder_id}|{file_name}"
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the upload sessions in {self.path}: {e}")
+            return {}
+
+    def _update(self, key, session):
+        """Sets (or removes, when session is None) one session, merging with the changes of other processes."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                sessions = self._read()
+                if session is None:
+                    if sessions.pop(key, None) is None:
+                        return
+                else:
+                    sessions[key] = session
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(sessions, f, indent=2)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key, file_path):
+        session = self._read().get(key)
+        if session is None:
+            return None
+        st = os.stat(file_path)
+        if session['size'] != st.st_size or session['mtime'] != st.st_mtime:
+            # the file changed since the upload started
+            self.remove(key)
+            return None
+        return session
+
+    def save(self, key, file_path, uri, file_id=None):
+        st = os.stat(file_path)
+        self._update(key, {'uri': uri, 'size': st.st_size, 'mtime': st.st_mtime, 'file_id': file_id})
+
+    def remove(self, key):
+        self._update(key, None)
+
+
+_media_class = None
+
+
+def adaptive_media_upload(file_path, mime_type, chunk_size):
+    """
+    Returns a resumable MediaFileUpload whose chunk size can be changed between chunks through its
+    `adaptive_chunksize` attribute (HttpRequest.next_chunk asks media.chunksize() for every chunk).
+    """
+    global _media_class
+    if _media_class is None:
+        from googleapiclient.http import MediaFileUpload
+
+        class AdaptiveMediaFileUpload(MediaFileUpload):
+            def chunksize(self):
+                return self.adaptive_chunksize
+
+        _media_class = AdaptiveMediaFileUpload
+
+    media = _media_class(file_path, mimetype=mime_type, chunksize=chunk_size, resumable=True)
+    media.adaptive_chunksize = chunk_size
+    return media
+
+
+def query_upload_offset(request, uri, size):
+    """
+    Asks Drive how much of a resumable upload it already received, with an empty PUT carrying
+    'Content-Range: bytes */size'.
+
+    :return: Tuple (offset, response). response is the file resource when the upload already completed,
+             offset is None when the session no longer exists.
+    """
+    resp, content = request.http.request(uri, method='PUT', headers={'Content-Range': f"bytes */{size}", 'Content-Length': '0'})
+    if resp.status in (200, 201):
+        return size, json.loads(content)
+    if resp.status == 308:
+        # 'range: bytes=0-N' are the bytes received so far, no header means none
+        received = resp.get('range')
+        return (int(received.split('-')[-1]) + 1 if received else 0), None
+    if resp.status in (404, 410):
+        return None, None
+    raise RuntimeError(f"Unexpected answer {resp.status} to the upload status query: {content[:200]!r}")
+
+
+class DriveUploadManager:
+    """
+    Uploads files to Google Drive with resumable uploads, several files at a time.
+
+    The session URI of every upload is saved to disk after its first chunk, and an upload that finds a saved
+    session asks Drive how many bytes it already has and continues from there. Progress is reported as one
+    bar with the aggregate throughput of all workers.
+    """
+    def __init__(self, drive, workers=UPLOAD_WORKERS, session_path=UPLOAD_SESSION_PATH):
+        """
+        :param drive: GoogleDriveService used for the existence checks and the API clients (one per worker thread)
+        :param workers: Number of files uploaded at the same time
+        :param session_path: JSON file in which the resumable session URIs are kept
+        """
+        self.drive = drive
+        self.workers = workers
+        self.sessions = UploadSessions(session_path)
+        self._lock = threading.Lock()
+        self._progress = None
+
+    def _advance(self, n_bytes):
+        with self._lock:
+            if self._progress is not None:
+                self._progress.update(n_bytes)
+
+    def _build_request(self, file_name, file_path, mime_type, folder_id, existing_file_id, chunk_size):
+        service = self.drive.build()
+        media = adaptive_media_upload(file_path, mime_type, chunk_size)
+        if existing_file_id:
+            return service.files().update(fileId=existing_file_id, media_body=media, fields='id'), media
+        file_metadata = {'name': file_name, 'parents': [folder_id]}
+        return service.files().create(body=file_metadata, media_body=media, fields='id'), media
+
+    def upload_one(self, file_path, folder_id, file_name=None, mime_type='application/octet-stream', overwrite=False):
+        """
+        Uploads one file, resuming a saved session when there is one.
+
+        :return: Dictionary with 'file_id', 'status' ('uploaded', 'overwritten', 'skipped' or 'failed'), 'resumed',
+                 'bytes_sent' (bytes sent by this call) and 'error'
+        """
+        file_name = file_name or os.path.basename(file_path)
+        key = UploadSessions.key(file_path, folder_id, file_name)
+        session = self.sessions.get(key, file_path)
+
+        existing_file_id = None
+        if session is not None:
+            existing_file_id = session['file_id']
+        else:
+            existing_file_id = self.drive.file_exists(file_name, folder_id)
+            if existing_file_id and not overwrite:
+                print(f"File '{file_name}' already exists. Skipping upload.")
+                self._advance(os.path.getsize(file_path))
+                return {'file_id': existing_file_id, 'status': 'skipped', 'resumed': False, 'bytes_sent': 0, 'error': None}
+
+        request, media = self._build_request(file_name, file_path, mime_type, folder_id, existing_file_id, MIN_CHUNK_SIZE)
+        status = 'overwritten' if existing_file_id else 'uploaded'
+        resumed = False
+        response = None
+        progress = 0  # bytes Drive has received
+        bytes_sent = 0
+        try:
+            if session is not None:
+                offset, response = query_upload_offset(request, session['uri'], media.size())
+                if offset is None:
+                    # the session expired (Drive keeps them for about a week), start over
+                    print(f"Upload session of '{file_name}' expired, restarting the upload.")
+                    self.sessions.remove(key)
+                    return self.upload_one(file_path, folder_id, file_name, mime_type, overwrite)
+                # continue from the first byte Drive does not have
+                request.resumable_uri = session['uri']
+                request.resumable_progress = offset
+                progress = offset
+                self._advance(offset)
+                resumed = True
+
+            while response is None:
+                start = time.perf_counter()
+                _, response = request.next_chunk(num_retries=3)
+                elapsed = time.perf_counter() - start
+
+                done = media.size() if response is not None else request.resumable_progress
+                sent, progress = done - progress, done
+                bytes_sent += sent
+                self._advance(sent)
+                if session is None:
+                    self.sessions.save(key, file_path, request.resumable_uri, existing_file_id)
+                    session = True
+                media.adaptive_chunksize = adapt_chunk_size(sent, elapsed)
+        except Exception as e:
+            # the session is kept, the next run resumes the upload
+            return {'file_id': None, 'status': 'failed', 'resumed': resumed, 'bytes_sent': bytes_sent, 'error': str(e)}
+
+        self.sessions.remove(key)
+        file_id = response.get('id')
+        if not existing_file_id:
+            self.drive._add_child(folder_id, file_name, file_id, mime_type)
+        return {'file_id': file_id, 'status': status, 'resumed': resumed, 'bytes_sent': bytes_sent, 'error': None}
+
+    def upload(self, files, overwrite=False):
+        """
+        Uploads files concurrently.
+
+        :param files: List of dictionaries with 'file_path', 'folder_id' and optionally 'file_name' and 'mime_type'
+        :param overwrite: Replace files that already exist in the destination folder instead of skipping them
+        :return: Dictionary {file_path: result of upload_one}, the aggregate throughput is printed at the end
+        """
+        total_bytes = sum(os.path.getsize(f['file_path']) for f in files)
+        results = {}
+        start = time.perf_counter()
+
+        with tqdm(total=total_bytes, unit='B', unit_scale=True, unit_divisor=1024, desc="Uploading to Drive", file=sys.stdout) as progress:
+            self._progress = progress
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(files)))) as executor:
+                    futures = {executor.submit(self.upload_one, f['file_path'], f['folder_id'], f.get('file_name'),
+                                               f.get('mime_type', 'application/octet-stream'), overwrite): f['file_path']
+                               for f in files}
+                    for future in as_completed(futures):
+                        file_path = futures[future]
+                        try:
+                            results[file_path] = future.result()
+                        except Exception as e:
+                            results[file_path] = {'file_id': None, 'status': 'failed', 'resumed': False, 'bytes_sent': 0, 'error': str(e)}
+                        if results[file_path]['status'] == 'failed':
+                            print(f"Failed to upload {file_path}: {results[file_path]['error']}")
+            finally:
+                self._progress = None
+
+        elapsed = time.perf_counter() - start
+        # bytes sent by this run, without the parts of resumed uploads that Drive already had
+        sent = sum(r['bytes_sent'] for r in results.values())
+        n_failed = sum(r['status'] == 'failed' for r in results.values())
+        print(f"Uploaded {sent / 1024 ** 2:.1f} MB in {elapsed:.1f} s ({sent / 1024 ** 2 / max(elapsed, 1e-9):.1f} MB/s), "
+              f"{len(files) - n_failed}/{len(files)} files done.")
+        return results
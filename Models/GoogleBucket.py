@@ -20,15 +20,23 @@ sys.path.append(root_dir)
 import subprocess
 from tqdm import tqdm
 import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import Functions.utilities as u
+from Models.GoogleBucketBackends import get_backend
 
 cfg = u.read_config()
 
+MOVE_WORKERS = cfg.get('bucket', {}).get('move_workers', 16)
+
 
 class GoogleBucket:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, backend=None) -> None:
+        """
+        :param backend: Storage backend name ('native', 'gsutil', 'local' or 'auto'), defaults to bucket.backend in config.yml
+        """
+        self.backend = get_backend(backend)
 
 
     def convert_to_bucket_paths(self, directories, country):
@@ -49,39 +57,82 @@ class GoogleBucket:
         
 
     def get_bucket_folder_sizes(self, bucket_path):
-        result = subprocess.run(["gsutil", "du", "-s", bucket_path], capture_output=True, text=True)
-        output = result.stdout
+        objects, _ = self.backend.list([bucket_path])
+        return {bucket_path: sum(obj['size'] for obj in objects)}
 
-        # Process the output to get sizes
-        sizes = {}
-        for line in output.splitlines():
-            size, path = line.split()
-            sizes[path] = int(size)
-        return sizes
 
+    def get_bucket_folders_stats(self, bucket_paths):
+        """
+        Returns total size and file count of many bucket folders from one streamed recursive listing per parent prefix.
+        Contract folders all live under the same `<images>/<country>` prefix, so this is usually a single listing.
 
-    def get_bucket_folders_total_sizes(self, bucket_paths):
-        folder_total_sizes = {}
-        with tqdm(total=len(bucket_paths), desc="Getting folder sizes", file=sys.stdout) as pbar:
-            for bucket_path in bucket_paths:
+        :param bucket_paths: List of bucket folder paths
+        :return: Dictionary where keys are folder paths and values are dictionaries {'size': int, 'count': int}
+        """
+        # group the folders by their parent prefix, keyed by folder name
+        parents = {}
+        for bucket_path in bucket_paths:
+            parent, name = bucket_path.rstrip('/').rsplit('/', 1)
+            parents.setdefault(parent, {})[name] = bucket_path
+
+        folder_stats = {bucket_path: {'size': 0, 'count': 0} for bucket_path in bucket_paths}
+        with tqdm(desc="Listing bucket objects", unit=" objects", file=sys.stdout) as pbar:
+            for parent, folders in parents.items():
                 try:
-                    # Ensure the path ends with '/*' to include all files in the folder
-                    full_path = f"{bucket_path.rstrip('/')}/*"
-                    result = subprocess.run(["gsutil", "du", "-s", full_path], capture_output=True, text=True)
-                    output = result.stdout.strip()
-
-                    if output:  # Check if there's any output
-                        size, _ = output.split()
-                        folder_total_sizes[bucket_path] = int(size)
-                    else:
-                        print(f"No size information available for {bucket_path}")
+                    for obj in self.backend.iter_objects(parent):
+                        name = obj['path'][len(parent) + 1:].split('/', 1)[0]
+                        bucket_path = folders.get(name)
+                        if bucket_path is not None:
+                            folder_stats[bucket_path]['size'] += obj['size']
+                            folder_stats[bucket_path]['count'] += 1
+                        pbar.update(1)
                 except Exception as e:
-                    print(f"An error occurred while accessing {bucket_path}: {e}")
-                finally:
-                    pbar.update(1)  # Update progress
+                    print(f"An error occurred while accessing {parent}: {e}")
+        return folder_stats
+
+
+    def get_bucket_folders_total_sizes(self, bucket_paths):
+        folder_total_sizes = {}
+        for bucket_path, stats in self.get_bucket_folders_stats(bucket_paths).items():
+            if stats['count'] > 0:  # Check if there's anything in the folder
+                folder_total_sizes[bucket_path] = stats['size']
+            else:
+                print(f"No size information available for {bucket_path}")
         return folder_total_sizes
 
 
+    def get_bucket_manifest(self, bucket_paths, with_hashes=False):
+        """
+        Lists path, size and creation time of every object inside the given bucket folders, subfolders included.
+
+        :param bucket_paths: List of bucket folder paths
+        :param with_hashes: Also fetch the MD5 and CRC32C stored by GCS for each object (composite objects only have a CRC32C)
+        :return: Dictionary where keys are folder paths and values are dictionaries
+                 {object path relative to the folder: {'size', 'mtime'[, 'md5', 'crc32c']}}, like get_remote_manifest
+        """
+        folder_keys = {bucket_path.rstrip('/'): bucket_path for bucket_path in bucket_paths}
+        manifest = {bucket_path: {} for bucket_path in bucket_paths}
+
+        objects, _ = self.backend.list(bucket_paths, recursive=True, with_hashes=with_hashes)
+
+        for obj in objects:
+            # placeholder objects of empty "folders" are not files
+            if obj['path'].endswith('/'):
+                continue
+            # the listed folder is the closest parent of the object that was asked for
+            folder = os.path.dirname(obj['path'])
+            while folder not in folder_keys and folder.count('/') > 2:
+                folder = os.path.dirname(folder)
+            key = folder_keys.get(folder)
+            if key is not None:
+                entry = {'size': obj['size'], 'mtime': obj['created']}
+                if with_hashes:
+                    entry.update({algorithm: obj[algorithm] for algorithm in ('md5', 'crc32c') if obj.get(algorithm) is not None})
+                manifest[key][obj['path'][len(folder) + 1:]] = entry
+
+        return manifest
+
+
     def download_files_from_bucket(self, bucket_paths, local_dest, max_retries=3, wait_seconds=5):
         # Ensure that bucket_paths is a list
         if not isinstance(bucket_paths, list):
@@ -137,11 +188,11 @@ class GoogleBucket:
 
                 # Check if the gs_path exists
                 try:
-                    result = subprocess.run(["gsutil", "ls", gs_path], check=True, capture_output=True, text=True)
-                    if not result.stdout.strip():
+                    objects, _ = self.backend.list([gs_path])
+                    if not objects:
                         print(f"No objects found at {gs_path}. Skipping download.")
                         continue
-                except subprocess.CalledProcessError:
+                except Exception:
                     print(f"Failed to list contents of {gs_path}. Skipping download.")
                     continue
 
@@ -175,13 +226,11 @@ class GoogleBucket:
             gs_dir += '/'
 
         try:
-            # Run the gsutil ls command
-            result = subprocess.run(["gsutil", "ls", gs_dir], capture_output=True, text=True, check=True)
-            # Split the output into lines and filter out empty lines
-            files = [line for line in result.stdout.split('\n') if line]
+            objects, prefixes = self.backend.list([gs_dir], recursive=False)
+            files = sorted([obj['path'] for obj in objects] + prefixes)
             files = [x for x in files if x != gs_dir]
             return files
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             raise RuntimeError(f"An error occurred while listing the directory: {e}")
 
 
@@ -193,20 +242,16 @@ class GoogleBucket:
             gs_dir += '/'
 
         try:
-            result = subprocess.run(["gsutil", "ls", "-l", gs_dir], capture_output=True, text=True, check=True)
-            lines = result.stdout.strip().split('\n')
-            
+            objects, _ = self.backend.list([gs_dir], recursive=False)
+
             files_details = []
-            for line in lines[:-1]:  # Skip the last line which is a total size
-                parts = line.split()
-                if len(parts) >= 3:
-                    size = int(parts[0])
-                    created = parts[1] 
-                    path = parts[2]
-                    files_details.append({'size': size, 'created': created, 'path': path})
+            for obj in sorted(objects, key=lambda x: x['path']):
+                # same format as `gsutil ls -l`, e.g. 2024-05-01T12:00:00Z
+                created = datetime.fromtimestamp(obj['created'], tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                files_details.append({'size': obj['size'], 'created': created, 'path': obj['path']})
             files_details = [x for x in files_details if x['path'] != gs_dir]
             return files_details
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             raise RuntimeError(f"An error occurred while listing the directory: {e}")
 
 
@@ -229,13 +274,52 @@ class GoogleBucket:
         filename = os.path.basename(source_path)
         destination_path = os.path.join(destination_folder, filename)
 
-        try:
-            # Run the gsutil mv command
-            subprocess.run(["gsutil", "mv", source_path, destination_path], check=True)
-            # print(f"Moved {source_path} to {destination_path} successfully.")
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to move {source_path}: {e}.")
-            raise
+        error = self.backend.move([(source_path, destination_path)])[source_path]
+        if error is not None:
+            print(f"Failed to move {source_path}: {error}.")
+            raise RuntimeError(f"Failed to move {source_path}: {error}")
+
+    def move_files_in_bucket(self, pairs, workers=None, max_retries=3, wait_seconds=2):
+        """
+        Moves many objects concurrently. Each object is copied server-side and then deleted, and retried independently.
+
+        :param pairs: List of tuples (source_path, destination_path) of full object paths
+        :param workers: Number of concurrent moves (defaults to bucket.move_workers in config.yml)
+        :param max_retries: Attempts per object
+        :param wait_seconds: Seconds to wait between attempts, doubled after each failure
+        :return: Dictionary {source_path: {'destination': str, 'status': 'moved' or 'failed', 'attempts': int, 'error': str or None}}
+        """
+        for source_path, destination_path in pairs:
+            if not source_path.startswith('gs://') or not destination_path.startswith('gs://'):
+                raise ValueError("Invalid Google Cloud Storage paths. Must start with 'gs://'.")
+
+        def move(source_path, destination_path):
+            error = None
+            for attempt in range(1, max_retries + 1):
+                error = self.backend.move([(source_path, destination_path)])[source_path]
+                if error is None:
+                    return {'destination': destination_path, 'status': 'moved', 'attempts': attempt, 'error': None}
+                if attempt < max_retries:
+                    time.sleep(wait_seconds * 2 ** (attempt - 1))
+            return {'destination': destination_path, 'status': 'failed', 'attempts': max_retries, 'error': error}
+
+        report = {}
+        if not pairs:
+            return report
+
+        with tqdm(total=len(pairs), desc="Moving files", file=sys.stdout) as pbar:
+            with ThreadPoolExecutor(max_workers=min(workers or MOVE_WORKERS, len(pairs))) as executor:
+                futures = {executor.submit(move, *pair): pair[0] for pair in pairs}
+                for future in as_completed(futures):
+                    report[futures[future]] = future.result()
+                    pbar.update(1)
+
+        n_failed = sum(1 for result in report.values() if result['status'] == 'failed')
+        print(f"Moved {len(pairs) - n_failed} of {len(pairs)} files.")
+        for source_path, result in report.items():
+            if result['status'] == 'failed':
+                print(f"Failed to move {source_path}: {result['error']}.")
+        return report
 
     def delete_from_bucket(self, gs_paths):
         """
@@ -246,17 +330,17 @@ class GoogleBucket:
         if not isinstance(gs_paths, list):
             raise ValueError("gs_paths must be a list")
 
+        valid_paths = []
         for gs_path in gs_paths:
             if gs_path.startswith('gs://'):
-                print(f"Deleting {gs_path}...")
-
-                try:
-                    # Add '-r' for recursive deletion and '-f' to ignore non-existent objects
-                    subprocess.run(["gsutil", "-m", "rm", "-r", "-f", gs_path], check=True)
-                    print(f"Deleted {gs_path} successfully.")
-                except subprocess.CalledProcessError as e:
-                    print(f"Failed to delete {gs_path}: {e}.")
+                valid_paths.append(gs_path)
             else:
                 print(f"Skipping {gs_path}, not a valid Google Cloud Storage path.")
 
+        if valid_paths:
+            print(f"Deleting {len(valid_paths)} paths...")
+            for gs_path, error in self.backend.delete(valid_paths).items():
+                if error is not None:
+                    print(f"Failed to delete {gs_path}: {error}.")
+
         print("Deletion complete.")
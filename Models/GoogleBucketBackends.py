@@ -0,0 +1,391 @@
+# --- SET PROJECT ROOT
+
+import os
+import sys
+
+# Find the project root directory dynamically
+root_dir = os.path.abspath(__file__)  # Start from the current file's directory
+
+# Traverse upwards until the .project_root file is found or until reaching the system root
+while not os.path.exists(os.path.join(root_dir, '.project_root')) and root_dir != '/':
+    root_dir = os.path.dirname(root_dir)
+
+# Make sure the .project_root file is found
+assert root_dir != '/', "The .project_root file was not found. Make sure it exists in your project root."
+
+sys.path.append(root_dir)
+
+# ---
+
+import subprocess
+import hashlib
+import shutil
+import base64
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import Functions.utilities as u
+
+cfg = u.read_config()
+
+# Maximum number of calls in one GCS JSON API batch request
+GCS_BATCH_SIZE = 100
+# Number of paths passed to a single gsutil command
+GSUTIL_ARGS_PER_CALL = 500
+# What gsutil prints when a listed folder does not exist, the only error a listing tolerates
+GSUTIL_NO_MATCH = "matched no objects"
+
+
+def split_gs_path(gs_path):
+    """
+    Splits 'gs://bucket/some/prefix' into ('bucket', 'some/prefix').
+    """
+    if not gs_path.startswith('gs://'):
+        raise ValueError("Invalid Google Cloud Storage path. Must start with 'gs://'.")
+    bucket_name, _, name = gs_path[len('gs://'):].partition('/')
+    return bucket_name, name
+
+
+def check_gsutil_listing(returncode, args, stdout, stderr):
+    """
+    Raises CalledProcessError when a `gsutil ls` failed for any other reason than folders without objects.
+    """
+    if returncode != 0 and GSUTIL_NO_MATCH not in stderr:
+        raise subprocess.CalledProcessError(returncode, args, stdout, stderr)
+
+
+def folder_prefix(gs_path):
+    """Returns the path with exactly one trailing slash, so that listings only match objects inside the folder."""
+    return gs_path.rstrip('/') + '/'
+
+
+"""
+Backends implement the storage primitives used by GoogleBucket. Objects are returned as dictionaries
+{'path': 'gs://...', 'size': int, 'created': epoch seconds, 'md5': hex digest or None, 'crc32c': hex digest or None}.
+Hashes are only filled in by listings with_hashes; composite objects have a CRC32C but no MD5.
+
+    list(gs_dirs, recursive=True, with_hashes=False) -> (objects, prefixes)
+        Lists the objects inside the folders. Non-recursive listings also return the sub-folder prefixes.
+    iter_objects(gs_dir) -> generator of objects
+        Streams every object below the folder, without holding the whole listing in memory.
+    delete(gs_paths) -> dict {gs_path: None or error message}
+        Deletes objects, or folders with everything inside them (paths ending with '/' are always folders).
+    move(pairs) -> dict {source_path: None or error message}
+        Moves objects given as tuples (source_path, destination_path).
+"""
+
+
+class GsutilBackend:
+    """
+    Runs the gsutil command line tool in a subprocess. Used when the google-cloud-storage package is not installed.
+    """
+    name = "gsutil"
+
+    def list(self, gs_dirs, recursive=True, with_hashes=False):
+        # 'folder/**' lists every object below the folder; 'folder/' lists its objects and sub-folder prefixes,
+        # except with -L which needs 'folder/*' to expand the objects
+        pattern = "**" if recursive else ("*" if with_hashes else "")
+        urls = [folder_prefix(gs_dir) + pattern for gs_dir in gs_dirs]
+        # folders that do not exist make gsutil exit non-zero but the rest is still listed, any other error raises
+        result = subprocess.run(["gsutil", "ls", "-L" if with_hashes else "-l"] + urls, capture_output=True, text=True)
+        check_gsutil_listing(result.returncode, result.args, result.stdout, result.stderr)
+
+        if with_hashes:
+            return self._parse_ls_long_listing(result.stdout), []
+
+        objects = []
+        prefixes = []
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) == 1 and parts[0].startswith('gs://') and parts[0].endswith('/'):
+                prefixes.append(parts[0])
+            else:
+                obj = self._parse_ls_line(parts)
+                if obj is not None:
+                    objects.append(obj)
+        return objects, prefixes
+
+    def iter_objects(self, gs_dir):
+        process = subprocess.Popen(["gsutil", "ls", "-l", folder_prefix(gs_dir) + "**"],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            for line in process.stdout:
+                obj = self._parse_ls_line(line.split())
+                if obj is not None:
+                    yield obj
+        finally:
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            process.wait()
+        check_gsutil_listing(process.returncode, process.args, None, stderr)
+
+    def _parse_ls_line(self, parts):
+        """
+        Parses one split line of `gsutil ls -l`, returning None for the TOTAL line and sub-folder prefixes.
+        """
+        if len(parts) != 3 or not parts[2].startswith('gs://'):
+            return None
+        size, created, path = parts
+        return {
+            'path': path,
+            'size': int(size),
+            'created': datetime.fromisoformat(created.replace('Z', '+00:00')).timestamp(),
+            'md5': None,
+            'crc32c': None,
+        }
+
+    def _parse_ls_long_listing(self, output):
+        """
+        Parses the output of `gsutil ls -L` into a list of objects.
+        """
+        objects = []
+        entry = None
+        for line in output.splitlines():
+            if line.startswith('gs://') and line.endswith(':'):
+                if entry is not None and 'size' in entry:
+                    objects.append(entry)
+                entry = {'path': line[:-1], 'created': 0.0, 'md5': None, 'crc32c': None}
+            elif entry is not None and ':' in line:
+                field, value = [x.strip() for x in line.split(':', 1)]
+                if field == 'Content-Length':
+                    entry['size'] = int(value)
+                elif field == 'Creation time':
+                    entry['created'] = parsedate_to_datetime(value).timestamp()
+                elif field == 'Hash (md5)':
+                    entry['md5'] = base64.b64decode(value).hex()
+                elif field == 'Hash (crc32c)':
+                    entry['crc32c'] = base64.b64decode(value).hex()
+        if entry is not None and 'size' in entry:
+            objects.append(entry)
+        return objects
+
+    def delete(self, gs_paths):
+        results = {}
+        # one `gsutil -m rm` per chunk of paths instead of one process per path
+        for i in range(0, len(gs_paths), GSUTIL_ARGS_PER_CALL):
+            chunk = gs_paths[i:i + GSUTIL_ARGS_PER_CALL]
+            try:
+                # Add '-r' for recursive deletion and '-f' to ignore non-existent objects
+                subprocess.run(["gsutil", "-m", "rm", "-r", "-f"] + chunk, check=True)
+                error = None
+            except subprocess.CalledProcessError as e:
+                error = str(e)
+            results.update({gs_path: error for gs_path in chunk})
+        return results
+
+    def move(self, pairs):
+        results = {}
+        for source_path, destination_path in pairs:
+            try:
+                subprocess.run(["gsutil", "mv", source_path, destination_path], check=True)
+                results[source_path] = None
+            except subprocess.CalledProcessError as e:
+                results[source_path] = str(e)
+        return results
+
+
+class NativeBackend:
+    """
+    Uses the google-cloud-storage client in-process: paginated list-objects calls, batched deletes and server-side copies.
+    """
+    name = "native"
+
+    def __init__(self):
+        from google.cloud import storage
+        self.client = storage.Client()
+
+    def _to_object(self, bucket_name, blob):
+        return {
+            'path': f"gs://{bucket_name}/{blob.name}",
+            'size': blob.size,
+            'created': blob.time_created.timestamp() if blob.time_created else 0.0,
+            'md5': base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None,
+            'crc32c': base64.b64decode(blob.crc32c).hex() if blob.crc32c else None,
+        }
+
+    def list(self, gs_dirs, recursive=True, with_hashes=False):
+        objects = []
+        prefixes = []
+        for gs_dir in gs_dirs:
+            bucket_name, prefix = split_gs_path(folder_prefix(gs_dir))
+            # the iterator follows nextPageToken, so listings are never truncated at the first page
+            blobs = self.client.list_blobs(bucket_name, prefix=prefix, delimiter=None if recursive else '/', page_size=1000)
+            for blob in blobs:
+                if blob.name != prefix:
+                    objects.append(self._to_object(bucket_name, blob))
+            prefixes += [f"gs://{bucket_name}/{p}" for p in sorted(blobs.prefixes)]
+        return objects, prefixes
+
+    def iter_objects(self, gs_dir):
+        bucket_name, prefix = split_gs_path(folder_prefix(gs_dir))
+        for blob in self.client.list_blobs(bucket_name, prefix=prefix, page_size=1000):
+            if blob.name != prefix:
+                yield self._to_object(bucket_name, blob)
+
+    def _delete_names(self, bucket, names):
+        """Deletes known object names, GCS_BATCH_SIZE per batch request."""
+        for i in range(0, len(names), GCS_BATCH_SIZE):
+            with self.client.batch():
+                for name in names[i:i + GCS_BATCH_SIZE]:
+                    bucket.delete_blob(name)
+
+    def delete(self, gs_paths):
+        from google.api_core.exceptions import NotFound
+
+        results = {}
+        folders = [gs_path for gs_path in gs_paths if gs_path.endswith('/')]
+        objects = {}
+        for gs_path in gs_paths:
+            if not gs_path.endswith('/'):
+                bucket_name, name = split_gs_path(gs_path)
+                objects.setdefault(bucket_name, []).append((gs_path, name))
+
+        # object paths are deleted directly, without listing them first
+        for bucket_name, items in objects.items():
+            bucket = self.client.bucket(bucket_name)
+            for i in range(0, len(items), GCS_BATCH_SIZE):
+                chunk = items[i:i + GCS_BATCH_SIZE]
+                try:
+                    self._delete_names(bucket, [name for _, name in chunk])
+                    results.update({gs_path: None for gs_path, _ in chunk})
+                except NotFound:
+                    # some path of the batch is not an object: retry them one by one and treat those as folders
+                    for gs_path, name in chunk:
+                        try:
+                            bucket.delete_blob(name)
+                            results[gs_path] = None
+                        except NotFound:
+                            folders.append(gs_path)
+                        except Exception as e:
+                            results[gs_path] = str(e)
+                except Exception as e:
+                    results.update({gs_path: str(e) for gs_path, _ in chunk})
+
+        # folders are listed to find the objects inside them
+        for gs_path in folders:
+            bucket_name, name = split_gs_path(gs_path)
+            try:
+                names = [blob.name for blob in self.client.list_blobs(bucket_name, prefix=folder_prefix(name), page_size=1000)]
+                self._delete_names(self.client.bucket(bucket_name), names)
+                results[gs_path] = None
+            except Exception as e:
+                results[gs_path] = str(e)
+        return results
+
+    def move(self, pairs):
+        results = {}
+        for source_path, destination_path in pairs:
+            try:
+                source_bucket_name, source_name = split_gs_path(source_path)
+                destination_bucket_name, destination_name = split_gs_path(destination_path)
+                source_bucket = self.client.bucket(source_bucket_name)
+                destination_bucket = self.client.bucket(destination_bucket_name)
+                source_bucket.copy_blob(source_bucket.blob(source_name), destination_bucket, destination_name)
+                source_bucket.delete_blob(source_name)
+                results[source_path] = None
+            except Exception as e:
+                results[source_path] = str(e)
+        return results
+
+
+class LocalBackend:
+    """
+    Filesystem-backed fake of a bucket for offline testing: gs://bucket/path maps to <root>/bucket/path.
+    """
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _local_path(self, gs_path):
+        bucket_name, name = split_gs_path(gs_path)
+        return os.path.join(self.root, bucket_name, name)
+
+    def _gs_path(self, local_path):
+        return "gs://" + os.path.relpath(local_path, self.root).replace(os.sep, '/')
+
+    def _to_object(self, local_path, with_hashes):
+        md5 = None
+        if with_hashes:
+            digest = hashlib.md5()
+            with open(local_path, 'rb') as f:
+                for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                    digest.update(block)
+            md5 = digest.hexdigest()
+        st = os.stat(local_path)
+        return {'path': self._gs_path(local_path), 'size': st.st_size, 'created': st.st_mtime, 'md5': md5, 'crc32c': None}
+
+    def list(self, gs_dirs, recursive=True, with_hashes=False):
+        objects = []
+        prefixes = []
+        for gs_dir in gs_dirs:
+            local_dir = self._local_path(gs_dir)
+            if not os.path.isdir(local_dir):
+                continue
+            if recursive:
+                for dirpath, _, filenames in os.walk(local_dir):
+                    for filename in sorted(filenames):
+                        objects.append(self._to_object(os.path.join(dirpath, filename), with_hashes))
+            else:
+                for item in sorted(os.listdir(local_dir)):
+                    item_path = os.path.join(local_dir, item)
+                    if os.path.isdir(item_path):
+                        prefixes.append(self._gs_path(item_path) + '/')
+                    else:
+                        objects.append(self._to_object(item_path, with_hashes))
+        return objects, prefixes
+
+    def iter_objects(self, gs_dir):
+        for dirpath, _, filenames in os.walk(self._local_path(gs_dir)):
+            for filename in sorted(filenames):
+                yield self._to_object(os.path.join(dirpath, filename), False)
+
+    def delete(self, gs_paths):
+        results = {}
+        for gs_path in gs_paths:
+            local_path = self._local_path(gs_path.rstrip('/'))
+            try:
+                if os.path.isdir(local_path):
+                    shutil.rmtree(local_path)
+                elif os.path.exists(local_path):
+                    os.remove(local_path)
+                results[gs_path] = None
+            except OSError as e:
+                results[gs_path] = str(e)
+        return results
+
+    def move(self, pairs):
+        results = {}
+        for source_path, destination_path in pairs:
+            try:
+                local_destination = self._local_path(destination_path)
+                os.makedirs(os.path.dirname(local_destination), exist_ok=True)
+                shutil.move(self._local_path(source_path), local_destination)
+                results[source_path] = None
+            except OSError as e:
+                results[source_path] = str(e)
+        return results
+
+
+def get_backend(name=None):
+    """
+    Returns the storage backend set in config.yml under bucket.backend: 'native', 'gsutil', 'local' or 'auto' (default).
+    'auto' uses the native client when google-cloud-storage is installed and falls back to gsutil otherwise.
+    """
+    if name is None:
+        name = cfg.get('bucket', {}).get('backend', 'auto')
+
+    if name == 'local':
+        return LocalBackend(cfg['bucket']['local_root'])
+    if name == 'gsutil':
+        return GsutilBackend()
+    if name == 'native':
+        return NativeBackend()
+    if name == 'auto':
+        try:
+            return NativeBackend()
+        except Exception as e:
+            print(f"Native Google Cloud Storage client unavailable ({e}), falling back to gsutil.")
+            return GsutilBackend()
+    raise ValueError(f"Unknown bucket backend '{name}'. Expected 'native', 'gsutil', 'local' or 'auto'.")
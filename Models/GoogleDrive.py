@@ -17,32 +17,108 @@ sys.path.append(root_dir)
 
 # ---
 
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-import pickle
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from oauth2client.service_account import ServiceAccountCredentials
+# The Google API client libraries and pandas are imported where they are used, so that
+# importing this module (e.g. for a status update) stays fast
 import yaml
 
 import io
+import time
+import random
+import threading
 import gspread
+from gspread.utils import rowcol_to_a1
 import json
-import numpy as np
-import pandas as pd
 
 import Functions.utilities as u
-from Functions.contract_utils import export_config_file, deserialize_from_google_sheet, serialize_for_google_sheet
+from Functions.contract_utils import export_config_file, deserialize_from_google_sheet, serialize_for_google_sheet, ContractConfig
+from Models.SheetMirror import get_mirror, MirroredWorksheet
 
 cfg = u.read_config()
 
+# Maximum number of calls in one Drive batch request
+DRIVE_BATCH_SIZE = 100
+# Reasons of the 403/429 errors the Drive API returns when a request is refused by the rate limit
+DRIVE_RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Batch requests sent at the same time when walking or deleting folder trees
+DRIVE_BATCH_WORKERS = cfg.get('google_drive', {}).get('batch_workers', 4)
+
+# Seconds a fetched copy of a worksheet is trusted before it is read again
+SHEET_CACHE_TTL = cfg.get('google_sheets', {}).get('cache_ttl', 60)
+# Attempts of a write when the Sheets API answers 429 (rate limit exceeded)
+SHEET_WRITE_RETRIES = cfg.get('google_sheets', {}).get('write_retries', 5)
+# Serve the worksheets from a local SQLite mirror, see Models/SheetMirror.py
+SHEET_MIRROR = cfg.get('google_sheets', {}).get('mirror', False)
+
+
+# Credentials per (auth method, credential file), shared by all GoogleDriveService instances of the process
+_drive_credentials = {}
+_drive_credentials_lock = threading.Lock()
+# Built services per thread: googleapiclient service objects must not be shared between threads
+_drive_services = threading.local()
+
+DISCOVERY_CACHE_DIR = os.path.join(root_dir, "Files", "discovery_cache")
+
+
+DRIVE_DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+
+
+def is_rate_limit_error(error):
+    """
+    Returns True when error is an HttpError of the Drive API refusing a request because of the rate limit.
+
+    :param error: Exception returned for a request, or None
+    :return: True if the request can be sent again after a pause
+    """
+    from googleapiclient.errors import HttpError
+    if not isinstance(error, HttpError) or error.resp.status not in (403, 429):
+        return False
+    reasons = []
+    # {"error": {"errors": [{"reason": "userRateLimitExceeded", ...}], ...}}
+    try:
+        content = error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content
+        reasons = [detail.get('reason') for detail in json.loads(content)['error'].get('errors', [])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    # parsed by googleapiclient itself in recent versions
+    details = getattr(error, 'error_details', None)
+    if isinstance(details, list):
+        reasons += [detail.get('reason') for detail in details if isinstance(detail, dict)]
+    return any(reason in DRIVE_RATE_LIMIT_REASONS for reason in reasons)
+
+
+def build_drive_service(creds):
+    """
+    Builds a Drive v3 service from the discovery document cached on disk, so building never goes to the network.
+    The document is downloaded from the public Discovery service on the first build.
+    """
+    from googleapiclient.discovery import build, build_from_document
+
+    doc_path = os.path.join(DISCOVERY_CACHE_DIR, "drive_v3.json")
+    if not os.path.isfile(doc_path):
+        import urllib.request
+        try:
+            with urllib.request.urlopen(DRIVE_DISCOVERY_URL, timeout=30) as response:
+                document = response.read().decode('utf-8')
+            json.loads(document)  # do not cache an error page
+            os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{doc_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(document)
+            os.replace(tmp_path, doc_path)
+        except (OSError, ValueError) as e:
+            print(f"Could not cache the Drive discovery document: {e}")
+            return build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+    with open(doc_path, 'r') as f:
+        return build_from_document(f.read(), credentials=creds)
+
 
 class GoogleDriveService:
     def __init__(self, auth_method):
         self.load_config()
         self._SCOPES = ['https://www.googleapis.com/auth/drive']
         self.auth_method = auth_method
+        self._children = {}  # folder id -> {name: {'id', 'mimeType'}} of the folders listed by list_children
     
     def load_config(self):
         with open(f"{root_dir}/Config/config.yml", 'r') as file:
@@ -51,20 +127,62 @@ class GoogleDriveService:
         self.personal_account_cred_path = os.path.join(root_dir, cfg['google_drive'].get('personal_account_cred_path'))
         self.personal_account_token_path = os.path.join(root_dir, cfg['google_drive'].get('personal_account_token_path'))
 
-    def build(self):
+    def _credentials_key(self):
         if self.auth_method == 'service_account':
-            return self.build_service_account()
-        elif self.auth_method == 'personal_account':
-            return self.build_personal_account()
+            return (self.auth_method, self.service_account_cred_path)
+        return (self.auth_method, self.personal_account_token_path)
+
+    def get_credentials(self):
+        """
+        Returns the credentials of the auth method, loaded once per process and refreshed when they have expired.
+        """
+        key = self._credentials_key()
+        with _drive_credentials_lock:
+            creds = _drive_credentials.get(key)
+            if creds is None:
+                if self.auth_method == 'service_account':
+                    creds = self.load_service_account_credentials()
+                elif self.auth_method == 'personal_account':
+                    creds = self.load_personal_account_credentials()
+                else:
+                    raise ValueError(f"Invalid auth_method '{self.auth_method}'. Expected 'service_account' or 'personal_account'.")
+                _drive_credentials[key] = creds
+            elif self.auth_method == 'personal_account' and not creds.valid:
+                creds = self.load_personal_account_credentials(creds)
+                _drive_credentials[key] = creds
+            return creds
+
+    def build(self):
+        """
+        Returns the Drive service of this thread, built once per thread and auth method.
+        Requests made through it refresh the access token automatically when it expires.
+        """
+        key = self._credentials_key()
+        services = getattr(_drive_services, 'services', None)
+        if services is None:
+            services = _drive_services.services = {}
+
+        creds = self.get_credentials()
+        cached = services.get(key)
+        if cached is None or cached[0] is not creds:
+            services[key] = (creds, build_drive_service(creds))
+        return services[key][1]
 
     def build_service_account(self):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            self.service_account_cred_path, self._SCOPES)
-        return build('drive', 'v3', credentials=creds)
+        return self.build()
 
     def build_personal_account(self):
-        creds = None
-        if os.path.exists(self.personal_account_token_path):
+        return self.build()
+
+    def load_service_account_credentials(self):
+        from oauth2client.service_account import ServiceAccountCredentials
+        return ServiceAccountCredentials.from_json_keyfile_name(self.service_account_cred_path, self._SCOPES)
+
+    def load_personal_account_credentials(self, creds=None):
+        import pickle
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+        if creds is None and os.path.exists(self.personal_account_token_path):
             with open(self.personal_account_token_path, 'rb') as token:
                 creds = pickle.load(token)
         
@@ -79,9 +197,46 @@ class GoogleDriveService:
             with open(self.personal_account_token_path, 'wb') as token:
                 pickle.dump(creds, token)
 
-        return build('drive', 'v3', credentials=creds)
+        return creds
+
+    def list_children(self, folder_id, refresh=False):
+        """
+        Lists the items of a Drive folder once, following every page, and keeps them in an in-memory index
+        that answers folder_exists and file_exists without further queries.
+
+        :param folder_id: ID of the Drive folder
+        :param refresh: List the folder again even if it is already indexed
+        :return: Dictionary {name: {'id': id, 'mimeType': mime type}}
+        """
+        if folder_id in self._children and not refresh:
+            return self._children[folder_id]
+
+        service = self.build()
+        query = f"'{folder_id}' in parents and trashed=false"
+        children = {}
+        page_token = None
+        while True:
+            response = service.files().list(q=query, spaces='drive', fields='nextPageToken, files(id, name, mimeType)',
+                                            pageSize=1000, pageToken=page_token).execute()
+            for file in response.get('files', []):
+                # like the queries, the first item with a name wins when names are not unique
+                children.setdefault(file['name'], {'id': file['id'], 'mimeType': file['mimeType']})
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+
+        self._children[folder_id] = children
+        return children
+
+    def _add_child(self, folder_id, name, item_id, mime_type):
+        if folder_id in self._children:
+            self._children[folder_id][name] = {'id': item_id, 'mimeType': mime_type}
 
     def folder_exists(self, name, parent_id):
+        if parent_id in self._children:
+            child = self._children[parent_id].get(name)
+            return child['id'] if child and child['mimeType'] == 'application/vnd.google-apps.folder' else None
+
         service = self.build()
         query = f"mimeType='application/vnd.google-apps.folder' and name='{name}' and '{parent_id}' in parents and trashed=false"
         response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
@@ -91,8 +246,10 @@ class GoogleDriveService:
         return None
 
     def list_items_owned_by_service_account(self, folder_id=None):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.service_account_cred_path, self._SCOPES)
-        service = build('drive', 'v3', credentials=creds)
+        # always the service account, also when this instance authenticates with a personal account
+        service_account = self if self.auth_method == 'service_account' else GoogleDriveService('service_account')
+        creds = service_account.get_credentials()
+        service = service_account.build()
         service_account_email = creds.service_account_email
 
         query = f"'{service_account_email}' in owners"
@@ -106,24 +263,112 @@ class GoogleDriveService:
         return items
 
 
-    def delete_item(self, item_id):
+    def _execute_batch(self, calls, max_retries=3, wait_seconds=2):
+        """
+        Sends up to DRIVE_BATCH_SIZE calls in one batch request. Calls refused by the rate limit are sent again.
+
+        :param calls: List of tuples (key, function returning the request for a service)
+        :return: Dictionary {key: (response, exception)}
+        """
         service = self.build()
-        item = service.files().get(fileId=item_id, fields='mimeType').execute()
-        if item['mimeType'] == 'application/vnd.google-apps.folder':
-            self._delete_contents_recursive(service, item_id)
-        service.files().delete(fileId=item_id).execute()
-        print(f"Deleted item with ID: {item_id}")
+        results = {}
+        for attempt in range(max_retries + 1):
+            batch = service.new_batch_http_request()
+            keys = {}
+            for i, (key, make_request) in enumerate(calls):
+                keys[str(i)] = key
+                batch.add(make_request(service), request_id=str(i),
+                          callback=lambda request_id, response, exception: results.__setitem__(keys[request_id], (response, exception)))
+            batch.execute()
+
+            limited = {key for key, (_, e) in results.items() if is_rate_limit_error(e)}
+            calls = [call for call in calls if call[0] in limited]
+            if not calls or attempt == max_retries:
+                break
+            time.sleep(wait_seconds * 2 ** attempt + random.uniform(0, 1))
+        return results
+
+    def _execute_batches(self, calls, workers=None):
+        """
+        Splits calls into batch requests and sends them from several threads, each with its own client.
+        """
+        chunks = [calls[i:i + DRIVE_BATCH_SIZE] for i in range(0, len(calls), DRIVE_BATCH_SIZE)]
+        results = {}
+        if len(chunks) == 1:
+            return self._execute_batch(chunks[0])
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers or DRIVE_BATCH_WORKERS) as executor:
+            for chunk_results in executor.map(self._execute_batch, chunks):
+                results.update(chunk_results)
+        return results
+
+    def list_tree(self, folder_id, workers=None):
+        """
+        Lists everything below a Drive folder. The tree is walked breadth-first: the items of all folders of a
+        level are listed with batch requests, following every page, and the sub-folders form the next level.
 
-    def _delete_contents_recursive(self, service, folder_id):
-        query = f"'{folder_id}' in parents"
-        results = service.files().list(q=query, fields="files(id, mimeType)").execute()
-        items = results.get('files', [])
+        :return: Tuple (items, errors). Items are dictionaries with 'id', 'name', 'mimeType', 'parent' and 'depth',
+                 errors is a list of tuples (folder id, error message) of the folders that could not be listed
+        """
+        items = []
+        errors = []
+        level = [(folder_id, None, 1)]  # tuples (folder id, page token, depth of its items)
+        while level:
+            calls = [((parent_id, page_token, depth),
+                      lambda service, parent_id=parent_id, page_token=page_token: service.files().list(
+                          q=f"'{parent_id}' in parents and trashed=false", spaces='drive', pageSize=1000, pageToken=page_token,
+                          fields='nextPageToken, files(id, name, mimeType)'))
+                     for parent_id, page_token, depth in level]
+            next_level = []
+            for (parent_id, _, depth), (response, exception) in self._execute_batches(calls, workers).items():
+                if exception is not None:
+                    errors.append((parent_id, str(exception)))
+                    continue
+                for file in response.get('files', []):
+                    items.append({**file, 'parent': parent_id, 'depth': depth})
+                    if file['mimeType'] == 'application/vnd.google-apps.folder':
+                        next_level.append((file['id'], None, depth + 1))
+                if response.get('nextPageToken'):
+                    next_level.append((parent_id, response['nextPageToken'], depth))
+            level = next_level
+        return items, errors
+
+    def delete_item(self, item_id, workers=None):
+        """
+        Deletes a file, or a folder with everything inside it. The contents of a folder are listed with list_tree
+        and deleted with batch requests, deepest items first.
 
-        for item in items:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                self._delete_contents_recursive(service, item['id'])
-            service.files().delete(fileId=item['id']).execute()
-            print(f"Deleted item: {item['id']}")
+        :return: Dictionary with 'listed', 'deleted' and 'failed' counts, 'errors' (list of tuples (id, error message)) and 'seconds'
+        """
+        start = time.time()
+        service = self.build()
+        item = service.files().get(fileId=item_id, fields='mimeType').execute()
+
+        items, errors = [], []
+        if item['mimeType'] == 'application/vnd.google-apps.folder':
+            items, errors = self.list_tree(item_id, workers)
+
+        deleted = 0
+        # deepest first, so folders are empty by the time they are deleted
+        for depth in sorted({i['depth'] for i in items}, reverse=True) + [0]:
+            ids = [i['id'] for i in items if i['depth'] == depth] if depth else [item_id]
+            calls = [(id_, lambda service, id_=id_: service.files().delete(fileId=id_)) for id_ in ids]
+            for id_, (_, exception) in self._execute_batches(calls, workers).items():
+                # 404: already deleted together with its folder
+                if exception is None or getattr(getattr(exception, 'resp', None), 'status', None) == 404:
+                    deleted += 1
+                else:
+                    errors.append((id_, str(exception)))
+
+        self._children.pop(item_id, None)
+        for children in self._children.values():
+            for name in [name for name, child in children.items() if child['id'] == item_id]:
+                del children[name]
+
+        summary = {'listed': len(items), 'deleted': deleted, 'failed': len(errors), 'errors': errors,
+                   'seconds': time.time() - start}
+        print(f"Deleted item with ID: {item_id} ({deleted} items deleted, {len(errors)} errors, {summary['seconds']:.1f} s)")
+        return summary
 
     def create_folder(self, name, parent_id):
         existing_folder_id = self.folder_exists(name, parent_id)
@@ -137,9 +382,17 @@ class GoogleDriveService:
             'parents': [parent_id]
         }
         folder = service.files().create(body=file_metadata, fields='id').execute()
+        self._add_child(parent_id, name, folder.get('id'), 'application/vnd.google-apps.folder')
+        if parent_id in self._children:
+            # a new folder is empty, so it is indexed without listing it
+            self._children[folder.get('id')] = {}
         return folder.get('id')
 
     def file_exists(self, file_name, folder_id):
+        if folder_id in self._children:
+            child = self._children[folder_id].get(file_name)
+            return child['id'] if child else None
+
         service = self.build()
         query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
         response = service.files().list(q=query, spaces='drive', fields='files(id)').execute()
@@ -148,42 +401,31 @@ class GoogleDriveService:
         return None
 
     def upload_file(self, file_name, file_path, mime_type, folder_id, overwrite=False):
-        existing_file_id = self.file_exists(file_name, folder_id)
-        service = self.build()
+        """
+        Uploads a file with a resumable upload. An upload interrupted by a crash continues where it stopped
+        the next time the same file is uploaded to the same folder (see Models/DriveUploads.py).
+        """
+        from Models.DriveUploads import DriveUploadManager
+        result = DriveUploadManager(self, workers=1).upload_one(file_path, folder_id, file_name, mime_type, overwrite)
+        if result['status'] == 'failed':
+            raise RuntimeError(f"Failed to upload '{file_name}': {result['error']}")
+        if result['status'] != 'skipped':
+            print(f"File {result['status']}. File ID: {result['file_id']}")
+        return result['file_id']
+
+    def upload_files(self, files, overwrite=False, workers=None):
+        """
+        Uploads several files at the same time with resumable uploads.
 
-        chunksize = 1000 * 1024 * 1024  # 1 Gigabyte
-        
-        if existing_file_id:
-            if overwrite:
-                # Overwrite the existing file
-
-                media = MediaFileUpload(file_path, mimetype=mime_type, chunksize=chunksize, resumable=True)
-                request = service.files().update(fileId=existing_file_id, media_body=media)
-                response = None
-                while response is None:
-                    status, response = request.next_chunk()
-                    if status:
-                        print(f"Upload progress: {int(status.progress() * 100)}%")
-                print(f"File overwritten. File ID: {response.get('id')}")
-                return response.get('id')
-            else:
-                print(f"File '{file_name}' already exists. Skipping upload.")
-                return existing_file_id
-        else:
-            # File does not exist, proceed with upload
-            file_metadata = {'name': file_name, 'parents': [folder_id]}
-            media = MediaFileUpload(file_path, mimetype=mime_type, chunksize=chunksize, resumable=True)
-            request = service.files().create(body=file_metadata, media_body=media, fields='id')
-            response = None
-            while response is None:
-                status, response = request.next_chunk()
-                if status:
-                    print(f"Upload progress: {int(status.progress() * 100)}%")
-            print(f"File uploaded. File ID: {response.get('id')}")
-            return response.get('id')
-
-
-    def upload_folder(self, local_folder_path, drive_folder_id, skip=[], overwrite=False):
+        :param files: List of dictionaries with 'file_path', 'folder_id' and optionally 'file_name' and 'mime_type'
+        :return: Dictionary {file_path: {'file_id', 'status', 'resumed', 'error'}}
+        """
+        from Models.DriveUploads import DriveUploadManager, UPLOAD_WORKERS
+        return DriveUploadManager(self, workers=workers or UPLOAD_WORKERS).upload(files, overwrite=overwrite)
+
+    def _collect_folder_uploads(self, local_folder_path, drive_folder_id, skip, files):
+        # one listing per Drive folder, the existence checks of the items are answered from the index
+        self.list_children(drive_folder_id)
         for item in os.listdir(local_folder_path):
             item_path = os.path.join(local_folder_path, item)
 
@@ -194,16 +436,23 @@ class GoogleDriveService:
 
             if os.path.isfile(item_path):
                 mime_type = 'application/pdf' if item_path.endswith('.pdf') else 'application/octet-stream'
-                self.upload_file(item, item_path, mime_type, drive_folder_id, overwrite=overwrite)
+                files.append({'file_path': item_path, 'folder_id': drive_folder_id, 'file_name': item, 'mime_type': mime_type})
             elif os.path.isdir(item_path):
                 new_folder_id = self.create_folder(item, drive_folder_id)
-                self.upload_folder(item_path, new_folder_id, skip, overwrite)
+                self._collect_folder_uploads(item_path, new_folder_id, skip, files)
+        return files
+
+    def upload_folder(self, local_folder_path, drive_folder_id, skip=[], overwrite=False, workers=None):
+        # create the folder tree first, then upload all files concurrently
+        files = self._collect_folder_uploads(local_folder_path, drive_folder_id, skip, [])
+        return self.upload_files(files, overwrite=overwrite, workers=workers)
 
 
     def download_file(self, file_id, destination_path):
         """
         Downloads a file from Google Drive specified by the file_id to the given destination_path.
         """
+        from googleapiclient.http import MediaIoBaseDownload
         service = self.build()
         request = service.files().get_media(fileId=file_id)
         
@@ -217,13 +466,46 @@ class GoogleDriveService:
 
 
 class GoogleSheet:
+    # headers of the columns that identify a row, used by the mirror to find rows that moved
+    row_key_columns = None
+
     def __init__(self, spreadsheet_id):
         self._SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
         self._credential_path = os.path.join(root_dir, 'Config', 'google_service.json')
         self.spreadsheet_id = spreadsheet_id
-        self.client = self.authenticate()
+        self.sheet_name = None
+        self._client = None
+        self._worksheet = None
+        self._pending = {}  # (worksheet id, row, col) -> value of buffered writes
+        self._pending_worksheets = {}
+        self._buffer_depth = 0
+        self.cache_ttl = SHEET_CACHE_TTL
+        self._values = None  # all values of self.worksheet from the last fetch
+        self._fetched_at = 0
+
+    @property
+    def client(self):
+        # authenticate on first use, not when the sheet object is created
+        if self._client is None:
+            self._client = self.authenticate()
+        return self._client
+
+    @property
+    def worksheet(self):
+        # open the worksheet and read its headers on first use
+        if self._worksheet is None and self.sheet_name is not None:
+            self._worksheet = self.get_worksheet(self.sheet_name)
+            if not self._worksheet:
+                print(f"Initialization failed: Worksheet '{self.sheet_name}' not found.")
+                return None
+            self.initialize_columns()
+        return self._worksheet
+
+    def initialize_columns(self):
+        pass
 
     def authenticate(self):
+        from google.oauth2.service_account import Credentials
         try:
             creds = Credentials.from_service_account_file(self._credential_path, scopes=self._SCOPES)
             return gspread.authorize(creds)
@@ -232,6 +514,8 @@ class GoogleSheet:
             raise
 
     def get_worksheet(self, sheet_name):
+        if SHEET_MIRROR:
+            return self._get_mirrored_worksheet(sheet_name)
         try:
             return self.client.open_by_key(self.spreadsheet_id).worksheet(sheet_name)
         except gspread.exceptions.SpreadsheetNotFound:
@@ -244,6 +528,69 @@ class GoogleSheet:
             print(f"Unexpected error accessing worksheet: {e}")
             return None
 
+    def _get_mirrored_worksheet(self, sheet_name):
+        """
+        Returns the worksheet backed by the local SQLite mirror (see Models/SheetMirror.py).
+        The real worksheet is only opened when the mirror needs to send writes or pull the sheet.
+        """
+        opened = []
+
+        def worksheet_fn():
+            if not opened:
+                opened.append(self.client.open_by_key(self.spreadsheet_id).worksheet(sheet_name))
+            return opened[0]
+
+        try:
+            mirror = get_mirror()
+            mirror.register(sheet_name, worksheet_fn, self._with_backoff, key_columns=self.row_key_columns)
+            return MirroredWorksheet(mirror, sheet_name, worksheet_fn)
+        except Exception as e:
+            print(f"Unexpected error accessing worksheet: {e}")
+            return None
+
+    def invalidate(self):
+        """
+        Drops the cached copy of the worksheet so that the next lookup fetches it again.
+        """
+        self._values = None
+
+    def _load(self, force=False):
+        """
+        Returns all values of the worksheet, fetching them in a single call when the cache is empty or older than cache_ttl.
+        """
+        if force or self._values is None or time.time() - self._fetched_at > self.cache_ttl:
+            self._values = self.worksheet.get_all_values()
+            self._fetched_at = time.time()
+            self._build_index()
+        return self._values
+
+    def _build_index(self):
+        """
+        Called after every fetch of the worksheet, subclasses index the rows here.
+        """
+        pass
+
+    def _cached_row(self, row_index):
+        """
+        Returns the cached values of a row without trailing empty cells, like worksheet.row_values.
+        """
+        row = list(self._load()[row_index - 1])
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+    def _set_cached_cell(self, row_index, col_index, value):
+        """
+        Applies a write to the cached copy of the worksheet, so that it stays current without a new fetch.
+        Called by flush once the write was sent.
+        """
+        if self._values is None or row_index > len(self._values):
+            return
+        row = self._values[row_index - 1]
+        if len(row) < col_index:
+            row.extend([''] * (col_index - len(row)))
+        row[col_index - 1] = '' if value is None else str(value)
+
     def read_cell(self, worksheet, row, col):
         try:
             return worksheet.cell(row, col).value
@@ -252,11 +599,87 @@ class GoogleSheet:
             raise
 
     def update_cell(self, worksheet, row, col, value):
-        try:
-            worksheet.update_cell(row, col, value)
-        except Exception as e:
-            print(f"Error updating cell at row {row}, column {col}: {e}")
-            raise
+        # inside a `with sheet:` block the write is buffered until the block exits, otherwise it is sent right away.
+        # Either way it goes through flush, so that every write uses the same value input option
+        with self:
+            self._pending[(worksheet.id, row, col)] = value
+            self._pending_worksheets[worksheet.id] = worksheet
+
+    def update_row(self, worksheet, row, values, col=1):
+        """
+        Writes consecutive cells of a row, starting at column col. Buffered like update_cell.
+        """
+        with self:
+            for i, value in enumerate(values):
+                self.update_cell(worksheet, row, col + i, value)
+
+    def __enter__(self):
+        self._buffer_depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._buffer_depth -= 1
+        if self._buffer_depth == 0:
+            self.flush()
+        return False
+
+    def flush(self):
+        """
+        Sends all buffered cell updates, one batch_update per worksheet. Repeated writes to the same cell
+        were already coalesced in the buffer, and adjacent cells of a row are sent as a single range.
+        Values are sent RAW like the writes of the sheet mirror, so that e.g. 'false' stays a string.
+        """
+        pending, self._pending = self._pending, {}
+        worksheets, self._pending_worksheets = self._pending_worksheets, {}
+
+        by_worksheet = {}
+        for (worksheet_id, row, col), value in pending.items():
+            by_worksheet.setdefault(worksheet_id, {}).setdefault(row, {})[col] = value
+
+        for worksheet_id, rows in by_worksheet.items():
+            worksheet = worksheets[worksheet_id]
+            data = []
+            for row, cells in sorted(rows.items()):
+                run_start, run_values = None, []
+                for col in sorted(cells):
+                    if run_start is not None and col == run_start + len(run_values):
+                        run_values.append(cells[col])
+                        continue
+                    if run_start is not None:
+                        data.append({'range': rowcol_to_a1(row, run_start), 'values': [run_values]})
+                    run_start, run_values = col, [cells[col]]
+                data.append({'range': rowcol_to_a1(row, run_start), 'values': [run_values]})
+
+            # writing below the last row of the grid fails, so grow the sheet first
+            last_row = max(rows)
+            if last_row > worksheet.row_count:
+                self._with_backoff(worksheet.add_rows, last_row - worksheet.row_count)
+
+            try:
+                self._with_backoff(worksheet.batch_update, data, value_input_option='RAW')
+            except Exception as e:
+                print(f"Error flushing {len(pending)} cell updates: {e}")
+                raise
+
+            # the cached copy only takes writes the sheet accepted
+            if self._worksheet is not None and worksheet_id == self._worksheet.id:
+                for row, cells in rows.items():
+                    for col, value in cells.items():
+                        self._set_cached_cell(row, col, value)
+
+    def _with_backoff(self, func, *args, **kwargs):
+        """
+        Calls func, retrying with exponential backoff while the Sheets API answers 429 (rate limit exceeded).
+        """
+        for attempt in range(SHEET_WRITE_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if e.response.status_code != 429 or attempt == SHEET_WRITE_RETRIES - 1:
+                    raise
+                wait_seconds = 2 ** attempt + random.uniform(0, 1)
+                print(f"Sheets API rate limit exceeded, retrying in {wait_seconds:.1f} seconds...")
+                time.sleep(wait_seconds)
 
 
 
@@ -277,24 +700,21 @@ config_columns = [
         ]
 
 class ConfigSheet(GoogleSheet):
+    row_key_columns = ('contract_name', 'machine')
+
     def __init__(self, spreadsheet_id, sheet_name):
         super().__init__(spreadsheet_id)
         self.sheet_name = sheet_name
 
-        self.worksheet = self.get_worksheet(sheet_name)
-        if not self.worksheet:
-            print(f"Initialization failed: Worksheet '{sheet_name}' not found.")
-            return
-
-        self.initialize_columns()
+        self._configs = {}  # memoized ContractConfig objects, see get_config
 
     def find_contract_row(self, contract_name, machine):
         try:
             # Get all values in the worksheet (assuming the first row contains headers)
-            all_values = self.worksheet.get_all_values()
+            all_values = self._load()
 
-            # Check if the first row contains 'contract_name' and 'machine' columns
-            if 'contract_name' in all_values[0] and 'machine' in all_values[0]:
+            # Check if the first row contains 'contract_name' and 'machine' columns, an empty sheet has no rows at all
+            if all_values and 'contract_name' in all_values[0] and 'machine' in all_values[0]:
                 contract_name_index = all_values[0].index('contract_name')
                 machine_index = all_values[0].index('machine')
 
@@ -366,12 +786,17 @@ class ConfigSheet(GoogleSheet):
             raise
 
     def add_contract(self, contract_name, machine, config_data):
-        if self.contract_exists(contract_name):
+        # One read for the existence check and the headers
+        all_values = self.worksheet.get_all_values()
+        if contract_name in [row[0] for row in all_values if row]:
             print(f"Contract '{contract_name}' already exists. Aborting addition.")
             return
 
         # Get the column headers from the first row
-        column_headers = self.worksheet.row_values(1)
+        if not all_values:
+            print(f"Worksheet '{self.sheet_name}' has no header row. Cannot add contract '{contract_name}'.")
+            return
+        column_headers = all_values[0]
 
         # Create a list to store the values for the new row
         new_row_values = [''] * len(column_headers)
@@ -394,12 +819,20 @@ class ConfigSheet(GoogleSheet):
                 index = column_headers.index(key)
                 new_row_values[index] = value
 
-        # Add the new row to the worksheet
-        self.worksheet.append_row(new_row_values)
+        # Append the new row in a single call. append_row writes the values RAW, so the serialized
+        # 'true'/'false' are not turned into booleans that read back as 'TRUE'/'FALSE'
+        self._with_backoff(self.worksheet.append_row, new_row_values)
+        self.invalidate()
         print(f"Contract '{contract_name}' added.")
 
 
     def get_config(self, contract_name, machine):
+        """
+        Returns the configuration of a contract as a read-only ContractConfig.
+
+        The object is built once and reused for as long as the header row and the contract row
+        of the sheet are unchanged, so repeated calls from the stages cost no parsing.
+        """
         # Retrieve configuration data for the specified contract
         row_id = self.find_contract_row(contract_name, machine)
         if row_id is None:
@@ -407,24 +840,13 @@ class ConfigSheet(GoogleSheet):
             return
 
         # Assuming the first row contains column headers
-        column_headers = self.worksheet.row_values(1)
-        contract_data = self.worksheet.row_values(row_id)
+        column_headers = self._cached_row(1)
+        contract_data = self._cached_row(row_id)
 
-        # Deserialize and convert row data to a dictionary
-        config_data = {}
-        for i, key in enumerate(column_headers):
-            try:
-                value = deserialize_from_google_sheet(contract_data[i])
-            except:
-                value = None
-            # Explicitly convert 'True'/'False' strings to boolean values
-            if value == 'True':
-                value = True
-            elif value == 'False':
-                value = False
-            config_data[key] = value
-
-        return config_data
+        key = (contract_name, machine, tuple(column_headers), tuple(contract_data))
+        if key not in self._configs:
+            self._configs[key] = ContractConfig.from_sheet_row(contract_name, machine, column_headers, contract_data)
+        return self._configs[key]
     
 
     # def export_config(self, contract_name, country, machine_name, symlinks, export_machine_name=None):
@@ -438,7 +860,7 @@ class ConfigSheet(GoogleSheet):
         machine = status['machine']
         contract_alias = status['contract_name']
 
-        config_data = self.get_config(contract_alias, machine)
+        config_data = self.get_config(contract_alias, machine).to_dict()
         if export_machine_name is None:
             export_machine_name = machine
 
@@ -451,21 +873,24 @@ status_columns = ['contract_name', 'code', 'machine', 'user', 'image_upload', 's
                   'initialize_graph', 'rasterize_clusters', 'download_clusters_1', 'new_neighbors', 'export_georef']
 
 class StatusSheet(GoogleSheet):
-    def __init__(self, spreadsheet_id, sheet_name):
+    row_key_columns = ('contract_name', 'machine', 'user')
+
+    def __init__(self, spreadsheet_id, sheet_name, cache_ttl=SHEET_CACHE_TTL):
         super().__init__(spreadsheet_id)
         self.sheet_name = sheet_name
-        self.worksheet = self.get_worksheet(sheet_name)
-        if not self.worksheet:
-            print(f"Initialization failed: Worksheet '{sheet_name}' not found.")
-            return
+        self.cache_ttl = cache_ttl
+        self._columns = {}  # This will store column names and their indexes
+        self._row_index = {}  # (contract_name, machine, user) -> 1-indexed row number
 
-        self.columns = {}  # This will store column names and their indexes
-        self.initialize_columns()
+    @property
+    def columns(self):
+        self.worksheet  # the headers are read when the worksheet is first opened
+        return self._columns
 
     def initialize_columns(self):
         # Populate column headers into a dictionary for easy access
         headers = self.worksheet.row_values(1)
-        if not headers[0]:  # Assume if the first cell is empty, the row is empty
+        if not headers or not headers[0]:  # Assume if the first cell is empty, the row is empty
             # Populate the first row with status_columns
             headers = status_columns  # Assuming status_columns is defined
             cell_list = self.worksheet.range(1, 1, 1, len(headers))
@@ -473,21 +898,24 @@ class StatusSheet(GoogleSheet):
                 cell.value = headers[i]
             self.worksheet.update_cells(cell_list)
             print("Column initialization complete.")
-        else:
-            # Map headers to their index positions
-            self.columns = {name: idx for idx, name in enumerate(headers)}
-            # print("Column headers retrieved:", self.columns)
+        # Map headers to their index positions
+        self._columns = {name: idx for idx, name in enumerate(headers)}
+        # print("Column headers retrieved:", self.columns)
+
+    def _build_index(self):
+        contract_idx = self.columns['contract_name']
+        machine_idx = self.columns['machine']
+        user_idx = self.columns['user']
+        self._row_index = {}
+        for idx, row in enumerate(self._values):
+            if len(row) > max(contract_idx, machine_idx, user_idx):
+                # keep the first match, like a top-down search of the sheet
+                self._row_index.setdefault((row[contract_idx], row[machine_idx], row[user_idx]), idx + 1)  # +1 because spreadsheet rows are 1-indexed
 
     def find_contract_row(self, contract_name, machine, user):
         try:
-            data = self.worksheet.get_all_values()
-            contract_idx = self.columns['contract_name']
-            machine_idx = self.columns['machine']
-            user_idx = self.columns['user']
-            for idx, row in enumerate(data):
-                if row[contract_idx] == contract_name and row[machine_idx] == machine and row[user_idx] == user:
-                    return idx + 1  # +1 because spreadsheet rows are 1-indexed
-            return None
+            self._load()
+            return self._row_index.get((contract_name, machine, user))
         except Exception as e:
             print(f"Error finding contract row: {e}")
             raise
@@ -501,7 +929,19 @@ class StatusSheet(GoogleSheet):
             return
             
         new_row_values = [contract_name, contract_code, machine, user] + [''] * (len(self.columns) - 4)
-        self.worksheet.append_row(new_row_values)
+        response = self.worksheet.append_row(new_row_values)
+        try:
+            # e.g. 'status!A12:X12', the row the sheet actually appended to
+            updated_range = response['updates']['updatedRange']
+            row_index = int(updated_range.split('!')[1].split(':')[0].lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        except (KeyError, IndexError, TypeError, ValueError):
+            row_index = None
+
+        if self._values is not None and row_index == len(self._values) + 1:
+            self._values.append(['' if x is None else str(x) for x in new_row_values])
+            self._row_index.setdefault((contract_name, machine, user), row_index)
+        else:
+            self.invalidate()
         print(f"Contract '{contract_name}' added with machine '{machine}' and user '{user}'.")
 
     def update_status(self, contract_name, machine, user, column_name, status):
@@ -529,9 +969,11 @@ class StatusSheet(GoogleSheet):
             row_index = self.find_contract_row(contract_name, machine, user)
 
         try:
-            for column_name, status in status_updates.items():
-                col_index = self.columns[column_name] + 1  # +1 for 1-indexed columns
-                self.update_cell(self.worksheet, row_index, col_index, status)
+            # buffered and sent as one batch_update when the block exits
+            with self:
+                for column_name, status in status_updates.items():
+                    col_index = self.columns[column_name] + 1  # +1 for 1-indexed columns
+                    self.update_cell(self.worksheet, row_index, col_index, status)
             print(f"Statuses updated for '{contract_name}'.")
         except KeyError as e:
             print(f"Column not found: {e}")
@@ -555,8 +997,8 @@ class StatusSheet(GoogleSheet):
             return None
 
         try:
-            row_values = self.worksheet.row_values(row_index)
-            column_names = self.worksheet.row_values(1)
+            row_values = self._cached_row(row_index)
+            column_names = self._cached_row(1)
             status_dict = dict(zip(column_names, row_values))
 
             # Ensure all status_columns are included
@@ -590,8 +1032,9 @@ class StatusSheet(GoogleSheet):
                 print(f"Column '{column_name}' not found.")
                 return None
 
-            col_index = self.columns[column_name] + 1  # +1 for 1-indexed columns
-            return self.worksheet.cell(row_index, col_index).value
+            row_values = self._cached_row(row_index)
+            col_index = self.columns[column_name]
+            return row_values[col_index] if col_index < len(row_values) else None
         except Exception as e:
             print(f"Error retrieving status from column '{column_name}': {e}")
             return None
@@ -629,16 +1072,17 @@ class Status:
         Updates the status for a specified column.
         """
         self.status_sheet.update_status(self.contract_alias, self.machine, self.user, column_name, status)
-        self.refresh_status()  # Refresh the status data after update
+        self.data = self.refresh_status()  # Refresh the status data after update, served from the sheet cache
 
     def update_status_multiple(self, status_updates):
         """
         Updates multiple statuses.
         """
         self.status_sheet.update_status_multiple(self.contract_alias, self.machine, self.user, status_updates)
-        self.refresh_status()  # Refresh the status data after updates
+        self.data = self.refresh_status()  # Refresh the status data after updates, served from the sheet cache
 
     def load_symlinks(self, machine='tabei'):
+        import pandas as pd
         symlinks_db_fp = f"{root_dir}/Files/symlink_keys/{self.contract_alias}_symlinks_key.xlsx"
         if os.path.isfile(symlinks_db_fp):
             symlink_db = pd.read_excel(symlinks_db_fp)
@@ -33,17 +33,31 @@ import io
 import stat
 
 import Functions.utilities as u
+from Functions.ssh_utils import pool, ensure_connection
+from Functions.sftp_utils import SFTPTransferEngine
 
 
 # Load configuration
 cfg = u.read_config()
 
-# Try to get the password from an environment variable (used on Tabei file uploads)
-pwd = os.getenv('VM_DECRYPTION_PASSWORD')
+def get_pwd():
+    """
+    Returns the Google VM decryption password, prompting for it on first use.
+    """
+    # Try to get the password from an environment variable (used on Tabei file uploads)
+    pwd = os.getenv('VM_DECRYPTION_PASSWORD')
 
-if not pwd:
-    pwd = getpass.getpass("  Enter Google VM decryption password: ")
-    os.environ['VM_DECRYPTION_PASSWORD'] = pwd
+    if not pwd:
+        pwd = getpass.getpass("  Enter Google VM decryption password: ")
+        os.environ['VM_DECRYPTION_PASSWORD'] = pwd
+    return pwd
+
+
+def __getattr__(name):
+    # `Models.GoogleVM.pwd` is resolved on first access instead of prompting at import time
+    if name == 'pwd':
+        return get_pwd()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Define the tqdm callback function
@@ -53,37 +67,6 @@ def tqdm_callback(t):
     return inner_callback
 
 
-# Decorator function to ensure connection for SavioClient methods
-# as I understand it only works for shell scripts
-def ensure_connection(host_type="shell", verbose=False):
-    def decorator(func):
-        def wrapper(self, *args, **kwargs):
-            _verbose = verbose  # Use the verbose setting provided to the decorator
-
-            was_connected = self.connected
-            should_reconnect = was_connected and self.host_type != host_type
-
-            if not was_connected or should_reconnect:
-                if was_connected and _verbose:
-                    print(f"Conflicting host type, closing {self.host_type}, and opening {host_type}")
-                    self.close()
-                self.connect(host_type)
-                self.connected = True
-            else:
-                if _verbose:
-                    print("Using existing connection...")
-
-            try:
-                return func(self, *args, **kwargs)
-            finally:
-                if not was_connected:
-                    self.close()
-                    self.connected = False
-        return wrapper
-    return decorator
-
-
-
 # Define the SavioClient class
 class VMClient:
     def __init__(self):
@@ -92,7 +75,7 @@ class VMClient:
         self.zone = cfg['google_vm']['zone']
         self.ip = self.get_instance_external_ip()
         self.ssh_key_path = cfg['google_vm']['key_path']
-        self.ssh = SSHClient()
+        self.ssh = None
         self.sftp = None
         self.connected = False
         self.host_type = None
@@ -113,26 +96,28 @@ class VMClient:
 
 
     def connect(self, host_type="shell"):
-        print("Opening Google VM connection")
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        if not self.connected or self.host_type != host_type:
-            self._connect_ssh()
-            self.connected = True
-            self.host_type = host_type
-            if host_type == 'ftp':
-                self.sftp = self.ssh.open_sftp()
+        # sessions are shared process-wide, a new connection is only opened on a pool miss
+        hostname = self.ip
+        # shell and ftp share one transport, only the SFTP channel is opened on demand
+        session = pool.acquire(hostname, self.username, self._connect_ssh)
+        self.ssh = session.ssh
+        self.sftp = session.get_sftp() if host_type == 'ftp' else session.sftp
+        self.connected = True
+        self.host_type = host_type
 
     def _connect_ssh(self):
         max_attempts = 5
         attempts = 0
+        print("Opening Google VM connection")
+        ssh = SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         while attempts < max_attempts:
             try:
-                self.ssh.connect(hostname=self.ip, 
+                ssh.connect(hostname=self.ip, 
                                  username=self.username, 
                                  key_filename=self.ssh_key_path, 
-                                 passphrase=pwd)
-                self.connected = True
-                return
+                                 passphrase=get_pwd())
+                return ssh
             except Exception as e:
                 attempts += 1
                 print(f"Failed to connect (Attempt {attempts}/{max_attempts}): {e}")
@@ -144,14 +129,14 @@ class VMClient:
                     raise
 
     def close(self):
-        if self.sftp and self.host_type == 'ftp':
-            self.sftp.close()
-            self.sftp = None
-
-        self.ssh.close()
+        """
+        Releases this client's reference to the pooled session. The underlying
+        connection stays open for reuse and is closed when the process exits.
+        """
+        self.ssh = None
+        self.sftp = None
         self.connected = False
         self.host_type = None
-        print("closed Google VM connection")
 
 
     @ensure_connection('shell')
@@ -210,6 +195,31 @@ class VMClient:
             print(f"An error occurred during file upload: {e}")
             raise e
         
+    @ensure_connection('ftp')
+    def upload_files_parallel(self, file_paths, remote_paths, workers=None, journal=None):
+        """
+        Uploads files concurrently over multiple SFTP channels.
+
+        :param file_paths: List of local file paths
+        :param remote_paths: List of remote file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).upload(file_paths, remote_paths, journal)
+
+    @ensure_connection('ftp')
+    def download_files_parallel(self, remote_paths, local_paths, workers=None, sizes=None, journal=None):
+        """
+        Downloads files concurrently over multiple SFTP channels.
+
+        :param remote_paths: List of remote file paths
+        :param local_paths: List of local file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param sizes: Optional list of remote file sizes
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).download(remote_paths, local_paths, sizes, journal)
+
     @ensure_connection('ftp')
     def download_files_sftp(self, remote_paths, local_paths):
         try:
@@ -27,17 +27,32 @@ import glob
 from stat import S_ISDIR, S_ISREG
 
 import Functions.utilities as u
+from Functions.ssh_utils import pool, ensure_connection, get_folder_total_sizes_batched
+from Functions.sftp_utils import SFTPTransferEngine, TransferJournal
+from Functions.manifest_utils import get_remote_manifest, add_remote_hashes
 
 # Load configuration
 cfg = u.read_config()
 
-# Try to get the password from an environment variable (used on Tabei file uploads)
-pwd = os.getenv('SAVIO_DECRYPTION_PASSWORD')
+def get_pwd():
+    """
+    Returns the Savio decryption password, prompting for it on first use.
+    """
+    # Try to get the password from an environment variable (used on Tabei file uploads)
+    pwd = os.getenv('SAVIO_DECRYPTION_PASSWORD')
 
-if not pwd:
-    pwd = getpass.getpass("  Enter Savio decryption password: ")
-    u.get_savio_password(pwd)
-    os.environ['SAVIO_DECRYPTION_PASSWORD'] = pwd
+    if not pwd:
+        pwd = getpass.getpass("  Enter Savio decryption password: ")
+        u.get_savio_password(pwd)
+        os.environ['SAVIO_DECRYPTION_PASSWORD'] = pwd
+    return pwd
+
+
+def __getattr__(name):
+    # `Models.Savio.pwd` is resolved on first access instead of prompting at import time
+    if name == 'pwd':
+        return get_pwd()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Define the tqdm callback function
@@ -47,41 +62,11 @@ def tqdm_callback(t):
     return inner_callback
 
 
-# Decorator function to ensure connection for SavioClient methods
-# as I understand it only works for shell scripts
-def ensure_connection(host_type="shell", verbose=False):
-    def decorator(func):
-        def wrapper(self, *args, **kwargs):
-            _verbose = verbose  # Use the verbose setting provided to the decorator
-
-            was_connected = self.connected
-            should_reconnect = was_connected and self.host_type != host_type
-
-            if not was_connected or should_reconnect:
-                if was_connected and _verbose:
-                    print(f"Conflicting host type, closing {self.host_type}, and opening {host_type}")
-                    self.close()
-                self.connect(host_type)
-                self.connected = True
-            else:
-                if _verbose:
-                    print("Using existing connection...")
-
-            try:
-                return func(self, *args, **kwargs)
-            finally:
-                if not was_connected:
-                    self.close()
-                    self.connected = False
-        return wrapper
-    return decorator
-
-
 # Define the SavioClient class
 class SavioClient:
     def __init__(self):
         self.username = cfg['savio']['username']
-        self.ssh = SSHClient()
+        self.ssh = None
         self.sftp = None
         self.connected = False
         self.host_type = None
@@ -94,26 +79,27 @@ class SavioClient:
             hostname = 'dtn.brc.berkeley.edu'
         else:
             raise ValueError("Invalid host_type. Expected 'shell' or 'ftp'.")
-        print(f"opening Savio connection: {host_type}")
-        self.ssh.load_system_host_keys()
-        if not self.connected or self.host_type != host_type:
-            self._connect_ssh(hostname)
-            self.connected = True
-            self.host_type = host_type
 
-            if host_type == 'ftp':
-                self.sftp = self.ssh.open_sftp()
+        # One session per node (login node for shell, DTN for ftp), shared process-wide,
+        # so only a pool miss pays for the TOTP handshake
+        session = pool.acquire(hostname, self.username, lambda: self._connect_ssh(hostname, host_type))
+        self.ssh = session.ssh
+        self.sftp = session.get_sftp() if host_type == 'ftp' else None
+        self.connected = True
+        self.host_type = host_type
 
 
-    def _connect_ssh(self, hostname):
+    def _connect_ssh(self, hostname, host_type="shell"):
         max_attempts = 5
         attempts = 0
 
+        print(f"opening Savio connection: {host_type}")
+        ssh = SSHClient()
+        ssh.load_system_host_keys()
         while attempts < max_attempts:
             try:
-                self.ssh.connect(hostname=hostname, username=self.username, password=u.get_savio_password(pwd))
-                self.connected = True
-                return  # Successfully connected, exit the method
+                ssh.connect(hostname=hostname, username=self.username, password=u.get_savio_password(get_pwd()))
+                return ssh  # Successfully connected, exit the method
             except Exception as e:
                 attempts += 1
                 print(f"Failed to connect (Attempt {attempts}/{max_attempts}): {e}")
@@ -126,14 +112,14 @@ class SavioClient:
 
 
     def close(self):
-        if self.sftp and self.host_type == 'ftp':
-            self.sftp.close()
-            self.sftp = None
-
-        self.ssh.close()
+        """
+        Releases this client's reference to the pooled session. The underlying
+        connection stays open for reuse and is closed when the process exits.
+        """
+        self.ssh = None
+        self.sftp = None
         self.connected = False
         self.host_type = None
-        print("closed Savio connection")
 
 
 
@@ -200,6 +186,31 @@ class SavioClient:
             print(f"An error occurred during file upload: {e}")
             raise e
 
+    @ensure_connection('ftp')
+    def upload_files_parallel(self, file_paths, remote_paths, workers=None, journal=None):
+        """
+        Uploads files concurrently over multiple SFTP channels on the DTN connection.
+
+        :param file_paths: List of local file paths
+        :param remote_paths: List of remote file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).upload(file_paths, remote_paths, journal)
+
+    @ensure_connection('ftp')
+    def download_files_parallel(self, remote_paths, local_paths, workers=None, sizes=None, journal=None):
+        """
+        Downloads files concurrently over multiple SFTP channels on the DTN connection.
+
+        :param remote_paths: List of remote file paths
+        :param local_paths: List of local file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param sizes: Optional list of remote file sizes
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).download(remote_paths, local_paths, sizes, journal)
+
     @ensure_connection('ftp')
     def download_files_sftp(self, remote_paths, local_paths):
          # Check if remote_paths and local_paths are lists
@@ -220,21 +231,56 @@ class SavioClient:
             raise e
     
     @ensure_connection('ftp')
-    def download_folders_sftp(self, remote_dir_paths, local_dir_path):
+    def download_folders_sftp(self, remote_dir_paths, local_dir_path, parallel=True):
         """
         Recursively downloads multiple directories from the Savio server to a local destination.
 
         Args:
             remote_dir_paths (list): A list of remote directory paths on the Savio server.
             local_dir_path (str): The local base directory path where the folders will be downloaded.
+            parallel (bool): Download all files through the parallel transfer engine.
         """
         # Ensure the local base directory exists
         os.makedirs(local_dir_path, exist_ok=True)
 
+        if parallel:
+            remote_paths, local_paths, sizes = [], [], []
+            for remote_dir_path in remote_dir_paths:
+                local_sub_dir_path = os.path.join(local_dir_path, os.path.basename(remote_dir_path))
+                r, l, z = self._list_files_recursive(remote_dir_path, local_sub_dir_path)
+                remote_paths += r
+                local_paths += l
+                sizes += z
+            journal = TransferJournal.for_batch("download", os.path.abspath(local_dir_path))
+            self.download_files_parallel(remote_paths, local_paths, sizes=sizes, journal=journal)
+            return
+
         for remote_dir_path in remote_dir_paths:
             local_sub_dir_path = os.path.join(local_dir_path, os.path.basename(remote_dir_path))
             self.download_folder_sftp(remote_dir_path, local_sub_dir_path)
 
+    def _list_files_recursive(self, remote_dir_path, local_dir_path):
+        """
+        Lists all files below a remote directory together with their local destinations and sizes.
+
+        :return: Tuple of lists (remote_paths, local_paths, sizes)
+        """
+        os.makedirs(local_dir_path, exist_ok=True)
+        remote_paths, local_paths, sizes = [], [], []
+        for item in self.sftp.listdir_attr(remote_dir_path):
+            remote_item_path = os.path.join(remote_dir_path, item.filename)
+            local_item_path = os.path.join(local_dir_path, item.filename)
+            if S_ISDIR(item.st_mode):
+                r, l, z = self._list_files_recursive(remote_item_path, local_item_path)
+                remote_paths += r
+                local_paths += l
+                sizes += z
+            else:
+                remote_paths.append(remote_item_path)
+                local_paths.append(local_item_path)
+                sizes.append(item.st_size)
+        return remote_paths, local_paths, sizes
+
     @ensure_connection('ftp')
     def download_folder_sftp(self, remote_dir_path, local_dir_path):
         """
@@ -288,17 +334,34 @@ class SavioClient:
             raise e
 
 
+    @staticmethod
+    def list_folder_files(directory):
+        """
+        Returns the paths of all files below a local folder relative to it, subfolders included,
+        like the manifests of get_manifest.
+        """
+        relative_paths = []
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                relative_paths.append(os.path.relpath(os.path.join(dirpath, filename), directory))
+        return sorted(relative_paths)
+
+    def _upload_folder_files(self, local_directory, savio_directory):
+        relative_paths = self.list_folder_files(local_directory)
+        for remote_dir in sorted({os.path.dirname(os.path.join(savio_directory, p)) for p in relative_paths} | {savio_directory}):
+            self.makedirs(remote_dir)
+
+        file_paths = [os.path.join(local_directory, p) for p in relative_paths]
+        remote_paths = [os.path.join(savio_directory, p) for p in relative_paths]
+        self.upload_files_sftp(file_paths, remote_paths)
+
     def upload_image_folders_pattern(self, source_pattern, country):
         directories = glob.glob(source_pattern)
         for directory in directories:
             if os.path.isdir(directory):
                 folder_name = os.path.basename(directory.rstrip('/'))
                 full_dest_path = os.path.join(cfg['savio']['images_folder'], country, folder_name)
-                
-                file_paths = [os.path.join(directory, file) for file in os.listdir(directory)]
-                remote_paths = [os.path.join(full_dest_path, file) for file in os.listdir(directory)]
-
-                self.upload_files_sftp(file_paths, remote_paths)
+                self._upload_folder_files(directory, full_dest_path)
             else:
                 print(f"Skipping {directory}, not a directory.")
 
@@ -320,25 +383,52 @@ class SavioClient:
 
 
     @ensure_connection('ftp')
-    def upload_image_folders(self, directories, country):
+    def upload_image_folders(self, directories, country, parallel=True):
         """
-        Uploads image folders to Savio using the converted directory paths.
+        Uploads image folders to Savio using the converted directory paths, subfolders included.
 
         :param directories: List of Tabei directory paths
         :param country: Country name for the Savio directory structure
+        :param parallel: Upload all files through the parallel transfer engine
         """
         directory_mappings = self.convert_to_savio_folderpaths(directories, country)
 
+        if parallel:
+            file_paths, remote_paths = [], []
+            for local_directory, savio_directory in directory_mappings:
+                for relative_path in self.list_folder_files(local_directory):
+                    file_paths.append(os.path.join(local_directory, relative_path))
+                    remote_paths.append(os.path.join(savio_directory, relative_path))
+            self.upload_image_files(file_paths, country, remote_paths)
+            return
+
         for local_directory, savio_directory in directory_mappings:
-            # Ensure the remote directory exists
-            self.makedirs(savio_directory)
+            self._upload_folder_files(local_directory, savio_directory)
 
-            file_paths = [os.path.join(local_directory, file) for file in os.listdir(local_directory)]
-            remote_paths = [os.path.join(savio_directory, file) for file in os.listdir(local_directory)]
+        print("Upload complete.")
 
-            self.upload_files_sftp(file_paths, remote_paths)
+    @ensure_connection('ftp')
+    def upload_image_files(self, file_paths, country, remote_paths=None):
+        """
+        Uploads individual image files into their Savio image folders, e.g. the delta found by a manifest comparison.
 
-        print("Upload complete.")
+        :param file_paths: List of Tabei file paths
+        :param country: Country name for the Savio directory structure
+        :param remote_paths: Destination of every file (e.g. the pairs of the manifest delta, which keep subfolders),
+                             by default the file goes directly into the Savio folder of its Tabei folder
+        """
+        if remote_paths is None:
+            directories = sorted(set(os.path.dirname(fp) for fp in file_paths))
+            savio_directories = dict(self.convert_to_savio_folderpaths(directories, country))
+            remote_paths = [os.path.join(savio_directories[os.path.dirname(fp)], os.path.basename(fp)) for fp in file_paths]
+
+        for remote_dir in sorted(set(os.path.dirname(rp) for rp in remote_paths)):
+            # Ensure the remote directory exists
+            self.makedirs(remote_dir)
+
+        # the journal lets an interrupted upload resume where it stopped, also when the re-run sends fewer files
+        journal = TransferJournal.for_batch("upload", os.path.join(cfg['savio']['images_folder'], country))
+        self.upload_files_parallel(file_paths, remote_paths, journal=journal)
 
     @ensure_connection('ftp')
     def get_filepaths_in_folders(self, folder_paths):
@@ -375,28 +465,46 @@ class SavioClient:
                 print(f"An error occurred while accessing {folder_path}: {e}")
         return folder_sizes
 
-    @ensure_connection('shell', verbose=False)
-    def get_folder_total_sizes(self, folder_paths):
+    @ensure_connection('shell')
+    def get_manifest(self, folder_paths):
+        """
+        Returns path, size and mtime of every file in the specified folders (subfolders included), listed in one remote pass.
+
+        :param folder_paths: List of paths to the folders
+        :return: Dictionary where keys are folder paths and values are dictionaries {relative file path: {'size', 'mtime'}}
+        """
+        return get_remote_manifest(self.ssh, folder_paths)
+
+    @ensure_connection('ftp')
+    def add_hashes(self, manifest, hash_types=None):
+        """
+        Adds hashes (MD5 by default) to a manifest from get_manifest. The hashing runs on the DTN rather than the
+        login node, and files already hashed with the same size and mtime are taken from the local cache.
+
+        :param manifest: Manifest returned by get_manifest
+        :param hash_types: Dictionary {path: 'md5' or 'crc32c'} of the files to hash, see hashes_to_verify
+        :return: The manifest with an 'md5' (or 'crc32c') entry per hashed file
+        """
+        return add_remote_hashes(self.ssh, manifest, "savio", hash_types=hash_types)
+
+    @ensure_connection('shell')
+    def get_folder_total_sizes(self, folder_paths, concurrency=None, delay=None, exclude_directories=False):
         """
-        Returns the total file sizes for each specified folder by executing a command on the server.
+        Returns the total file sizes for each specified folder with `du -sb` per folder, batched into few remote shells.
+        Chunks are run one at a time with a short pause by default, to stay under the login node rate limits.
 
         :param folder_paths: List of paths to the folders
+        :param concurrency: Number of du commands run at the same time (defaults to savio.du_concurrency in config.yml)
+        :param delay: Seconds to pause after each du command (defaults to savio.du_delay in config.yml)
+        :param exclude_directories: Only count the files, see get_folder_total_sizes_batched
         :return: Dictionary where keys are folder paths and values are total sizes of the folders in bytes
         """
-        folder_total_sizes = {}
-        with tqdm(total=len(folder_paths), desc="Getting folder sizes", file=sys.stdout) as pbar:
-            for folder_path in folder_paths:
-                try:
-                    command = f"du -sb {folder_path} | cut -f1"
-                    output = self.execute_command(command)
-                    size = int(output.strip())  # Convert the output to an integer
-                    folder_total_sizes[folder_path] = size
-                except Exception as e:
-                    print(f"An error occurred while accessing {folder_path}: {e}")
-                finally:
-                    time.sleep(3)  # Sleep for 3 seconds
-                    pbar.update(1)  # Update progress for each processed folder path
-        return folder_total_sizes
+        if concurrency is None:
+            concurrency = cfg['savio'].get('du_concurrency', 1)
+        if delay is None:
+            delay = cfg['savio'].get('du_delay', 1)
+        return get_folder_total_sizes_batched(self.ssh, folder_paths, concurrency=concurrency, delay=delay,
+                                              exclude_directories=exclude_directories)
 
 
 if __name__ == "__main__":
@@ -32,16 +32,31 @@ import io
 import stat
 
 import Functions.utilities as u
+from Functions.ssh_utils import pool, ensure_connection, get_folder_total_sizes_batched
+from Functions.sftp_utils import SFTPTransferEngine
+from Functions.manifest_utils import get_remote_manifest, add_remote_hashes
 
 # Load configuration
 cfg = u.read_config()
 
-# Try to get the password from an environment variable (used on Tabei file uploads)
-pwd = os.getenv('TABEI_DECRYPTION_PASSWORD')
+def get_pwd():
+    """
+    Returns the Tabei decryption password, prompting for it on first use.
+    """
+    # Try to get the password from an environment variable (used on Tabei file uploads)
+    pwd = os.getenv('TABEI_DECRYPTION_PASSWORD')
 
-if not pwd:
-    pwd = getpass.getpass("  Enter Tabei decryption password: ")
-    os.environ['TABEI_DECRYPTION_PASSWORD'] = pwd
+    if not pwd:
+        pwd = getpass.getpass("  Enter Tabei decryption password: ")
+        os.environ['TABEI_DECRYPTION_PASSWORD'] = pwd
+    return pwd
+
+
+def __getattr__(name):
+    # `Models.Tabei.pwd` is resolved on first access instead of prompting at import time
+    if name == 'pwd':
+        return get_pwd()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Define the tqdm callback function
@@ -51,66 +66,38 @@ def tqdm_callback(t):
     return inner_callback
 
 
-# Decorator function to ensure connection for SavioClient methods
-# as I understand it only works for shell scripts
-def ensure_connection(host_type="shell", verbose=False):
-    def decorator(func):
-        def wrapper(self, *args, **kwargs):
-            _verbose = verbose  # Use the verbose setting provided to the decorator
-
-            was_connected = self.connected
-            should_reconnect = was_connected and self.host_type != host_type
-
-            if not was_connected or should_reconnect:
-                if was_connected and _verbose:
-                    print(f"Conflicting host type, closing {self.host_type}, and opening {host_type}")
-                    self.close()
-                self.connect(host_type)
-                self.connected = True
-            else:
-                if _verbose:
-                    print("Using existing connection...")
-
-            try:
-                return func(self, *args, **kwargs)
-            finally:
-                if not was_connected:
-                    self.close()
-                    self.connected = False
-        return wrapper
-    return decorator
-
-
 class TabeiClient:
     def __init__(self):
         self.username = cfg['tabei']['username']
         self.ssh_key_path = cfg['tabei']['key_path']
-        self.ssh = SSHClient()
+        self.ssh = None
         self.sftp = None
         self.connected = False
         self.host_type = None
 
     def connect(self, host_type="shell"):
-        print("Opening Tabei connection")
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        if not self.connected or self.host_type != host_type:
-            self._connect_ssh()
-            self.connected = True
-            self.host_type = host_type
-            if host_type == 'ftp':
-                self.sftp = self.ssh.open_sftp()
+        # sessions are shared process-wide, a new connection is only opened on a pool miss
+        hostname = "tabei.gspp.berkeley.edu"
+        # shell and ftp share one transport, only the SFTP channel is opened on demand
+        session = pool.acquire(hostname, self.username, self._connect_ssh)
+        self.ssh = session.ssh
+        self.sftp = session.get_sftp() if host_type == 'ftp' else session.sftp
+        self.connected = True
+        self.host_type = host_type
 
     def _connect_ssh(self):
         max_attempts = 5
         attempts = 0
+        print("Opening Tabei connection")
+        ssh = SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         while attempts < max_attempts:
             try:
-                self.ssh.connect(hostname="tabei.gspp.berkeley.edu", 
+                ssh.connect(hostname="tabei.gspp.berkeley.edu", 
                                  username=self.username, 
                                  key_filename=self.ssh_key_path, 
-                                 passphrase=pwd)
-                self.connected = True
-                return
+                                 passphrase=get_pwd())
+                return ssh
             except Exception as e:
                 attempts += 1
                 print(f"Failed to connect (Attempt {attempts}/{max_attempts}): {e}")
@@ -122,14 +109,14 @@ class TabeiClient:
                     raise
 
     def close(self):
-        if self.sftp and self.host_type == 'ftp':
-            self.sftp.close()
-            self.sftp = None
-
-        self.ssh.close()
+        """
+        Releases this client's reference to the pooled session. The underlying
+        connection stays open for reuse and is closed when the process exits.
+        """
+        self.ssh = None
+        self.sftp = None
         self.connected = False
         self.host_type = None
-        print("closed Tabei connection")
 
 
 
@@ -219,6 +206,31 @@ class TabeiClient:
                 pbar.update(1)
         return filepaths
 
+    @ensure_connection('ftp')
+    def upload_files_parallel(self, file_paths, remote_paths, workers=None, journal=None):
+        """
+        Uploads files concurrently over multiple SFTP channels.
+
+        :param file_paths: List of local file paths
+        :param remote_paths: List of remote file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).upload(file_paths, remote_paths, journal)
+
+    @ensure_connection('ftp')
+    def download_files_parallel(self, remote_paths, local_paths, workers=None, sizes=None, journal=None):
+        """
+        Downloads files concurrently over multiple SFTP channels.
+
+        :param remote_paths: List of remote file paths
+        :param local_paths: List of local file paths
+        :param workers: Number of concurrent channels (defaults to sftp.workers in config.yml)
+        :param sizes: Optional list of remote file sizes
+        :param journal: Optional TransferJournal used to resume an interrupted batch
+        """
+        SFTPTransferEngine(self.ssh, workers).download(remote_paths, local_paths, sizes, journal)
+
     @ensure_connection('ftp')
     def download_files_sftp(self, remote_paths, local_paths):
         try:
@@ -295,28 +307,45 @@ class TabeiClient:
         return folder_sizes
 
 
-    @ensure_connection('shell', False)
-    def get_folder_total_sizes(self, folder_paths):
+    @ensure_connection('shell')
+    def get_manifest(self, folder_paths):
+        """
+        Returns path, size and mtime of every file in the specified folders (subfolders included), listed in one remote pass.
+
+        :param folder_paths: List of paths to the folders
+        :return: Dictionary where keys are folder paths and values are dictionaries {relative file path: {'size', 'mtime'}}
+        """
+        return get_remote_manifest(self.ssh, folder_paths)
+
+    @ensure_connection('shell')
+    def add_hashes(self, manifest, hash_types=None):
+        """
+        Adds hashes (MD5 by default) to a manifest from get_manifest. Files already hashed with the same
+        size and mtime are taken from the local cache.
+
+        :param manifest: Manifest returned by get_manifest
+        :param hash_types: Dictionary {path: 'md5' or 'crc32c'} of the files to hash, see hashes_to_verify
+        :return: The manifest with an 'md5' (or 'crc32c') entry per hashed file
+        """
+        return add_remote_hashes(self.ssh, manifest, "tabei", hash_types=hash_types)
+
+    @ensure_connection('shell')
+    def get_folder_total_sizes(self, folder_paths, concurrency=None, delay=None, exclude_directories=False):
         """
-        Returns the total file sizes for each specified folder by executing a command on the server.
+        Returns the total file sizes for each specified folder with `du -sb` per folder, batched into few remote shells.
 
         :param folder_paths: List of paths to the folders
+        :param concurrency: Number of du commands run at the same time (defaults to tabei.du_concurrency in config.yml)
+        :param delay: Seconds to pause after each du command (defaults to tabei.du_delay in config.yml)
+        :param exclude_directories: Only count the files, see get_folder_total_sizes_batched
         :return: Dictionary where keys are folder paths and values are total sizes of the folders in bytes
         """
-        folder_total_sizes = {}
-        with tqdm(total=len(folder_paths), desc="Getting folder sizes", file=sys.stdout) as pbar:
-            for folder_path in folder_paths:
-                try:
-                    command = f"du -sb {folder_path} | cut -f1"
-                    output = self.execute_command(command)
-                    size = int(output.strip())  # Convert the output to an integer
-                    folder_total_sizes[folder_path] = size
-                except Exception as e:
-                    print(f"An error occurred while accessing {folder_path}: {e}")
-                finally:
-                    time.sleep(3)  # Include the sleep as per your requirement
-                    pbar.update(1)  # Update progress for each processed folder path
-        return folder_total_sizes
+        if concurrency is None:
+            concurrency = cfg['tabei'].get('du_concurrency', 4)
+        if delay is None:
+            delay = cfg['tabei'].get('du_delay', 0)
+        return get_folder_total_sizes_batched(self.ssh, folder_paths, concurrency=concurrency, delay=delay,
+                                              exclude_directories=exclude_directories)
     
         
     @ensure_connection('shell')
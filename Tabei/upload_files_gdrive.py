@@ -34,11 +34,10 @@ def upload_file(fps, destination_folder):
 
     drive = GoogleDriveService("personal_account")
 
-    for fp in fps:
-        filename = os.path.basename(fp)
-
-        # now upload the archive the the images_folder
-        drive.upload_file(filename, fp, "application/zip", destination_folder)
+    # upload the archives to the destination folder, several at a time and resumable after a crash
+    files = [{'file_path': fp, 'folder_id': destination_folder, 'file_name': os.path.basename(fp), 'mime_type': "application/zip"}
+             for fp in fps]
+    return drive.upload_files(files)
 
 
 if __name__ == "__main__":
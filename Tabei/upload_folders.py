@@ -42,7 +42,8 @@ def upload_to_bucket(directories, country):
             full_dest_path = os.path.join(bucket_images, country, folder_name)
             print(f"Uploading {directory} to {full_dest_path}...")
             # subprocess.run(["gcloud", "storage", "cp", directory, full_dest_path, "--recursive"])
-            subprocess.run(["gsutil", "-m", "cp", "-r", directory, full_dest_path])
+            # check=True: a failed copy must exit non-zero, so that the status is not set to Done
+            subprocess.run(["gsutil", "-m", "cp", "-r", directory, full_dest_path], check=True)
         else:
             print(f"Skipping {directory}, not a directory.")
 
@@ -50,24 +51,76 @@ def upload_to_bucket(directories, country):
 
 
 
-def main(paths, country, destination):
+def upload_files_to_bucket(file_paths, country, workers=None, destination_paths=None):
+    bucket_images = cfg['bucket']['images'].strip('/')
+
+    if destination_paths is None:
+        destination_paths = [os.path.join(bucket_images, country, os.path.basename(os.path.dirname(fp)), os.path.basename(fp))
+                             for fp in file_paths]
+
+    # group the files by destination folder (subfolders included), so that each folder is a single parallel gsutil copy
+    folders = {}
+    for fp, destination_fp in zip(file_paths, destination_paths):
+        folders.setdefault(os.path.dirname(destination_fp), []).append(fp)
+
+    gsutil = ["gsutil"]
+    if workers:
+        gsutil += ["-o", f"GSUtil:parallel_thread_count={workers}"]
+
+    for destination_dir, fps in folders.items():
+        full_dest_path = destination_dir + "/"
+        print(f"Uploading {len(fps)} files to {full_dest_path}...")
+        # check=True: a failed copy must exit non-zero, so that the status is not set to Done
+        subprocess.run(gsutil + ["-m", "cp", "-I", full_dest_path], input="\n".join(fps), text=True, check=True)
+
+    print("Upload complete.")
+
+
+def read_files_list(files_list):
+    """
+    Reads an upload list of write_upload_list: "<source>\t<destination>" per line, or only the source path.
+
+    :return: Tuple (source paths, destination paths or None when the list has no destinations)
+    """
+    with open(files_list, 'r') as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    pairs = [line.split('\t', 1) for line in lines]
+    if all(len(pair) == 2 for pair in pairs):
+        return [source for source, _ in pairs], [destination for _, destination in pairs]
+    return [line.strip() for line in lines], None
+
+
+def main(paths, country, destination, files_list=None, workers=None):
+    file_paths, destination_paths = read_files_list(files_list) if files_list else (None, None)
+
     if destination.lower() == "savio":
         s = SavioClient()
-        s.upload_image_folders(paths, country)
+        if file_paths is not None:
+            s.upload_image_files(file_paths, country, destination_paths)
+        else:
+            s.upload_image_folders(paths, country)
 
     elif destination.lower() == "bucket":
-        upload_to_bucket(paths, country)
+        if file_paths is not None:
+            upload_files_to_bucket(file_paths, country, workers, destination_paths)
+        else:
+            upload_to_bucket(paths, country)
         
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Upload directories to Savio")
-    parser.add_argument('--paths', nargs='+', help='List of folder paths to upload', required=True)
+    parser.add_argument('--paths', nargs='+', help='List of folder paths to upload')
+    parser.add_argument('--files_list', type=str, help='Text file with one file path per line to upload, instead of whole folders')
     parser.add_argument('--country', type=str, help='Country name for the destination path', required=True)
     parser.add_argument('--destination', type=str, help='Savio or Bucket', required=True)
+    parser.add_argument('--workers', type=int, help='Number of parallel upload threads for the bucket', default=None)
 
     args = parser.parse_args()
 
-    main(args.paths, args.country, args.destination)
+    if not args.paths and not args.files_list:
+        parser.error("Either --paths or --files_list is required")
+
+    main(args.paths, args.country, args.destination, args.files_list, args.workers)
 
 
 
@@ -22,7 +22,7 @@ from Models.GoogleDrive import ConfigSheet, StatusSheet, Status
 from Functions.contract_utils import generate_default_config_data, export_config_file
 import Functions.utilities as u
 from Functions.shell_utils import generate_shell_script
-from Models.Savio import SavioClient, pwd
+from Models.Savio import SavioClient, get_pwd
 from Models.Tabei import TabeiClient
 from Models.GoogleVM import VMClient
 from Models.GoogleBucket import GoogleBucket
@@ -31,8 +31,6 @@ from tqdm import tqdm
 import time
 import re
 import collections
-import pandas as pd
-import geopandas as gpd
 
 
 
@@ -41,6 +39,7 @@ from Local.download_thumbnails import tabei_create_thumbnails_contract, download
 
 
 cfg = u.read_config()
+# Creating the sheets is cheap: authentication and the first fetch happen on first use
 config_db = ConfigSheet(cfg['google_drive']['config_files']['id'], "config")
 status_db = StatusSheet(cfg['google_drive']['config_files']['id'], "status")
 
@@ -80,8 +79,9 @@ def upload_images(country, contract_alias, contract, contract_status):
 
             folders = contract.df.path.to_list()
 
+            verify_hashes = cfg.get('verification', {}).get('hashes', False)
             t.connect('shell')
-            upload_status = upload_images_savio(contract_alias, folders, country, pwd, t, s)
+            upload_status = upload_images_savio(contract_alias, folders, country, get_pwd(), t, s, verify_hashes)
             t.close()
 
         elif contract_status.machine == "google_vm":
@@ -90,8 +90,9 @@ def upload_images(country, contract_alias, contract, contract_status):
   
             folders = contract.df.path.to_list()
             workers = cfg['bucket'].get("workers", 1)
+            verify_hashes = cfg.get('verification', {}).get('hashes', False)
             t.connect('shell')
-            upload_status = upload_images_bucket(contract_alias, folders, country, pwd, t, b, workers)
+            upload_status = upload_images_bucket(contract_alias, folders, country, get_pwd(), t, b, workers, verify_hashes)
             t.close()
 
         if upload_status != "Complete":
@@ -108,8 +109,7 @@ def create_symlinks(contract_alias, country, contract, contract_status):
     machine = status['machine']
     contract_cfg = config_db.get_config(contract_alias, machine)
 
-    symlink_setting = contract_cfg.get('symlink', None)
-    symlink_active = symlink_setting not in ["", None, False, "false"]
+    symlink_active = contract_cfg.symlink_active
 
     if (not symlink_active) or (symlink_active and status['symlinks'] == "Done"):
         return True
@@ -167,8 +167,7 @@ def regex_test(contract_alias, country, contract, contract_status):
     status = contract_status.data
     machine = status['machine']
     contract_cfg = config_db.get_config(contract_alias, machine)
-    symlink_setting = contract_cfg.get('symlink', None)
-    symlink_active = symlink_setting not in ["", None, False, "false"]
+    symlink_active = contract_cfg.symlink_active
 
 
     if contract_status.data['regex_test'] != "Done":
@@ -184,7 +183,6 @@ def regex_test(contract_alias, country, contract, contract_status):
         fps = t.get_filepaths_in_folders(folders)
 
         # check for a custom regex pattern in the config sheet
-        contract_cfg = config_db.get_config(contract_alias, machine)
         regex_pattern = '^(?P<prefix>.*)_(?P<idx0>.*)_(?P<idx1>.*).(jpg|tif)'
         if "collection_regex" in contract_cfg.keys():
             if contract_cfg['collection_regex'] != None:
@@ -252,8 +250,7 @@ def create_and_download_thumbnails(contract_status, country, contract):
     contract_alias = status['contract_name']
 
     contract_cfg = config_db.get_config(contract_alias, machine)    
-    symlink_setting = contract_cfg.get('symlink', None)
-    symlink_active = symlink_setting not in ["", None, False, "false"]
+    symlink_active = contract_cfg.symlink_active
 
     if not symlink_active:
         tabei_folders = contract.df.path.to_list()
@@ -585,6 +582,7 @@ def download_img_df(contract_status):
         b.download_files_from_bucket([remote_fp], local_results_folder)
 
     # create an excel version of the image df
+    import geopandas as gpd  # only needed here, and slow to import
     img_df = gpd.read_file(local_fp)
     img_df_fp = os.path.join(cfg['local']['results'], contract_status.country, contract_alias, "img_df.xlsx")
     img_df.to_excel(img_df_fp, index=False)
@@ -755,11 +753,7 @@ def new_neighbors(contract_status, stage, required_stage):
         raise RuntimeError(f"You need to finish the {required_stage} stage")
     if status[stage] != "Done":
         # parse the keep_clusters from the config file
-        contract_config = config_db.get_config(contract_alias, machine)
-        try:
-            cluster_ids = [int(x.strip()) for x in contract_config['keep_clusters'].split(",")]
-        except:
-            raise ValueError("Cluster ids in config sheet 'keep_clusters' is not correctly specified. Make sure it is a comma separated string of integers, indicating clusters to keep")
+        cluster_ids = config_db.get_config(contract_alias, machine).keep_clusters
         
         if machine == "savio":
             s = SavioClient()
@@ -789,11 +783,7 @@ def export_for_georeferencing(contract_status):
 
     if status['export_georef'] != "Done":
         # parse the keep_clusters from the config file
-        contract_config = config_db.get_config(contract_alias, machine)
-        try:
-            cluster_ids = [int(x.strip()) for x in contract_config['keep_clusters'].split(",")]
-        except:
-            raise ValueError("Cluster ids in config sheet 'keep_clusters' is not correctly specified. Make sure it is a comma separated string of integers, indicating clusters to keep")
+        cluster_ids = config_db.get_config(contract_alias, machine).keep_clusters
         
         if machine == "savio":
             s = SavioClient()
@@ -970,8 +960,7 @@ def export_georeferencing(contract_code, country, machine, contract_alias=None,
     status = contract_status.data
     machine = status['machine']
     contract_cfg = config_db.get_config(contract_alias, machine)
-    symlink_setting = contract_cfg.get('symlink', None)
-    symlink_active = symlink_setting not in ["", None, False, "false"]
+    symlink_active = contract_cfg.symlink_active
 
     if status['prepare_swaths'] != "Done":
         raise RuntimeError(f"You need to finish the prepare_swaths stage")
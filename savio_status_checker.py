@@ -1,4 +1,4 @@
-from Models.Savio import SavioClient, pwd
+from Models.Savio import SavioClient
 import json
 import os
 import pandas as pd